@@ -1,3 +1,7 @@
-from .state import State, ArtifactGroupType
+from .state import State, StateDiff, ArtifactDiff, ArtifactGroupType
 from .client import Client, StateContext, ConnectionWarnings
 from . import data
+from . import merge
+from . import history
+from . import metrics
+from . import aggregate
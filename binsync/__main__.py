@@ -0,0 +1,81 @@
+import argparse
+import json
+import logging
+import sys
+
+from .common.headless import HeadlessController
+from .metrics import REGISTRY
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m binsync",
+        description="Run BinSync without a decompiler.",
+    )
+    parser.add_argument("--repo", required=True, help="path to the local binsync repo")
+    parser.add_argument("--user", required=True, help="the user to connect as")
+    binary = parser.add_mutually_exclusive_group(required=True)
+    binary.add_argument("--binary", help="path to the binary the repo is about")
+    binary.add_argument("--binary-hash", help="md5 hash of the binary the repo is about")
+    parser.add_argument("--init", action="store_true", help="create the repo if it does not exist")
+    parser.add_argument("--remote", help="url of the remote to clone the repo from")
+    parser.add_argument("--metrics-file", help="write metrics in the Prometheus text format to this file")
+    parser.add_argument("-v", "--verbose", action="store_true")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("serve", help="run the sync loop until interrupted")
+
+    dump = commands.add_parser("dump", help="dump the states of all users as JSON lines")
+    dump.add_argument("-o", "--output", help="file to write to, stdout by default")
+    dump.add_argument("--users", nargs="+", help="only dump these users")
+
+    imp = commands.add_parser("import", help="import artifacts from JSON into the local state in one commit")
+    imp.add_argument("input", help="JSON or JSON lines file, - for stdin")
+    imp.add_argument("-m", "--message", default="Bulk Import", help="commit message")
+
+    commands.add_parser("stats", help="print artifact counts of every user")
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    controller = HeadlessController(binary_path=args.binary, binary_hash=args.binary_hash)
+    warnings = controller.connect(
+        args.user, args.repo, init_repo=args.init, remote_url=args.remote, metrics_path=args.metrics_file
+    )
+    for warning in warnings:
+        logging.getLogger("binsync").warning("Connection warning: %s", warning)
+
+    try:
+        if args.command == "serve":
+            controller.serve()
+        elif args.command == "dump":
+            if args.output:
+                with open(args.output, "w") as fp:
+                    count = controller.dump_jsonl(fp, users=args.users)
+            else:
+                count = controller.dump_jsonl(sys.stdout, users=args.users)
+            print(f"Dumped {count} artifacts.", file=sys.stderr)
+        elif args.command == "import":
+            if args.input == "-":
+                count = controller.import_json(sys.stdin, msg=args.message)
+            else:
+                with open(args.input, "r") as fp:
+                    count = controller.import_json(fp, msg=args.message)
+            print(f"Imported {count} artifacts.", file=sys.stderr)
+        elif args.command == "stats":
+            print(json.dumps(controller.stats(), indent=2, sort_keys=True, default=str))
+    finally:
+        if args.metrics_file:
+            REGISTRY.write_prometheus(args.metrics_file)
+        controller.client.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
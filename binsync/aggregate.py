@@ -0,0 +1,337 @@
+import os
+import threading
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import git
+
+from .state import State, ArtifactGroupType
+from .indexes import SearchIndex
+
+
+class ArtifactSummary:
+    """
+    What every user has for a single function, struct or comment. Only users that changed the artifact
+    are part of a summary.
+
+    :ivar key:          Address of the function or comment, or name of the struct
+    :ivar dict users:   (name, last_change) of the artifact, by user name. The name of a comment is its text.
+    """
+
+    __slots__ = ("key", "users")
+
+    def __init__(self, key, users=None):
+        self.key = key
+        self.users = users or {}  # type: Dict[str, Tuple[str, int]]
+
+    def __repr__(self):
+        return f"<ArtifactSummary {self.key}: {len(self.users)} users>"
+
+    @property
+    def latest_user(self) -> Optional[str]:
+        if not self.users:
+            return None
+
+        return max(self.users, key=lambda user: self.users[user][1])
+
+    @property
+    def latest_change(self) -> Optional[int]:
+        user = self.latest_user
+        return self.users[user][1] if user is not None else None
+
+    @property
+    def name(self) -> Optional[str]:
+        user = self.latest_user
+        return self.users[user][0] if user is not None else None
+
+    def names(self) -> Dict[str, str]:
+        return {user: name for user, (name, _) in self.users.items()}
+
+
+class UserSummary:
+    """
+    The latest activity of a user.
+
+    :ivar str user:             The user name
+    :ivar recent_function:      Address of the function the user changed last, None if there is none
+    :ivar int last_change:      Time of that change, or the last push of the user when there is none
+    """
+
+    __slots__ = ("user", "recent_function", "last_change")
+
+    def __init__(self, user, recent_function=None, last_change=None):
+        self.user = user
+        self.recent_function = recent_function
+        self.last_change = last_change
+
+
+class AggregateChanges:
+    """
+    What a refresh of the AggregateIndex changed.
+
+    :ivar dict keys:    The keys of summaries that changed, by ArtifactGroupType
+    :ivar set users:    Users whose summary changed
+    """
+
+    __slots__ = ("keys", "users")
+
+    def __init__(self):
+        self.keys = {a_type: set() for a_type in AggregateIndex.ARTIFACT_TYPES}  # type: Dict[int, Set]
+        self.users = set()  # type: Set[str]
+
+    def __bool__(self):
+        return bool(self.users) or any(self.keys.values())
+
+    @property
+    def functions(self) -> Set[int]:
+        return self.keys[ArtifactGroupType.FUNCTION]
+
+    @property
+    def structs(self) -> Set[str]:
+        return self.keys[ArtifactGroupType.STRUCT]
+
+    @property
+    def comments(self) -> Set[int]:
+        return self.keys[ArtifactGroupType.COMMENT]
+
+
+class SearchResults:
+    """
+    What matched a search of the AggregateIndex.
+
+    :ivar set functions:    Addresses of functions whose address, names or users matched, or that hold a
+                            comment that matched
+    :ivar set structs:      Names of structs whose names or users matched
+    :ivar set users:        Users whose name matched
+    """
+
+    __slots__ = ("functions", "structs", "users")
+
+    def __init__(self):
+        self.functions = set()  # type: Set[int]
+        self.structs = set()  # type: Set[str]
+        self.users = set()  # type: Set[str]
+
+    def __len__(self):
+        return len(self.functions) + len(self.structs) + len(self.users)
+
+
+class AggregateIndex:
+    """
+    A summary of every user's functions, structs and comments in one place: per artifact the name and
+    last change of every user, and per user their latest activity. The control panel tables, context
+    menus and search all read from it instead of going through every user's state on their own.
+
+    The index remembers the commit it last indexed for every user. A refresh only looks at the users
+    whose branch moved, and of those only at the files that differ between the two commits, so its cost
+    is proportional to what changed since the last refresh. The search index is kept up to date along
+    with the summaries.
+    """
+
+    ARTIFACT_TYPES = (ArtifactGroupType.FUNCTION, ArtifactGroupType.STRUCT, ArtifactGroupType.COMMENT)
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._commits = {}  # type: Dict[str, git.Commit]
+        self._summaries = {a_type: {} for a_type in self.ARTIFACT_TYPES}  # type: Dict[int, Dict]
+        self._users = {}  # type: Dict[str, UserSummary]
+        # the function of every comment, for finding functions by their comments
+        self._comment_functions = {}  # type: Dict[int, int]
+        self.search_index = SearchIndex()
+
+    #
+    # Queries
+    #
+
+    def summary(self, artifact_type, key) -> Optional[ArtifactSummary]:
+        with self._lock:
+            return self._summaries[artifact_type].get(key, None)
+
+    def summaries(self, artifact_type) -> Dict:
+        """
+        A copy of every summary of an artifact type, by key.
+        """
+        with self._lock:
+            return dict(self._summaries[artifact_type])
+
+    def user_summary(self, user) -> Optional[UserSummary]:
+        with self._lock:
+            return self._users.get(user, None)
+
+    def user_summaries(self) -> Dict[str, UserSummary]:
+        with self._lock:
+            return dict(self._users)
+
+    def users_of(self, artifact_type, key) -> Iterable[str]:
+        """
+        Users that changed an artifact.
+        """
+        summary = self.summary(artifact_type, key)
+        return list(summary.users) if summary is not None else []
+
+    def indexed_commit(self, user) -> Optional[git.Commit]:
+        return self._commits.get(user, None)
+
+    def search(self, query: str) -> SearchResults:
+        """
+        Finds the functions, structs and users matching @query: a case-insensitive substring of an
+        address (in hex), a name any user gave an artifact, a user name or a comment. Searching does not
+        wait for a refresh in progress.
+        """
+        results = SearchResults()
+        for artifact_type, key in self.search_index.search(query):
+            if artifact_type == ArtifactGroupType.FUNCTION:
+                results.functions.add(key)
+            elif artifact_type == ArtifactGroupType.STRUCT:
+                results.structs.add(key)
+            else:
+                func_addr = self._comment_functions.get(key, None)
+                if func_addr is not None:
+                    results.functions.add(func_addr)
+
+        query = query.lower().strip()
+        if query:
+            results.users = {user for user in list(self._users) if query in user.lower()}
+
+        return results
+
+    #
+    # Indexing
+    #
+
+    def refresh(self, client) -> AggregateChanges:
+        """
+        Catches the index up with the current branch of every user.
+        """
+        changes = AggregateChanges()
+        with client.commit_lock:
+            user_refs = client.user_refs()
+            head_commits = {user: ref.commit for user, ref in user_refs.items()}
+
+        with self._lock:
+            for user in list(self._commits):
+                if user not in head_commits:
+                    self._forget_user(user, changes)
+
+            for user, commit in head_commits.items():
+                old_commit = self._commits.get(user, None)
+                if old_commit is not None and old_commit.hexsha == commit.hexsha:
+                    continue
+
+                state = client.get_state_at(user=user, commit=commit)
+                if state is None:
+                    self._forget_user(user, changes)
+                    continue
+
+                if old_commit is None:
+                    keys = {a_type: set(state._storage_container(a_type)) for a_type in self.ARTIFACT_TYPES}
+                else:
+                    keys = self._changed_keys(old_commit, commit)
+                    if keys[ArtifactGroupType.COMMENT] is None:
+                        # all comments are in a single file, find the ones that changed
+                        old_state = client.get_state_at(user=user, commit=old_commit)
+                        keys[ArtifactGroupType.COMMENT] = set(state.comments) if old_state is None else \
+                            set(old_state.diff(state, artifact_types=[ArtifactGroupType.COMMENT]).comments.keys())
+
+                self._index_user(user, state, keys, changes)
+                self._commits[user] = commit
+
+        return changes
+
+    def _index_user(self, user, state: State, keys: Dict[int, Set], changes: AggregateChanges):
+        for artifact_type, type_keys in keys.items():
+            container = state._storage_container(artifact_type)
+            for key in type_keys:
+                artifact = container.get(key, None)
+                entry = None
+                if artifact is not None and artifact.last_change:
+                    if artifact_type == ArtifactGroupType.COMMENT:
+                        entry = (artifact.comment or "", artifact.last_change)
+                        if artifact.func_addr is not None:
+                            self._comment_functions[key] = artifact.func_addr
+                    else:
+                        entry = (artifact.name or "", artifact.last_change)
+
+                if self._set_entry(artifact_type, key, user, entry):
+                    changes.keys[artifact_type].add(key)
+
+        recent = state.recent(1, artifact_type=ArtifactGroupType.FUNCTION)
+        if recent:
+            _, recent_function, last_change = recent[0]
+        else:
+            recent_function, last_change = None, state.last_push_time
+
+        old_summary = self._users.get(user, None)
+        if old_summary is None or (old_summary.recent_function, old_summary.last_change) != (recent_function, last_change):
+            self._users[user] = UserSummary(user, recent_function, last_change)
+            changes.users.add(user)
+
+    def _set_entry(self, artifact_type, key, user, entry: Optional[Tuple[str, int]]) -> bool:
+        """
+        Sets (or with None removes) the entry of @user in a summary. Summaries are replaced rather than
+        changed, so one handed out by a query never changes under the reader.
+        """
+        summaries = self._summaries[artifact_type]
+        summary = summaries.get(key, None)
+        users = summary.users if summary is not None else {}
+        if users.get(user, None) == entry:
+            return False
+
+        users = dict(users)
+        if entry is None:
+            del users[user]
+        else:
+            users[user] = entry
+
+        if users:
+            summary = summaries[key] = ArtifactSummary(key, users)
+            self._index_search(artifact_type, summary)
+        else:
+            del summaries[key]
+            self.search_index.remove((artifact_type, key))
+            if artifact_type == ArtifactGroupType.COMMENT:
+                self._comment_functions.pop(key, None)
+
+        return True
+
+    def _index_search(self, artifact_type, summary: ArtifactSummary):
+        texts = list(summary.names().values())
+        if artifact_type == ArtifactGroupType.STRUCT:
+            texts.append(summary.key)
+        else:
+            texts.append(hex(summary.key))
+
+        # comments are found by their text only, searching a user should not match every comment
+        if artifact_type != ArtifactGroupType.COMMENT:
+            texts.extend(summary.users)
+
+        self.search_index.set((artifact_type, summary.key), texts)
+
+    @staticmethod
+    def _changed_keys(old_commit: git.Commit, commit: git.Commit) -> Dict[int, Optional[Set]]:
+        """
+        The keys of the functions and structs whose files differ between two commits. Comments are all
+        stored in one file, their keys are None if it differs.
+        """
+        keys = {a_type: set() for a_type in AggregateIndex.ARTIFACT_TYPES}
+        for diff in old_commit.tree.diff(commit.tree):
+            for path in {p for p in (diff.a_path, diff.b_path) if p}:
+                name = os.path.splitext(os.path.basename(path))[0]
+                if path.startswith("functions"):
+                    # the name of a function file is its address
+                    keys[ArtifactGroupType.FUNCTION].add(int(name, 16))
+                elif path.startswith("structs"):
+                    keys[ArtifactGroupType.STRUCT].add(name)
+                elif path == "comments.toml":
+                    keys[ArtifactGroupType.COMMENT] = None
+
+        return keys
+
+    def _forget_user(self, user, changes: AggregateChanges):
+        for artifact_type, summaries in self._summaries.items():
+            for key in [key for key, summary in summaries.items() if user in summary.users]:
+                self._set_entry(artifact_type, key, user, None)
+                changes.keys[artifact_type].add(key)
+
+        if self._users.pop(user, None) is not None:
+            changes.users.add(user)
+        self._commits.pop(user, None)
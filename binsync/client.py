@@ -1,18 +1,24 @@
 import time
 import threading
+import contextlib
 import os
 import subprocess
 import re
 import datetime
 import logging
 import typing
+from collections import OrderedDict
 
 import git
 import git.exc
 import filelock
 
-from .data import User, Function, Struct, Patch
+from .data import User, Function, Struct, Patch, STRING_TABLE
 from .state import State
+from .merge import Merge
+from .history import ArtifactHistory, HistoryEntry
+from .metrics import REGISTRY
+from .profiling import profiled
 from .errors import MetadataNotFoundError, ExternalUserCommitError
 
 _l = logging.getLogger(name=__name__)
@@ -62,7 +68,8 @@ class Client(object):
         init_repo=False,
         remote_url=None,
         ssh_agent_pid=None,
-        ssh_auth_sock=None
+        ssh_auth_sock=None,
+        metrics_path=None,
     ):
         """
         :param str master_user:     The username of the current user
@@ -74,6 +81,8 @@ class Client(object):
         :param remote_url:
         :param ssh_agent_pid:
         :param ssh_auth_sock:
+        :param str metrics_path:    If set, a file the metrics are written to in the Prometheus text format
+                                    after every update
         """
         self.master_user = master_user
         self.repo_root = repo_root
@@ -81,6 +90,8 @@ class Client(object):
         self.remote = remote
         self.repo = None
         self.repo_lock = None
+        # held by every git operation that moves HEAD or writes the index, and while reading git objects
+        self.commit_lock = threading.Lock()
 
         if master_user.endswith('/') or '__root__' in master_user:
             raise Exception(f"Bad username: {master_user}")
@@ -88,6 +99,7 @@ class Client(object):
         # ssh-agent info
         self.ssh_agent_pid = ssh_agent_pid  # type: int
         self.ssh_auth_sock = ssh_auth_sock  # type: str
+        self.metrics_path = metrics_path  # type: typing.Optional[str]
         self.connection_warnings = []
 
         # three scenarios
@@ -155,27 +167,42 @@ class Client(object):
         self._last_commit_ts = 0
 
         self.state = None
-        self.commit_lock = threading.Lock()
+
+        # commit hexsha -> (committed_date, read-only State), the starting points of historical reads. Read
+        # from the UI, prefetch and sync threads, so only accessed while holding _checkpoints_lock.
+        self._checkpoints = OrderedDict()  # type: OrderedDict[str, typing.Tuple[int, State]]
+        self._checkpoints_lock = threading.Lock()
+        self.max_checkpoints = 32
+
+        # change history of every artifact, a local cache kept next to the repo's own data
+        self.history = ArtifactHistory(os.path.join(self.repo.git_dir, ArtifactHistory.FILENAME))
+
+        # commits are deferred while a transaction is open
+        self._transaction_lock = threading.RLock()
+        self._transaction_depth = 0
+        self._commit_deferred = False
 
     def init_remote(self):
         """
         Init PyGits view of remote references in a repo.
         """
-        # get all remote branches
-        try:
-            branches = self.repo.remote().refs
-        except ValueError:
-            return
+        # checking out the tracking branches moves HEAD, which must not happen during a commit
+        with self.commit_lock:
+            # get all remote branches
+            try:
+                branches = self.repo.remote().refs
+            except ValueError:
+                return
 
-        # track any remote we are not already tracking
-        for branch in branches:
-            if "HEAD" in branch.name:
-                continue
+            # track any remote we are not already tracking
+            for branch in branches:
+                if "HEAD" in branch.name:
+                    continue
 
-            try:
-                self.repo.git.checkout('--track', branch.name)
-            except git.GitCommandError as e:
-                pass
+                try:
+                    self.repo.git.checkout('--track', branch.name)
+                except git.GitCommandError as e:
+                    pass
 
     def __del__(self):
         if self.repo_lock is not None:
@@ -254,21 +281,25 @@ class Client(object):
 
         self.last_pull_attempt_at = datetime.datetime.now()
 
-        self.checkout_to_master_user()
-        if self.has_remote:
-            try:
-                env = self.ssh_agent_env()
-                with self.repo.git.custom_environment(**env):
-                    self.repo.remotes[self.remote].pull()
-                self._last_pull_at = datetime.datetime.now()
-            except git.exc.GitCommandError as ex:
-                if print_error:
-                    print("Failed to pull from remote \"%s\".\n"
-                          "\n"
-                          "Git error: %s." % (
-                              self.remote,
-                              str(ex)
-                          ))
+        # the pull merges into our branch and its index, so it must not run during a commit
+        with self.commit_lock:
+            self.checkout_to_master_user()
+            if self.has_remote:
+                try:
+                    env = self.ssh_agent_env()
+                    with self.repo.git.custom_environment(**env), \
+                            REGISTRY.timer("binsync_pull_seconds", "Seconds spent pulling from the remote"):
+                        self.repo.remotes[self.remote].pull()
+                    self._last_pull_at = datetime.datetime.now()
+                except git.exc.GitCommandError as ex:
+                    REGISTRY.counter("binsync_pull_errors_total", "Failed pulls").inc()
+                    if print_error:
+                        print("Failed to pull from remote \"%s\".\n"
+                              "\n"
+                              "Git error: %s." % (
+                                  self.remote,
+                                  str(ex)
+                              ))
 
     def push(self, print_error=False):
         """
@@ -278,32 +309,40 @@ class Client(object):
         """
         self.last_push_attempt_at = datetime.datetime.now()
 
-        self.checkout_to_master_user()
-        if self.has_remote:
-            try:
-                env = self.ssh_agent_env()
-                with self.repo.git.custom_environment(**env):
-                    self.repo.remotes[self.remote].push(BINSYNC_ROOT_BRANCH)
-                    self.repo.remotes[self.remote].push(self.user_branch_name)
-                self._last_push_at = datetime.datetime.now()
-            except git.exc.GitCommandError as ex:
-                if print_error:
-                    print("Failed to push to remote \"%s\".\n"
-                          "Did you setup %s/master as the upstream of the local master branch?\n"
-                          "\n"
-                          "Git error: %s." % (
-                        self.remote,
-                        self.remote,
-                        str(ex)
-                    ))
+        # the checkout moves HEAD, which must not happen during a commit
+        with self.commit_lock:
+            self.checkout_to_master_user()
+            if self.has_remote:
+                try:
+                    env = self.ssh_agent_env()
+                    with self.repo.git.custom_environment(**env), \
+                            REGISTRY.timer("binsync_push_seconds", "Seconds spent pushing to the remote"):
+                        self.repo.remotes[self.remote].push(BINSYNC_ROOT_BRANCH)
+                        self.repo.remotes[self.remote].push(self.user_branch_name)
+                    self._last_push_at = datetime.datetime.now()
+                except git.exc.GitCommandError as ex:
+                    REGISTRY.counter("binsync_push_errors_total", "Failed pushes").inc()
+                    if print_error:
+                        print("Failed to push to remote \"%s\".\n"
+                              "Did you setup %s/master as the upstream of the local master branch?\n"
+                              "\n"
+                              "Git error: %s." % (
+                            self.remote,
+                            self.remote,
+                            str(ex)
+                        ))
 
     def users(self) -> typing.Iterable[User]:
-        for ref in self._get_best_refs():
-            try:
-                metadata = State.load_metadata(ref.commit.tree)
-                yield User.from_metadata(metadata)
-            except Exception as e:
-                continue
+        users = []
+        with self.commit_lock:
+            for ref in self._get_best_refs():
+                try:
+                    metadata = State.load_metadata(ref.commit.tree)
+                    users.append(User.from_metadata(metadata))
+                except Exception as e:
+                    continue
+
+        yield from users
 
     def tally(self, users=None):
         """
@@ -369,13 +408,14 @@ class Client(object):
             d['last_pull'] = self._last_pull_at if self._last_pull_at is not None else "never"
             d['last_pull_attempt'] = self.last_pull_attempt_at if self.last_pull_attempt_at is not None else "never"
 
+        d['metrics'] = REGISTRY.snapshot()
         return d
 
     def state_ctx(self, user=None, version=None, locked=False):
         state = self.get_state(user=user, version=version)
         return StateContext(self, state, locked=locked)
 
-    def get_tree(self, user):
+    def get_commit(self, user) -> git.Commit:
         with self.commit_lock:
             options = [ref for ref in self.repo.refs if ref.name.endswith(f"{BINSYNC_BRANCH_PREFIX}/{user}")]
             if not options:
@@ -383,30 +423,226 @@ class Client(object):
 
             # find the latest commit for the specified user!
             best = max(options, key=lambda ref: ref.commit.authored_date)
-            bct = best.commit.tree
+            return best.commit
 
-        return bct
+    def get_tree(self, user):
+        commit = self.get_commit(user)
+        with self.commit_lock:
+            return commit.tree
 
     def get_state(self, user=None, version=None):
         if user is None or user == self.master_user:
             # local state
             if self.state is None:
                 try:
-                    self.state = State.parse(
-                        self.get_tree(user=self.master_user), version=version,
-                        client=self,
-                    )  # Also need to check if user is none here???
+                    tree = self.get_tree(user=self.master_user)
+                    # the blobs are read lazily by the parse
+                    with self.commit_lock:
+                        self.state = State.parse(tree, version=version, client=self)
                 except MetadataNotFoundError:
                     # we should return a new state
                     self.state = State(user if user is not None else self.master_user, client=self)
             return self.state
+        elif version is not None:
+            try:
+                tree = self.get_tree(user=user)
+                with self.commit_lock:
+                    return State.parse(tree, version=version, client=self)
+            except MetadataNotFoundError:
+                return None
         else:
+            # other users' states are cached per commit and only reparsed when their branch moves
+            return self.get_state_at(user=user)
+
+    def get_snapshot(self, user=None, version=None) -> typing.Optional[State]:
+        """
+        Returns a read-only snapshot of a user's state. Snapshots are safe to read from other threads,
+        like the UI thread, without holding the commit_lock while the state keeps changing.
+        """
+        if user is not None and user != self.master_user:
+            state = self.get_state(user=user, version=version)
+            return state.snapshot() if state is not None else None
+
+        # the local state is changed by transactions, which must not be halfway through a write
+        with self._transaction_lock:
+            state = self.get_state(user=user, version=version)
+            return state.snapshot() if state is not None else None
+
+    def find_commit(self, user=None, commit=None, timestamp=None, changes_ago=None) -> git.Commit:
+        """
+        Finds a commit of a user's state by one of: its sha (@commit), the time it was current at
+        (@timestamp, a unix time or datetime), or how many commits it is behind the latest one (@changes_ago).
+        """
+        user = user if user is not None else self.master_user
+        if commit is not None:
+            with self.commit_lock:
+                return self.repo.commit(commit) if not isinstance(commit, git.Commit) else commit
+
+        head = self.get_commit(user)
+        if timestamp is not None:
+            if isinstance(timestamp, datetime.datetime):
+                timestamp = timestamp.timestamp()
+
+            with self.commit_lock:
+                for past_commit in self.repo.iter_commits(head, first_parent=True):
+                    if past_commit.committed_date <= timestamp:
+                        return past_commit
+
+            raise ValueError(f"User {user} has no commit before {timestamp}")
+
+        if changes_ago is not None:
+            with self.commit_lock:
+                for past_commit in self.repo.iter_commits(head, first_parent=True, skip=changes_ago, max_count=1):
+                    return past_commit
+
+            raise ValueError(f"User {user} has less than {changes_ago} commits")
+
+        return head
+
+    def get_state_at(self, user=None, commit=None, timestamp=None, changes_ago=None) -> typing.Optional[State]:
+        """
+        Reads a user's state as it was at a past commit, see find_commit() for how the commit is picked.
+
+        Past states are not parsed from scratch: the cached state of the same user closest in time is
+        moved to the requested commit by reloading only the files that differ (State.apply_tree_diff),
+        and the result is cached in turn.
+
+        @return: A read-only State, or None if the user had no state at that commit
+        """
+        user = user if user is not None else self.master_user
+        commit = self.find_commit(user=user, commit=commit, timestamp=timestamp, changes_ago=changes_ago)
+
+        with self._checkpoints_lock:
+            cached = self._checkpoints.get(commit.hexsha, None)
+            if cached is not None:
+                self._checkpoints.move_to_end(commit.hexsha)
+                return cached[1]
+
+            candidates = [
+                (hexsha, committed_date, state) for hexsha, (committed_date, state) in self._checkpoints.items()
+                if state.user == user
+            ]
+
+        # git objects are only read while holding the commit_lock
+        with self.commit_lock:
+            committed_date = commit.committed_date
+            nearest = self._nearest_checkpoint(candidates, committed_date)
             try:
-                state = State.parse(self.get_tree(user=user), version=version, client=self)
-                return state
+                if nearest is not None:
+                    start_hexsha, start_state = nearest
+                    state = start_state.snapshot(readonly=False)
+                    state.apply_tree_diff(self.repo.commit(start_hexsha).tree, commit.tree)
+                else:
+                    state = State.parse(commit.tree, client=self)
             except MetadataNotFoundError:
                 return None
 
+        snapshot = state.snapshot()
+        with self._checkpoints_lock:
+            # another thread may have read the same commit meanwhile, both states are equal
+            self._checkpoints[commit.hexsha] = (committed_date, snapshot)
+            while len(self._checkpoints) > self.max_checkpoints:
+                self._checkpoints.popitem(last=False)
+
+        return snapshot
+
+    @staticmethod
+    def _nearest_checkpoint(candidates, committed_date):
+        """
+        Returns the (hexsha, state) of the checkpoint of @candidates closest in time to @committed_date.
+        """
+        best = None
+        for hexsha, checkpoint_date, state in candidates:
+            distance = abs(checkpoint_date - committed_date)
+            if best is None or distance < best[0]:
+                best = distance, hexsha, state
+
+        return best[1:] if best is not None else None
+
+    def user_refs(self) -> typing.Dict[str, git.Reference]:
+        """
+        Returns the branch of every user, by user name. Our own branch is the local one, which may be ahead
+        of its remote copy.
+        """
+        user_refs = {
+            ref.name.split("/")[-1]: ref for ref in self._get_best_refs()
+            if not ref.name.endswith(BINSYNC_ROOT_BRANCH)
+        }
+        # a new user has no branch until its first commit
+        if self.user_branch_name in self.repo.heads:
+            user_refs[self.master_user] = self.repo.heads[self.user_branch_name]
+        return user_refs
+
+    def update_history(self) -> int:
+        """
+        Extends the artifact history index with the commits made to every user branch since it was
+        last updated.
+
+        @return: The number of new history entries
+        """
+        with self.commit_lock:
+            return self.history.update(self.repo, self.user_refs().items())
+
+    def artifact_history(self, artifact_type, key) -> typing.List[HistoryEntry]:
+        """
+        Returns every change made to an artifact by any user, oldest first, as far as the index knows.
+        The index is extended by update_history(), which the updates of the git thread run.
+
+        @param artifact_type:   An ArtifactGroupType
+        @param key:             Address of the artifact, or name for structs
+        """
+        return self.history.history(artifact_type, key)
+
+    def rollback(self, commit=None, timestamp=None, changes_ago=None, msg="Rollback"):
+        """
+        Replaces the local state with what it was at a past commit and commits the result, like
+        after a bad bulk sync. The history itself is kept, so a rollback can be rolled back too.
+        """
+        past_state = self.get_state_at(
+            user=self.master_user, commit=commit, timestamp=timestamp, changes_ago=changes_ago
+        )
+        if past_state is None:
+            raise ValueError("There is no state to roll back to.")
+
+        state = self.get_state()
+        state.copy_state(past_state)
+        self.commit_state(state=state, msg=msg)
+        return state
+
+    @contextlib.contextmanager
+    def transaction(self, msg="Bulk Change"):
+        """
+        Applies every change made to the local state inside the context as one batch, with a
+        single timestamp, a single commit and a single push:
+
+            with client.transaction() as state:
+                state.set_many(artifacts)
+
+        Commits requested inside the transaction (like the ones done by the controller pushers) are
+        deferred to its end. If an exception escapes the context, the state is rolled back and
+        nothing is committed.
+        """
+        with self._transaction_lock:
+            state = self.get_state()
+            self._transaction_depth += 1
+            try:
+                with state.batch():
+                    yield state
+            except BaseException:
+                if self._transaction_depth == 1:
+                    self._commit_deferred = False
+                raise
+            finally:
+                self._transaction_depth -= 1
+
+            if self._transaction_depth == 0 and (state.dirty or self._commit_deferred):
+                self._commit_deferred = False
+                self.commit_state(state=state, msg=msg)
+
+    @property
+    def in_transaction(self):
+        return self._transaction_depth > 0
+
     def get_locked_state(self, user=None, version=None):
         with self.commit_lock:
             yield self.get_state(user=user, version=version)
@@ -425,15 +661,17 @@ class Client(object):
             time.sleep(self._commit_interval)
             self.update()
 
+    @profiled("client_update")
     def update(self):
         """
         Update both the local and remote repo knowledge of files through pushes/pulls and commits
         in the case of dirty files.
         """
 
-        # do a pull if there is a remote repo connected
+        # do a pull if there is a remote repo connected, and track the branches of new users
         if self.has_remote:
             self.pull()
+            self.init_remote()
 
         # attempt to commit dirty files in a update phase
         if self.get_state().dirty:
@@ -442,9 +680,33 @@ class Client(object):
         if self.has_remote:
             self.push()
 
+        # index whatever was pulled or committed
+        self.update_history()
+
         self._last_commit_ts = time.time()
+        if self.metrics_path is not None:
+            try:
+                REGISTRY.write_prometheus(self.metrics_path)
+            except OSError as e:
+                _l.warning(f"Unable to write metrics to {self.metrics_path}: {e}")
+
+    def commit_state(self, state=None, msg="Generic Change", merge_parents=None):
+        # transactions hold the transaction lock while they change the state, so holding it here keeps the
+        # state from changing between the transaction check and the end of the dump
+        with self._transaction_lock:
+            if self.in_transaction:
+                self._commit_deferred = True
+                return
 
-    def commit_state(self, state=None, msg="Generic Change"):
+            # the commit is pushed by the next update, off the committing thread
+            self._commit_state(state=state, msg=msg, merge_parents=merge_parents)
+
+    def _commit_state(self, state=None, msg="Generic Change", merge_parents=None) -> bool:
+        """
+        Dumps and commits the state, the caller holds the transaction lock.
+
+        @return: True if a commit was made
+        """
         with self.commit_lock:
             self.checkout_to_master_user()
             if state is None:
@@ -455,29 +717,94 @@ class Client(object):
 
             assert self.master_user == state.user
 
+            # skip the dump entirely when only volatile data changed since the last commit
+            content_hash = state.content_hash()
+            if content_hash == state._last_commit_hash and not merge_parents:
+                state._dirty = False
+                return False
+
+            commit_start = time.perf_counter()
             master_user_branch = next(o for o in self.repo.branches if o.name == self.user_branch_name)
             index = self.repo.index
 
-            # dump the state
+            # dump the state, marking everything journaled so far as part of this commit
+            state.checkpoint_journal()
             state.dump(index)
 
             # commit changes
             self.repo.index.add([os.path.join(state.user, "*")])
 
-            if not self.repo.index.diff("HEAD"):
-                return
+            if not self.repo.index.diff("HEAD") and not merge_parents:
+                state._last_commit_hash = content_hash
+                return False
 
             # commit if there is any difference
             try:
-                commit = index.commit(msg)
+                if merge_parents:
+                    commit = index.commit(msg, parent_commits=[master_user_branch.commit] + list(merge_parents))
+                else:
+                    commit = index.commit(msg)
             except Exception:
                 print("[BinSync]: Internal Git Commit Error!")
-                return
+                return False
 
             master_user_branch.commit = commit
             state._dirty = False
+            state._last_commit_hash = content_hash
+            REGISTRY.histogram("binsync_commit_seconds", "Seconds spent dumping and committing the local state").observe(
+                time.perf_counter() - commit_start
+            )
+            REGISTRY.counter("binsync_commits_total", "Commits of the local state").inc()
 
-        self.push()
+        return True
+
+    def merge_from(self, user, prefer=None) -> typing.Optional[Merge]:
+        """
+        Three-way merges the state of @user into the local state, relative to the last commit both
+        branches share. Changes that do not conflict with ours are applied and committed; conflicting
+        artifacts keep our version and are reported in the returned Merge.
+
+        The merge is committed with @user's commit as a second parent, so the next merge only looks at
+        what changed after it. When conflicts are left unresolved that parent is not recorded, so they
+        are reported again by the next merge.
+
+        @param user:    The user to merge from
+        @param prefer:  Merge.OURS or Merge.THEIRS to resolve conflicts with that version
+        @return:        The Merge, or None if the user has no state
+        """
+        their_commit = self.get_commit(user)
+        try:
+            with self.commit_lock:
+                theirs = State.parse(their_commit.tree, client=self)
+        except MetadataNotFoundError:
+            return None
+
+        our_commit = self.get_commit(self.master_user)
+        with self.commit_lock:
+            bases = self.repo.merge_base(our_commit, their_commit)
+
+        base = None
+        if bases:
+            try:
+                with self.commit_lock:
+                    base = State.parse(bases[0].tree)
+            except MetadataNotFoundError:
+                pass
+        if base is None:
+            base = State(user)
+
+        # no transaction may change our state between the merge and its commit
+        with self._transaction_lock:
+            ours = self.get_state()
+            merge = Merge(base, ours, theirs)
+            merge.apply(ours, prefer=prefer)
+
+            resolved = prefer is not None or not merge.has_conflicts
+            self.commit_state(
+                state=ours, msg=f"Merge from {user}", merge_parents=[their_commit] if resolved else None
+            )
+
+        return merge
 
     def sync_states(self, user=None):
         target_state = self.get_state(user)
@@ -485,10 +812,8 @@ class Client(object):
             print("Unable to find state for user", user)
             return
 
-        my_state = self.get_state(self.master_user)
-
-        my_state.copy_state(target_state)
-        self.commit_state()
+        with self.transaction(msg=f"Synced state from {user}") as my_state:
+            my_state.copy_state(target_state)
 
     @staticmethod
     def discover_ssh_agent(ssh_agent_cmd):
@@ -538,6 +863,8 @@ class Client(object):
     def close(self):
         self.repo.close()
         del self.repo
+        # the loaded states are gone with the client, so are the strings they shared
+        STRING_TABLE.clear()
 
     def _get_best_refs(self):
         candidates = {}
@@ -1,13 +1,19 @@
 from functools import wraps
 import threading
 import time
+import contextlib
+import itertools
+import concurrent.futures
 import datetime
 import logging
-from typing import Optional, Iterable, Dict, List
+from typing import Optional, Iterable, Dict, List, Set
 from collections import OrderedDict
 
 import binsync.data
 from ..client import Client
+from ..aggregate import AggregateIndex, AggregateChanges
+from ..metrics import REGISTRY
+from ..profiling import PROFILER, profiled
 from ..data import User, Function, StackVariable, Comment, Struct
 
 _l = logging.getLogger(name=__name__)
@@ -57,17 +63,25 @@ def make_ro_state(f):
     """
     Build a read-only State _instance and pass to `f` as the `state` kwarg if the `state` kwarg is None.
     Function `f` should have have at least two kwargs, `user` and `state`.
+
+    States are shared through the controller's state_scope(), so every puller called while `f` runs
+    reuses the state `f` got instead of resolving it again.
     """
 
     @wraps(f)
     def state_check(self, *args, **kwargs):
         state = kwargs.pop('state', None)
         user = kwargs.pop('user', None)
-        if state is None:
-            state = self.client.get_state(user=user)
-        kwargs['state'] = state
-        kwargs['user'] = user
-        return f(self, *args, **kwargs)
+        with self.state_scope() as states:
+            if state is None:
+                state = states.get(user, None)
+                if state is None:
+                    state = self.client.get_state(user=user)
+                    states[user] = state
+
+            kwargs['state'] = state
+            kwargs['user'] = user
+            return f(self, *args, **kwargs)
 
     return state_check
 
@@ -76,6 +90,73 @@ def make_ro_state(f):
 # Description Classes
 #
 
+class PrefetchedFunction:
+    """
+    The artifacts of a function in a user's state, ready to be filled by a decompiler.
+    """
+
+    __slots__ = ("function", "comments")
+
+    def __init__(self, function: Function, comments: Dict[int, Comment]):
+        self.function = function
+        self.comments = comments
+
+    @property
+    def addr(self):
+        return self.function.addr
+
+    @property
+    def stack_vars(self) -> Dict[int, StackVariable]:
+        return self.function.stack_vars
+
+
+class SyncAllTask:
+    """
+    A sync_all running in the background. Functions are filled in priority order, so the ones already
+    in `results` are usually the ones the user cares about most.
+
+    :ivar list func_addrs:  Every function to fill, in the order they are filled
+    :ivar dict results:     Whether each function filled so far succeeded, by address
+    """
+
+    def __init__(self, func_addrs: List[int], user):
+        self.func_addrs = func_addrs
+        self.user = user
+        self.results = {}  # type: Dict[int, bool]
+
+        self._cancel_event = threading.Event()
+        self._done_event = threading.Event()
+
+    @property
+    def total(self):
+        return len(self.func_addrs)
+
+    @property
+    def done(self):
+        return len(self.results)
+
+    @property
+    def progress(self) -> float:
+        return self.done / self.total if self.total else 1.0
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def finished(self):
+        return self._done_event.is_set()
+
+    def cancel(self):
+        """
+        Stops the sync after the chunk being filled. Functions already filled stay filled.
+        """
+        self._cancel_event.set()
+
+    def wait(self, timeout=None) -> bool:
+        return self._done_event.wait(timeout)
+
+
 class SyncControlStatus:
     CONNECTED = 0
     CONNECTED_NO_REMOTE = 1
@@ -95,7 +176,29 @@ class BinSyncController:
     All class properties that have a "= None" means they must be set during runtime by an outside process.
     The client will be set on connection. The ctx_change_callback will be set by an outside UI
 
+    Work is split across three threads once connected: the command worker runs queued user commands as
+    soon as they are queued, the timer thread tracks the context and reloads the UI, and the git thread
+    pulls and pushes, so slow git operations never delay local changes.
     """
+
+    CTX_INTERVAL = 1
+    CTX_CACHE_SIZE = 16
+    CTX_HISTORY_SIZE = 64
+    FILL_CHUNK_SIZE = 256
+    SYNC_CHUNK_SIZE = 32
+    # time left to the decompiler between two chunks of a sync_all
+    SYNC_YIELD_INTERVAL = 0.05
+    UI_INTERVAL = 10
+    PULL_INTERVAL = 10
+    # positions of the arguments that identify the artifact a pusher changes, by pusher name. Controllers
+    # whose pushers take different arguments override it.
+    CMD_KEY_ARGS = {
+        "push_function_header": (0,),
+        "push_comment": (0,),
+        "push_stack_variable": (0, 1),
+        "push_struct": (0,),
+    }
+
     def __init__(self, headless=False):
         self.headless = headless
 
@@ -108,62 +211,234 @@ class BinSyncController:
         self._last_reload = None
         self.last_ctx = None
 
-        # command locks
+        # command locks, the condition wakes the command worker up whenever a command is queued
         self.queue_lock = threading.Lock()
         self.cmd_queue = OrderedDict()
-
-        # create a pulling thread, but start on connection
-        self.updater_thread = threading.Thread(target=self.updater_routine)
+        self.cmd_available = threading.Condition(self.queue_lock)
+        self._cmd_counter = itertools.count()
+        self._queue_stats = {
+            "queued": 0,
+            "coalesced": 0,
+            "drained": 0,
+            "failed": 0,
+            "max_depth": 0,
+            "last_drain_size": 0,
+            "last_drain_latency": 0.0,
+            "max_drain_latency": 0.0,
+        }
+
+        # states shared by the pullers of one operation, per thread
+        self._state_scope = threading.local()
+
+        # every user's view of recently visited functions, filled in the background on context changes.
+        # The lock guards every _ctx_ attribute below.
+        self._ctx_cache_lock = threading.Lock()
+        self._ctx_cache = OrderedDict()  # type: OrderedDict[int, Dict[str, PrefetchedFunction]]
+        # users whose view of a cached function must be reloaded, since their branch moved
+        self._ctx_stale = {}  # type: Dict[int, Set[str]]
+        self._ctx_pending = {}  # type: Dict[int, concurrent.futures.Future]
+        self._ctx_pool = None  # type: Optional[concurrent.futures.ThreadPoolExecutor]
+        # bumped on every invalidation, loads started before one are not cached
+        self._ctx_generation = 0
+        # the commit of every user's branch when the cache was last checked
+        self._ctx_commits = {}  # type: Dict[str, str]
+        # recently visited functions, most recent last
+        self._ctx_history = OrderedDict()  # type: OrderedDict[int, None]
+
+        # every user's functions and structs, summarized for the UI
+        self.aggregate = AggregateIndex()
+        self._aggregate_client = None  # type: Optional[Client]
+        self._aggregate_lock = threading.Lock()
+
+        # decompiler fillers are the slowest part of a sync, profile them when profiling is enabled
+        self.fill_function = profiled("fill_function")(self.fill_function)
+
+        # create the worker threads, but start them on connection
+        self._shutdown_event = threading.Event()
+        self._make_threads()
 
     #
     #   Multithreading updaters, locks, and evaluators
     #
 
     def make_controller_cmd(self, cmd_func, *args, **kwargs):
+        """
+        Queues a command for the command worker. A queued command that changes the same artifact as an
+        older one still in the queue replaces it, so rapid edits of one artifact are only applied once.
+        """
+        key = self._cmd_key(cmd_func, args, kwargs)
         with self.queue_lock:
-            self.cmd_queue[time.time()] = (cmd_func, args, kwargs)
+            old_cmd = self.cmd_queue.pop(key, None)
+            queued_at = old_cmd[3] if old_cmd is not None else time.time()
+            self.cmd_queue[key] = (cmd_func, args, kwargs, queued_at)
+
+            self._queue_stats["queued"] += 1
+            self._queue_stats["coalesced"] += old_cmd is not None
+            self._queue_stats["max_depth"] = max(self._queue_stats["max_depth"], len(self.cmd_queue))
+            self.cmd_available.notify()
+
+    def _cmd_key(self, cmd_func, args, kwargs):
+        """
+        Returns the identity of the artifact a command changes, commands with equal keys supersede each
+        other. Pushers are matched by name, and keyed by their arguments at the CMD_KEY_ARGS positions.
+        """
+        name = getattr(cmd_func, "__name__", None)
+        key_args = self.CMD_KEY_ARGS.get(name, None)
+        if key_args is not None:
+            try:
+                return (name,) + tuple(self._cmd_key_arg(args, kwargs, i) for i in key_args)
+            except IndexError:
+                pass
+
+        # commands that are never coalesced
+        return name, next(self._cmd_counter)
+
+    @staticmethod
+    def _cmd_key_arg(args, kwargs, i):
+        arg = args[i]
+        if not isinstance(arg, Struct):
+            return arg
+
+        # deleted structs have no name, they are keyed by the old name passed after them
+        if arg.name is None:
+            return args[i + 1] if len(args) > i + 1 else kwargs.get("old_name", None)
+
+        return arg.name
 
     def _eval_cmd_queue(self):
-        cmd = None
+        """
+        Drains the whole command queue, applying every command in a single client transaction.
+
+        @return: The number of commands that were run
+        """
         with self.queue_lock:
-            if len(self.cmd_queue) > 0:
-                # pop the first command from the queue
-                cmd = self.cmd_queue.popitem(last=False)[1]
+            cmds = list(self.cmd_queue.values())
+            self.cmd_queue.clear()
 
-        # parse the command if present
-        if not cmd:
-            return
+        if not cmds:
+            return 0
+
+        if len(cmds) == 1:
+            func, f_args, f_kargs, _ = cmds[0]
+            msg = self._generate_commit_message(func, *f_args, **f_kargs)
+        else:
+            msg = f"Updated {len(cmds)} artifacts"
+
+        drain_start = time.time()
+        queue_wait = REGISTRY.histogram("binsync_queue_wait_seconds", "Seconds commands waited in the queue")
+        for cmd in cmds:
+            queue_wait.observe(drain_start - cmd[3])
+
+        failed = 0
+        transaction = self.client.transaction(msg=msg) if self.check_client() else contextlib.nullcontext()
+        with transaction, REGISTRY.timer("binsync_queue_drain_seconds", "Seconds spent running queued commands"):
+            for func, f_args, f_kargs, _ in cmds:
+                try:
+                    func(*f_args, **f_kargs)
+                except Exception:
+                    failed += 1
+                    _l.exception("Failed to run the command %s", func)
+
+        # only the master user's view can have changed
+        if self.check_client():
+            self.invalidate_context_cache(users=[self.client.master_user])
+        REGISTRY.counter("binsync_commands_total", "Queued commands that were run").inc(len(cmds))
+        REGISTRY.counter("binsync_commands_failed_total", "Queued commands that raised").inc(failed)
+        latency = time.time() - min(cmd[3] for cmd in cmds)
+        with self.queue_lock:
+            self._queue_stats["drained"] += len(cmds)
+            self._queue_stats["failed"] += failed
+            self._queue_stats["last_drain_size"] = len(cmds)
+            self._queue_stats["last_drain_latency"] = latency
+            self._queue_stats["max_drain_latency"] = max(self._queue_stats["max_drain_latency"], latency)
 
-        func, f_args, f_kargs = cmd[:]
-        func(*f_args, **f_kargs)
+        return len(cmds)
 
-    def updater_routine(self):
-        while True:
-            time.sleep(1)
+    def queue_stats(self) -> Dict:
+        """
+        Metrics of the command queue: its current depth, how many commands were queued, coalesced and
+        run, and the latency between queueing a command and the end of the drain that ran it.
+        """
+        with self.queue_lock:
+            stats = dict(self._queue_stats)
+            stats["depth"] = len(self.cmd_queue)
+
+        return stats
 
+    def metrics(self) -> Dict:
+        """
+        Timings and counters of the whole sync pipeline, from the client to the UI, along with the
+        current depth of the command queue.
+        """
+        metrics = REGISTRY.snapshot()
+        with self.queue_lock:
+            metrics["binsync_queue_depth"] = len(self.cmd_queue)
+
+        return metrics
+
+    def updater_routine(self):
+        """
+        The command worker: sleeps until commands are queued, then runs all of them.
+        """
+        while not self._shutdown_event.is_set():
+            with self.queue_lock:
+                # the timeout only covers commands queued without a notify
+                while not self.cmd_queue and not self._shutdown_event.is_set():
+                    self.cmd_available.wait(timeout=1)
+
+            if self._shutdown_event.is_set():
+                break
+
+            # evaluate commands started by the user, a failed commit must not stop the worker
+            with PROFILER.profile("updater"):
+                try:
+                    while self._eval_cmd_queue():
+                        pass
+                except Exception:
+                    _l.exception("Failed to apply the queued commands")
+
+    def _timer_routine(self):
+        """
+        Tracks the context of the user and reloads the UI, each on its own interval.
+        """
+        last_reload = 0
+        while not self._shutdown_event.wait(self.CTX_INTERVAL):
             # verify the client is connected
-            if not self.check_client():
+            if not self.check_client() or self.headless:
                 continue
 
-            if not self.headless:
-                # update context knowledge every 1 second
-                if self.ctx_change_callback:
-                    self._check_and_notify_ctx()
+            # update context knowledge
+            if self.ctx_change_callback:
+                self._check_and_notify_ctx()
 
-                # update the control panel with new info every 10 seconds
-                if self._last_reload is None or (datetime.datetime.now() - self._last_reload).seconds > 10:
-                    self._last_reload = datetime.datetime.now()
-                    self._update_ui()
+            # update the control panel with new info
+            if time.time() - last_reload >= self.UI_INTERVAL:
+                last_reload = time.time()
+                self._last_reload = datetime.datetime.now()
+                self._update_ui()
 
-            # update client every 10 seconds if it has a remote connection
-            if self.client.has_remote and (
-                    (self.client.last_pull_attempt_at is None) or
-                    (datetime.datetime.now() - self.client.last_pull_attempt_at).seconds > 10
-            ):
-                self.client.update()
-
-            # evaluate commands started by the user
-            self._eval_cmd_queue()
+    def _git_routine(self):
+        """
+        Pulls, commits and pushes through the client, which can take long on large repos.
+        """
+        while not self._shutdown_event.is_set():
+            if self.check_client():
+                try:
+                    if self.client.has_remote:
+                        self.client.update()
+                    else:
+                        # nothing to pull or push, but local commits are still indexed off the other threads
+                        self.client.update_history()
+                    self._invalidate_moved_users()
+                except Exception:
+                    _l.exception("Failed to update the client")
+
+            self._shutdown_event.wait(self.PULL_INTERVAL)
+
+    def _make_threads(self):
+        self.updater_thread = threading.Thread(target=self.updater_routine, name="BinSyncCommands", daemon=True)
+        self.timer_thread = threading.Thread(target=self._timer_routine, name="BinSyncTimer", daemon=True)
+        self.git_thread = threading.Thread(target=self._git_routine, name="BinSyncGit", daemon=True)
 
     def _update_ui(self):
         if not self.ui_callback:
@@ -172,8 +447,30 @@ class BinSyncController:
         self.ui_callback()
 
     def start_updater_routine(self):
-        self.updater_thread.setDaemon(True)
-        self.updater_thread.start()
+        # threads can only be started once, so a restart after shutdown() needs new ones
+        if self._shutdown_event.is_set():
+            self._shutdown_event.clear()
+            self._make_threads()
+
+        for thread in (self.updater_thread, self.timer_thread, self.git_thread):
+            if not thread.is_alive():
+                thread.start()
+
+    def shutdown(self, timeout=5):
+        """
+        Stops the worker threads, waiting up to @timeout seconds for each to finish its current work.
+        """
+        self._shutdown_event.set()
+        with self.queue_lock:
+            self.cmd_available.notify_all()
+
+        for thread in (self.updater_thread, self.timer_thread, self.git_thread):
+            if thread.is_alive() and thread is not threading.current_thread():
+                thread.join(timeout=timeout)
+
+        if self._ctx_pool is not None:
+            self._ctx_pool.shutdown(wait=False)
+            self._ctx_pool = None
 
     def _check_and_notify_ctx(self):
         active_ctx = self.active_context()
@@ -181,8 +478,166 @@ class BinSyncController:
             return
 
         self.last_ctx = active_ctx
+        with self._ctx_cache_lock:
+            self._ctx_history.pop(active_ctx.addr, None)
+            self._ctx_history[active_ctx.addr] = None
+            while len(self._ctx_history) > self.CTX_HISTORY_SIZE:
+                self._ctx_history.popitem(last=False)
+
+        self.prefetch_context(active_ctx.addr)
         self.ctx_change_callback()
 
+    #
+    # Context Cache
+    #
+
+    def related_functions(self, func_addr) -> Iterable[int]:
+        """
+        Can be overridden by plugins to return functions the user is likely to visit after @func_addr,
+        like its callers and callees, which are then prefetched with it.
+        """
+        return ()
+
+    def prefetch_context(self, func_addr):
+        """
+        Starts resolving every user's view of @func_addr, then of its related functions, in the background.
+        """
+        if not self.check_client():
+            return
+
+        if self._ctx_pool is None:
+            self._ctx_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="BinSyncCtx")
+
+        try:
+            related = list(self.related_functions(func_addr))
+        except Exception:
+            _l.exception("Failed to find the functions related to %#x", func_addr)
+            related = []
+
+        for addr in [func_addr] + related[:self.CTX_CACHE_SIZE - 1]:
+            with self._ctx_cache_lock:
+                if (addr in self._ctx_cache and addr not in self._ctx_stale) or addr in self._ctx_pending:
+                    continue
+                self._ctx_pending[addr] = self._ctx_pool.submit(
+                    self._load_function_views, addr, self._ctx_stale.get(addr, None), self._ctx_generation
+                )
+
+    def function_views(self, func_addr) -> Dict[str, PrefetchedFunction]:
+        """
+        Returns every user's view of a function, by user name, from the context cache when possible.
+        Only waits for a prefetch of the function that is already running, a queued one is replaced by
+        loading the views on the calling thread.
+        """
+        with self._ctx_cache_lock:
+            views = self._ctx_cache.get(func_addr, None)
+            stale = self._ctx_stale.get(func_addr, None)
+            if views is not None and stale is None:
+                self._ctx_cache.move_to_end(func_addr)
+                return views
+
+            pending = self._ctx_pending.get(func_addr, None)
+            if pending is not None and pending.cancel():
+                del self._ctx_pending[func_addr]
+                pending = None
+            generation = self._ctx_generation
+
+        if pending is not None:
+            return pending.result()
+
+        return self._load_function_views(func_addr, stale, generation)
+
+    def refresh_aggregate(self) -> AggregateChanges:
+        """
+        Catches the aggregate index up with every user's branch, see AggregateIndex.refresh(). The index
+        starts over when the controller connects to another repo.
+
+        @return: What the refresh changed
+        """
+        with self._aggregate_lock:
+            if self._aggregate_client is not self.client:
+                self.aggregate = AggregateIndex()
+                self._aggregate_client = self.client
+
+            with REGISTRY.timer("binsync_aggregate_refresh_seconds", "Seconds spent refreshing the aggregate index"):
+                return self.aggregate.refresh(self.client)
+
+    def invalidate_context_cache(self, users: Optional[Iterable[str]] = None):
+        """
+        Drops the cached views of @users, or of every user, so they are reloaded when next needed. Loads
+        still running are not cached when they finish.
+        """
+        with self._ctx_cache_lock:
+            self._ctx_generation += 1
+            self._ctx_pending.clear()
+            if users is None:
+                self._ctx_cache.clear()
+                self._ctx_stale.clear()
+                return
+
+            users = set(users)
+            for func_addr, views in self._ctx_cache.items():
+                self._ctx_cache[func_addr] = {user: view for user, view in views.items() if user not in users}
+                self._ctx_stale.setdefault(func_addr, set()).update(users)
+
+    def _invalidate_moved_users(self):
+        """
+        Invalidates the cached views of the users whose branch moved since the last check.
+        """
+        with self.client.commit_lock:
+            commits = {user: ref.commit.hexsha for user, ref in self.client.user_refs().items()}
+
+        with self._ctx_cache_lock:
+            moved = {
+                user for user in set(commits) | set(self._ctx_commits)
+                if commits.get(user, None) != self._ctx_commits.get(user, None)
+            }
+            self._ctx_commits = commits
+
+        if moved:
+            self.invalidate_context_cache(users=moved)
+
+    def _load_function_views(self, func_addr, users: Optional[Set[str]] = None,
+                             generation: Optional[int] = None) -> Dict[str, PrefetchedFunction]:
+        """
+        Loads the views of @func_addr of @users, or of every user, and merges them into the cache unless
+        the cache was invalidated since @generation.
+        """
+        views = {}
+        try:
+            for user in self.users():
+                if users is not None and user.name not in users:
+                    continue
+
+                # the local state keeps changing on the command worker, read it from a snapshot
+                if user.name == self.client.master_user:
+                    state = self.client.get_snapshot()
+                else:
+                    state = self.client.get_state(user=user.name)
+                if state is None or func_addr not in state.functions:
+                    continue
+
+                views[user.name] = PrefetchedFunction(
+                    state.functions[func_addr], state.get_comments_in_function(func_addr)
+                )
+        except Exception:
+            _l.exception("Failed to load the views of function %#x", func_addr)
+
+        with self._ctx_cache_lock:
+            if generation is not None and generation != self._ctx_generation:
+                return views if users is None else dict(self._ctx_cache.get(func_addr, {}), **views)
+
+            self._ctx_pending.pop(func_addr, None)
+            if users is not None:
+                views = dict(self._ctx_cache.get(func_addr, {}), **views)
+            self._ctx_cache[func_addr] = views
+            self._ctx_cache.move_to_end(func_addr)
+            self._ctx_stale.pop(func_addr, None)
+            while len(self._ctx_cache) > self.CTX_CACHE_SIZE:
+                evicted, _ = self._ctx_cache.popitem(last=False)
+                self._ctx_stale.pop(evicted, None)
+
+        return views
+
     #
     # Client Interaction Functions
     #
@@ -215,6 +670,26 @@ class BinSyncController:
         else:
             return "<font color=#cc3232>Disconnected</font>"
 
+    @contextlib.contextmanager
+    def state_scope(self):
+        """
+        Opens a scope in which every make_ro_state function called on this thread shares the states it
+        resolves, keyed by user. Scopes nest: an inner scope is the outer one. Plugins can open a scope
+        around any operation that calls several pullers.
+
+        @return: The user -> State dict of the scope
+        """
+        states = getattr(self._state_scope, "states", None)
+        if states is not None:
+            yield states
+            return
+
+        self._state_scope.states = {}
+        try:
+            yield self._state_scope.states
+        finally:
+            self._state_scope.states = None
+
     def toggle_headless(self):
         self.headless = not self.headless
 
@@ -282,6 +757,180 @@ class BinSyncController:
         """
         raise NotImplementedError
 
+    @init_checker
+    def fill_functions(self, func_addrs, user=None, state=None) -> Dict[int, bool]:
+        """
+        Fill many functions from the specified user. The user's artifacts for the next chunk of functions
+        are prefetched on a worker thread while the current chunk is filled by fill_function_batch, on the
+        calling thread, since decompilers usually require changes to be made from a specific thread.
+
+        @param func_addrs:  Addresses of the functions to fill
+        @param user:        User to fill from
+        @param state:       The user's state, resolved once if not given
+        @return:            Whether each function was filled, by address
+        """
+        func_addrs = list(func_addrs)
+        chunks = [func_addrs[i:i + self.FILL_CHUNK_SIZE] for i in range(0, len(func_addrs), self.FILL_CHUNK_SIZE)]
+        results = {}
+        if not chunks:
+            return results
+
+        with self.state_scope() as states:
+            if state is None:
+                state = states.get(user, None) or self.client.get_state(user=user)
+                states[user] = state
+            if state is None:
+                return {addr: False for addr in func_addrs}
+
+            # the prefetcher must not read a state that is being written to
+            prefetch_state = state if state.readonly else state.snapshot()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="BinSyncPrefetch") as pool:
+                future = pool.submit(self._prefetch_functions, chunks[0], prefetch_state)
+                for idx, chunk in enumerate(chunks):
+                    batch = future.result()
+                    if idx + 1 < len(chunks):
+                        future = pool.submit(self._prefetch_functions, chunks[idx + 1], prefetch_state)
+
+                    for func_addr in chunk:
+                        if func_addr not in batch:
+                            results[func_addr] = False
+                    results.update(self.fill_function_batch(batch, user=user, state=state))
+
+        return results
+
+    def visible_functions(self) -> Iterable[int]:
+        """
+        Can be overridden by plugins to return the functions currently shown in open views, which
+        sync_all fills right after the current function.
+        """
+        return ()
+
+    def _sync_priority(self, func_addrs) -> List[int]:
+        """
+        Orders functions for sync_all: the current function, the visible ones, the recently visited
+        ones from most to least recent, then everything else by address.
+        """
+        remaining = set(func_addrs)
+        order = []
+
+        def take(addrs):
+            for addr in addrs:
+                if addr in remaining:
+                    remaining.discard(addr)
+                    order.append(addr)
+
+        if self.last_ctx is not None:
+            take([self.last_ctx.addr])
+        try:
+            take(self.visible_functions())
+        except Exception:
+            _l.exception("Failed to get the visible functions")
+        with self._ctx_cache_lock:
+            history = list(reversed(self._ctx_history))
+        take(history)
+        take(sorted(remaining))
+
+        return order
+
+    @init_checker
+    def sync_all(self, user=None, progress_callback=None, blocking=False) -> SyncAllTask:
+        """
+        Syncs everything from the specified user. Functions are filled in priority order (see
+        _sync_priority) and in small chunks, leaving the decompiler time to handle its own events between
+        chunks. Once every function is filled, the rest of the user's state is copied to ours.
+
+        The user's artifacts are read on the sync thread, and each chunk is filled through
+        run_in_main_thread, so decompilers that only allow changes from their main thread stay responsive.
+
+        @param user:                User to sync from
+        @param progress_callback:   Called with the SyncAllTask after every chunk
+        @param blocking:            Run on the calling thread instead of a new one
+        @return:                    A SyncAllTask to follow the progress of or cancel the sync
+        """
+        state = self.client.get_state(user=user)
+        task = SyncAllTask(self._sync_priority(state.functions.keys() if state is not None else ()), user)
+        if blocking:
+            self._run_sync_all(task, state, progress_callback)
+        else:
+            threading.Thread(
+                target=self._run_sync_all, args=(task, state, progress_callback), name="BinSyncSyncAll",
+                daemon=True
+            ).start()
+
+        return task
+
+    def _run_sync_all(self, task: SyncAllTask, state, progress_callback=None):
+        try:
+            if state is None:
+                return
+
+            # the sync thread must not read a state that is being written to
+            prefetch_state = state if state.readonly else state.snapshot()
+            for idx in range(0, task.total, self.SYNC_CHUNK_SIZE):
+                if task.cancelled:
+                    return
+
+                chunk = task.func_addrs[idx:idx + self.SYNC_CHUNK_SIZE]
+                batch = self._prefetch_functions(chunk, prefetch_state)
+                results = {func_addr: False for func_addr in chunk if func_addr not in batch}
+                results.update(self.run_in_main_thread(self.fill_function_batch, batch, user=task.user, state=state))
+                task.results.update(results)
+                if progress_callback:
+                    progress_callback(task)
+
+                time.sleep(self.SYNC_YIELD_INTERVAL)
+
+            if not task.cancelled:
+                self.client.sync_states(user=task.user)
+        except Exception:
+            _l.exception("Failed to sync all from %s", task.user)
+        finally:
+            task._done_event.set()
+
+    def run_in_main_thread(self, func, *args, **kwargs):
+        """
+        Runs @func where the decompiler allows its database to be changed, waits for it, and returns its
+        result. Plugins for decompilers that only allow changes from their main thread override this; by
+        default @func runs on the calling thread.
+        """
+        return func(*args, **kwargs)
+
+    @staticmethod
+    def _prefetch_functions(func_addrs, state) -> Dict[int, "PrefetchedFunction"]:
+        batch = OrderedDict()
+        for func_addr in func_addrs:
+            func = state.functions.get(func_addr, None)
+            if func is None:
+                continue
+
+            batch[func_addr] = PrefetchedFunction(func, state.get_comments_in_function(func_addr))
+
+        return batch
+
+    def fill_function_batch(self, batch: Dict[int, "PrefetchedFunction"], user=None, state=None) -> Dict[int, bool]:
+        """
+        Fills a batch of functions prefetched by fill_functions. Plugins that can apply many functions
+        more efficiently than one at a time should override this; by default each function is filled
+        with fill_function.
+
+        @param batch:   The prefetched artifacts of each function to fill, by address
+        @param user:
+        @param state:
+        @return:        Whether each function was filled, by address
+        """
+        results = {}
+        for func_addr in batch:
+            try:
+                r = self.fill_function(func_addr, user=user, state=state)
+            except Exception:
+                _l.exception("Failed to fill function %#x", func_addr)
+                r = False
+
+            # fillers report failures as False or -1
+            results[func_addr] = r is not False and not (isinstance(r, int) and r < 0)
+
+        return results
+
     #
     # Pushers
     #
@@ -0,0 +1,259 @@
+import copy
+import hashlib
+import json
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, TextIO
+
+import binsync.data
+from ..client import Client
+from ..state import ArtifactGroupType, ARTIFACT_LOADERS
+from ..data import Function, FunctionHeader, StackVariable, Comment, canonicalize
+from .controller import BinSyncController, PrefetchedFunction, init_checker, make_state, make_ro_state
+
+_l = logging.getLogger(name=__name__)
+
+# names of the artifact types in dumps and imports
+ARTIFACT_TYPE_NAMES = {
+    ArtifactGroupType.FUNCTION: "function",
+    ArtifactGroupType.COMMENT: "comment",
+    ArtifactGroupType.PATCH: "patch",
+    ArtifactGroupType.STRUCT: "struct",
+}
+ARTIFACT_NAME_TYPES = {name: artifact_type for artifact_type, name in ARTIFACT_TYPE_NAMES.items()}
+
+
+class HeadlessController(BinSyncController):
+    """
+    A controller that runs without a decompiler, for services and scripts. Filling a function copies
+    the other user's artifacts into the local state, since there is no decompiler to show them in.
+    """
+
+    def __init__(self, binary_path=None, binary_hash=None):
+        super(HeadlessController, self).__init__(headless=True)
+        self._binary_path = binary_path
+        self._binary_hash = binary_hash
+
+    def binary_hash(self) -> str:
+        if self._binary_hash is None:
+            if self._binary_path is None:
+                raise ValueError("A headless controller needs a binary or its hash to connect.")
+
+            with open(self._binary_path, "rb") as fp:
+                self._binary_hash = hashlib.md5(fp.read()).hexdigest()
+
+        return self._binary_hash
+
+    def active_context(self):
+        return None
+
+    def connect(self, user, path, init_repo=False, remote_url=None, start_threads=False, metrics_path=None):
+        """
+        Connects to a repo. Unlike decompiler controllers, the worker threads are only started on request,
+        since most scripts do their work and exit.
+        """
+        self.client = Client(
+            user, path, self.binary_hash(), init_repo=init_repo, remote_url=remote_url, metrics_path=metrics_path
+        )
+        if start_threads:
+            self.start_updater_routine()
+
+        return self.client.connection_warnings
+
+    #
+    # Fillers
+    #
+
+    @init_checker
+    @make_ro_state
+    def fill_struct(self, struct_name, user=None, state=None):
+        struct = state.structs.get(struct_name, None)
+        if struct is None:
+            return False
+
+        with self.client.transaction(msg=f"Synced struct:{struct_name} from {user}") as master_state:
+            return master_state.set_many([struct]) > 0
+
+    @init_checker
+    @make_ro_state
+    def fill_structs(self, user=None, state=None):
+        with self.client.transaction(msg=f"Synced structs from {user}") as master_state:
+            return master_state.set_many(list(state.structs.values())) > 0
+
+    @init_checker
+    @make_ro_state
+    def fill_function(self, func_addr, user=None, state=None):
+        func = state.functions.get(func_addr, None)
+        if func is None:
+            return False
+
+        with self.client.transaction(msg=f"Synced function:{hex(func_addr)} from {user}") as master_state:
+            master_state.set_many(
+                self._copy_function_artifacts(func, state.get_comments_in_function(func_addr), state),
+                set_last_change=False
+            )
+
+        return True
+
+    def fill_function_batch(self, batch: Dict[int, PrefetchedFunction], user=None, state=None) -> Dict[int, bool]:
+        """
+        Fills a whole batch of functions in a single transaction, and so a single commit.
+        """
+        artifacts = []
+        for prefetched in batch.values():
+            artifacts += self._copy_function_artifacts(prefetched.function, prefetched.comments, state)
+
+        with self.client.transaction(msg=f"Synced {len(batch)} functions from {user}") as master_state:
+            master_state.set_many(artifacts, set_last_change=False)
+
+        return {func_addr: True for func_addr in batch}
+
+    @staticmethod
+    def _copy_function_artifacts(func: Function, comments: Dict[int, Comment], state) -> List:
+        # the artifacts belong to the other user's cached state, which must not change through ours
+        return [func.copy()] + [copy.copy(cmt) for addr, cmt in comments.items() if addr in state.comments]
+
+    #
+    # Pushers
+    #
+
+    @init_checker
+    @make_state
+    def push_comment(self, addr, comment, decompiled=False, func_addr=None, user=None, state=None):
+        return state.set_comment(Comment(addr, comment, decompiled=decompiled, func_addr=func_addr))
+
+    @init_checker
+    @make_state
+    def push_function_header(self, addr, new_name, user=None, state=None):
+        return state.set_function_header(FunctionHeader(new_name, addr))
+
+    @init_checker
+    @make_state
+    def push_stack_variable(self, func_addr, offset, name, type_str, size, user=None, state=None):
+        stack_var = StackVariable(offset, binsync.data.StackOffsetType.IDA, name, type_str, size, func_addr)
+        return state.set_stack_variable(stack_var, offset, func_addr)
+
+    @init_checker
+    @make_state
+    def push_struct(self, struct, old_name, user=None, state=None):
+        return state.set_struct(struct, old_name)
+
+    #
+    # Bulk Operations
+    #
+
+    @init_checker
+    def dump_jsonl(self, fp: TextIO, users: Optional[Iterable[str]] = None) -> int:
+        """
+        Writes every artifact of every user (or only of @users) to @fp, one JSON object per line:
+            {"user": ..., "type": "function", "key": ..., "artifact": {...}}
+
+        @return: The number of artifacts written
+        """
+        users = list(users) if users is not None else [user.name for user in self.users()]
+        count = 0
+        for username in users:
+            state = self.client.get_state(user=username)
+            if state is None:
+                continue
+
+            for artifact_type, type_name in ARTIFACT_TYPE_NAMES.items():
+                for key, artifact in state._storage_container(artifact_type).items():
+                    record = {
+                        "user": username,
+                        "type": type_name,
+                        "key": key,
+                        "artifact": canonicalize(artifact.__getstate__()),
+                    }
+                    fp.write(json.dumps(record, sort_keys=True) + "\n")
+                    count += 1
+
+        return count
+
+    @init_checker
+    def import_json(self, fp: TextIO, msg="Bulk Import") -> int:
+        """
+        Imports artifacts into the local state in a single transaction, and so a single commit. The input
+        is either a JSON list or JSON lines of records, in the format of dump_jsonl ("user" and "key" are
+        ignored), or in one of the shorthands:
+            {"type": "function", "addr": 4198400, "name": "main"}
+            {"type": "comment", "addr": "0x401000", "comment": "...", "func_addr": "0x401000"}
+
+        @return: The number of artifacts that changed the local state
+        """
+        data = fp.read()
+        try:
+            records = json.loads(data)
+            if isinstance(records, dict):
+                records = [records]
+        except ValueError:
+            records = [json.loads(line) for line in data.splitlines() if line.strip()]
+
+        artifacts = [self._record_to_artifact(record) for record in records]
+        with self.client.transaction(msg=msg) as state:
+            return state.set_many(artifacts)
+
+    @staticmethod
+    def _record_to_artifact(record: Dict):
+        def addr(value):
+            return int(value, 0) if isinstance(value, str) else value
+
+        try:
+            artifact_type = ARTIFACT_NAME_TYPES[record["type"]]
+        except KeyError:
+            raise ValueError(f"Unknown artifact type in record {record}.")
+
+        if "artifact" in record:
+            return ARTIFACT_LOADERS[artifact_type].load(record["artifact"])
+
+        if artifact_type == ArtifactGroupType.FUNCTION:
+            return Function(addr(record["addr"]), header=FunctionHeader(record["name"], addr(record["addr"])))
+        elif artifact_type == ArtifactGroupType.COMMENT:
+            func_addr = record.get("func_addr", None)
+            return Comment(
+                addr(record["addr"]), record["comment"], decompiled=record.get("decompiled", False),
+                func_addr=addr(func_addr) if func_addr is not None else None
+            )
+
+        raise ValueError(f"Records of type {record['type']} need an \"artifact\".")
+
+    @init_checker
+    def stats(self) -> Dict:
+        """
+        Artifact counts and last changes of every user, with the client status and metrics.
+        """
+        users = {}
+        for user in self.users():
+            state = self.client.get_state(user=user.name)
+            if state is None:
+                continue
+
+            latest = state.recent(1)
+            users[user.name] = {
+                "functions": len(state.functions),
+                "comments": len(state.comments),
+                "patches": len(state.patches),
+                "structs": len(state.structs),
+                "last_change": latest[0][2] if latest else None,
+            }
+
+        return {
+            "users": users,
+            "client": {k: str(v) for k, v in self.client.status().items() if k != "metrics"},
+            "queue": self.queue_stats(),
+            "metrics": self.metrics(),
+        }
+
+    def serve(self, stop_event: Optional[threading.Event] = None):
+        """
+        Runs the sync loop until @stop_event is set or the process is interrupted.
+        """
+        stop_event = stop_event or threading.Event()
+        self.start_updater_routine()
+        try:
+            while not stop_event.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
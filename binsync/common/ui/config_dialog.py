@@ -16,6 +16,7 @@ else:
     from PyQt5.QtCore import QDir
 
 from ...client import ConnectionWarnings
+from ...profiling import PROFILER
 
 
 class SyncConfig(QDialog):
@@ -36,6 +37,7 @@ class SyncConfig(QDialog):
         self._repo_edit = None  # type:QLineEdit
         self._remote_edit = None  # type:QLineEdit
         self._initrepo_checkbox = None  # type:QCheckBox
+        self._profile_checkbox = None  # type:QCheckBox
 
         self._init_widgets()
         self.setLayout(self._main_layout)
@@ -96,6 +98,16 @@ class SyncConfig(QDialog):
         upper_layout.addWidget(self._initrepo_checkbox, row, 1)
         row += 1
 
+        # profiling checkbox
+        self._profile_checkbox = QCheckBox(self)
+        self._profile_checkbox.setText("Profile syncing")
+        self._profile_checkbox.setToolTip("Write a profile of every sync cycle to "
+                                          f"{PROFILER.output_dir or PROFILER.DEFAULT_DIR}, for reporting slowdowns.")
+        self._profile_checkbox.setChecked(PROFILER.enabled)
+
+        upper_layout.addWidget(self._profile_checkbox, row, 1)
+        row += 1
+
         # buttons
         self._ok_button = QPushButton(self)
         self._ok_button.setText("OK")
@@ -142,6 +154,12 @@ class SyncConfig(QDialog):
                                        )
             return
 
+        if self._profile_checkbox.isChecked():
+            if not PROFILER.enabled:
+                PROFILER.enable()
+        else:
+            PROFILER.disable()
+
         # convert to remote repo if no local is provided
         if not self.is_git_repo(path):
             remote_url = self._remote_edit.text()
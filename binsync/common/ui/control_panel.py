@@ -1,17 +1,23 @@
+import collections
 import datetime
+import time
 
 import binsync.data
+from binsync.metrics import REGISTRY
 
 from . import ui_version
 if ui_version == "PySide2":
-    from PySide2.QtWidgets import QVBoxLayout, QGroupBox, QWidget, QLabel, QTabWidget, QTableWidget, QStatusBar
-    from PySide2.QtCore import Signal
+    from PySide2.QtWidgets import QVBoxLayout, QGroupBox, QWidget, QLabel, QTabWidget, QTableWidget, QStatusBar, \
+        QLineEdit
+    from PySide2.QtCore import Signal, QTimer
 elif ui_version == "PySide6":
-    from PySide6.QtWidgets import QVBoxLayout, QGroupBox, QWidget, QLabel, QTabWidget, QTableWidget, QStatusBar
-    from PySide6.QtCore import Signal
+    from PySide6.QtWidgets import QVBoxLayout, QGroupBox, QWidget, QLabel, QTabWidget, QTableWidget, QStatusBar, \
+        QLineEdit
+    from PySide6.QtCore import Signal, QTimer
 else:
-    from PyQt5.QtWidgets import QVBoxLayout, QGroupBox, QWidget, QLabel, QTabWidget, QTableWidget, QStatusBar
-    from PyQt5.QtCore import pyqtSignal as Signal
+    from PyQt5.QtWidgets import QVBoxLayout, QGroupBox, QWidget, QLabel, QTabWidget, QTableWidget, QStatusBar, \
+        QLineEdit
+    from PyQt5.QtCore import pyqtSignal as Signal, QTimer
 
 from .tables.functions_table import QFunctionTable
 from .tables.activity_table import QActivityTable
@@ -20,14 +26,32 @@ from .tables.globals_table import QGlobalsTable
 
 
 class ControlPanel(QWidget):
-    update_ready = Signal()
-    ctx_change = Signal()
+    """
+    Table rows are computed off the UI thread, by the controller's timer thread, and only the diffs of the
+    rows are sent to the UI thread with update_ready and ctx_change. The UI thread applies them at most
+    FRAME_BUDGET seconds at a time, so large updates are spread over several event loop iterations
+    instead of freezing the decompiler.
+
+    The search box filters the functions, globals and activity tables to the matches of the controller's
+    aggregate index, which keeps its search index up to date as it is refreshed.
+    """
+
+    # seconds of table updates per event loop iteration
+    FRAME_BUDGET = 0.01
+    # milliseconds of no typing in the search box before searching
+    SEARCH_DELAY = 200
+
+    update_ready = Signal(object)
+    ctx_change = Signal(object)
 
     def __init__(self, controller, parent=None):
         super(ControlPanel, self).__init__(parent)
         self.controller = controller
 
         self.tables = {}
+        # (table name, iterator of RowDiff operations) not applied yet, in order
+        self._pending_updates = collections.deque()
+        self._apply_scheduled = False
         self._init_widgets()
 
         # register controller callback
@@ -44,19 +68,23 @@ class ControlPanel(QWidget):
 
         @return:
         """
-        self._update_table_data()
-        self.update_ready.emit()
+        self.update_ready.emit(self._update_table_data())
 
     def ctx_callback(self):
+        diffs = {}
         if isinstance(self.controller.last_ctx, binsync.data.Function):
-            self._ctx_table.update_table(new_ctx=self.controller.last_ctx.addr)
+            diffs["context"] = self._ctx_table.update_table(new_ctx=self.controller.last_ctx.addr)
 
-        self.ctx_change.emit()
+        self.ctx_change.emit(diffs)
 
-    def reload(self):
+    def reload(self, diffs=None):
         # check if connected
-        if self.controller and self.controller.check_client():
-            self._reload_tables()
+        if diffs and self.controller and self.controller.check_client():
+            self._queue_table_updates(diffs)
+
+            # rows of new matches may have just been added
+            if self._search_box.text().strip():
+                self._apply_search()
 
         # update status
         status = self.controller.status_string() if self.controller else "Disconnected"
@@ -76,6 +104,17 @@ class ControlPanel(QWidget):
         # control box
         control_layout = QVBoxLayout()
 
+        # search box
+        self._search_box = QLineEdit(self)
+        self._search_box.setPlaceholderText("Search functions, structs, users, comments")
+        self._search_box.setClearButtonEnabled(True)
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(self.SEARCH_DELAY)
+        self._search_timer.timeout.connect(self._apply_search)
+        # restart the delay on every edit, the text itself is read when it runs out
+        self._search_box.textChanged.connect(lambda _: self._search_timer.start())
+
         # tabs for tables
         self.tabView = QTabWidget()
 
@@ -98,24 +137,74 @@ class ControlPanel(QWidget):
         })
 
         main_layout = QVBoxLayout()
+        main_layout.addWidget(self._search_box)
         main_layout.addWidget(self.tabView)
         main_layout.addWidget(self._status_bar)
 
         self.setLayout(main_layout)
 
-    def _reload_ctx(self):
+    def _reload_ctx(self, diffs=None):
         ctx_name = self.controller.last_ctx.name or ""
         ctx_name = ctx_name[:12] + "..." if len(ctx_name) > 12 else ctx_name
         self._status_bar.showMessage(f"{ctx_name}@{hex(self.controller.last_ctx.addr)}")
-        self._ctx_table.reload()
+        if diffs:
+            self._queue_table_updates(diffs)
 
-    def _reload_tables(self):
-        for _, table in self.tables.items():
-            table.reload()
+    def _apply_search(self):
+        """
+        Filters the tables to the matches of the search box, or shows every row if it is empty.
+        """
+        query = self._search_box.text().strip()
+        if not query:
+            for table in (self._func_table, self._global_table, self._activity_table):
+                table.set_filter_keys(None)
+            return
 
-    def _update_table_data(self):
-        if self.controller.client.has_remote:
-            self.controller.client.init_remote()
+        with REGISTRY.timer("binsync_ui_search_seconds", "Seconds spent searching the aggregate index"):
+            results = self.controller.aggregate.search(query)
+
+        self._func_table.set_filter_keys(results.functions)
+        self._global_table.set_filter_keys(results.structs)
+        self._activity_table.set_filter_keys(results.users)
 
-        for _, table in self.tables.items():
-            table.update_table()
+    def _queue_table_updates(self, diffs):
+        for name, diff in diffs.items():
+            if diff:
+                self._pending_updates.append((name, diff.operations()))
+
+        self._apply_table_updates()
+
+    def _apply_table_updates(self):
+        """
+        Applies queued row diffs until the frame budget is used up, then continues in the next event loop
+        iteration. Diffs of a table are applied in the order they were computed.
+        """
+        self._apply_scheduled = False
+        start = time.perf_counter()
+        deadline = start + self.FRAME_BUDGET
+        while self._pending_updates:
+            name, operations = self._pending_updates[0]
+            if not self.tables[name].table_model.apply_operations(operations, deadline=deadline):
+                break
+            self._pending_updates.popleft()
+
+        REGISTRY.histogram("binsync_ui_apply_seconds", "Seconds spent applying row diffs per frame").observe(
+            time.perf_counter() - start
+        )
+        if self._pending_updates and not self._apply_scheduled:
+            self._apply_scheduled = True
+            QTimer.singleShot(0, self._apply_table_updates)
+
+    def _update_table_data(self):
+        """
+        Computes the row diffs of every table, off the UI thread. New remote branches are tracked
+        by the client updates of the git thread.
+        """
+        # all tables read from the aggregate index, which is refreshed once for all of them
+        changes = self.controller.refresh_aggregate()
+        diffs = {}
+        for name, table in self.tables.items():
+            with REGISTRY.timer("binsync_ui_update_seconds", "Seconds spent updating the data of a table", table=name):
+                diffs[name] = table.update_table(changes=changes)
+
+        return diffs
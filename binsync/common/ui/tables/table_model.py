@@ -0,0 +1,355 @@
+import time
+from typing import Dict, Hashable, Iterable, Iterator, Optional, Set, Tuple
+
+from .. import ui_version
+if ui_version == "PySide2":
+    from PySide2.QtWidgets import QTableView, QAbstractItemView, QHeaderView
+    from PySide2.QtCore import Qt, QAbstractTableModel, QModelIndex, QSortFilterProxyModel
+elif ui_version == "PySide6":
+    from PySide6.QtWidgets import QTableView, QAbstractItemView, QHeaderView
+    from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QSortFilterProxyModel
+else:
+    from PyQt5.QtWidgets import QTableView, QAbstractItemView, QHeaderView
+    from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QSortFilterProxyModel
+
+from ..utils import friendly_datetime
+
+
+class RowDiff:
+    """
+    The rows that differ between two versions of a table. Diffs are computed off the UI thread and handed
+    to it, so rows are immutable tuples and a diff is never changed once it is handed over.
+
+    :ivar dict added:   Row of every new key
+    :ivar dict changed: New row of every key whose row differs
+    :ivar list removed: Keys that are no longer in the table
+    """
+
+    REMOVE = "remove"
+    CHANGE = "change"
+    ADD = "add"
+
+    __slots__ = ("added", "changed", "removed")
+
+    def __init__(self, added=None, changed=None, removed=None):
+        self.added = added or {}  # type: Dict[Hashable, tuple]
+        self.changed = changed or {}  # type: Dict[Hashable, tuple]
+        self.removed = removed or []  # type: List[Hashable]
+
+    def __len__(self):
+        return len(self.added) + len(self.changed) + len(self.removed)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def operations(self) -> Iterator[Tuple[str, Hashable, Optional[tuple]]]:
+        """
+        Yields the diff as (operation, key, row) tuples, with the operations REMOVE, CHANGE and ADD.
+        """
+        for key in self.removed:
+            yield RowDiff.REMOVE, key, None
+        for key, row in self.changed.items():
+            yield RowDiff.CHANGE, key, row
+        for key, row in self.added.items():
+            yield RowDiff.ADD, key, row
+
+
+def diff_rows(old: Dict[Hashable, tuple], new: Dict[Hashable, tuple]) -> RowDiff:
+    diff = RowDiff()
+    for key, row in new.items():
+        old_row = old.get(key, None)
+        if old_row is None:
+            diff.added[key] = row
+        elif old_row != row:
+            diff.changed[key] = row
+
+    diff.removed = [key for key in old if key not in new]
+    return diff
+
+
+class BinSyncTableModel(QAbstractTableModel):
+    """
+    The rows of a control panel table, each a tuple of plain values stored under a unique key (an
+    address, a struct name, a user name). Tables are updated with RowDiffs, so only the rows that changed
+    are signaled to the views. Row positions in the model are arbitrary; views sort through a proxy on
+    the Qt.UserRole data, which is the raw value of a cell.
+    """
+
+    HEADER = []
+    # columns of addresses, shown in hex
+    ADDR_COLUMNS = ()
+    # columns of unix timestamps, shown relative to now
+    TIME_COLUMNS = ()
+
+    def __init__(self, parent=None):
+        super(BinSyncTableModel, self).__init__(parent)
+        self._keys = []  # type: List[Hashable]
+        self._rows = {}  # type: Dict[Hashable, tuple]
+        self._positions = {}  # type: Dict[Hashable, int]
+
+    #
+    # Qt model interface
+    #
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._keys)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADER)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADER[section]
+
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        value = self._rows[self._keys[index.row()]][index.column()]
+        if role == Qt.DisplayRole:
+            return self.display_value(index.column(), value)
+        elif role == Qt.UserRole:
+            return self.sort_value(index.column(), value)
+
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    #
+    # Cell values
+    #
+
+    def display_value(self, column, value):
+        if value is None:
+            return ""
+        if column in self.TIME_COLUMNS:
+            return friendly_datetime(value)
+        if column in self.ADDR_COLUMNS and isinstance(value, int):
+            return hex(value)
+
+        return str(value)
+
+    def sort_value(self, column, value):
+        if value is None:
+            return -1 if column in self.TIME_COLUMNS or column in self.ADDR_COLUMNS else ""
+
+        return value
+
+    #
+    # Rows
+    #
+
+    @property
+    def rows(self) -> Dict[Hashable, tuple]:
+        return self._rows
+
+    def key(self, row: int) -> Hashable:
+        return self._keys[row]
+
+    def row_data(self, key) -> Optional[tuple]:
+        return self._rows.get(key, None)
+
+    def apply_operations(self, operations: Iterator, deadline: Optional[float] = None, chunk_size=256) -> bool:
+        """
+        Applies operations of a RowDiff.operations() iterator until it is exhausted or, checked after every
+        chunk of operations, time.perf_counter() passes @deadline. Consecutive additions are inserted at
+        once.
+
+        @return: True if every operation was applied, False if some are left in @operations
+        """
+        while True:
+            chunk = []
+            for op in operations:
+                chunk.append(op)
+                if len(chunk) >= chunk_size:
+                    break
+
+            added = {}
+            for op, key, row in chunk:
+                if op == RowDiff.ADD:
+                    added[key] = row
+                    continue
+
+                if added:
+                    self.add_rows(added)
+                    added = {}
+                if op == RowDiff.REMOVE:
+                    self.remove_rows([key])
+                else:
+                    self.change_rows({key: row})
+            if added:
+                self.add_rows(added)
+
+            if len(chunk) < chunk_size:
+                return True
+            if deadline is not None and time.perf_counter() >= deadline:
+                return False
+
+    def apply_diff(self, diff: RowDiff) -> int:
+        self.remove_rows(diff.removed)
+        self.change_rows(diff.changed)
+        self.add_rows(diff.added)
+        return len(diff)
+
+    def remove_rows(self, keys: Iterable[Hashable]):
+        for key in keys:
+            pos = self._positions.pop(key, None)
+            if pos is None:
+                continue
+
+            # the last row is removed and then put in the hole, so a removal never shifts the rows after it.
+            # Views see every step, each leaving the keys and the row count consistent.
+            last = len(self._keys) - 1
+            self.beginRemoveRows(QModelIndex(), last, last)
+            last_key = self._keys.pop()
+            self.endRemoveRows()
+
+            if pos != last:
+                # indexes kept on the removed row must not follow the row that replaces it
+                self.changePersistentIndexList(
+                    [self.index(pos, column) for column in range(len(self.HEADER))],
+                    [QModelIndex()] * len(self.HEADER)
+                )
+                self._keys[pos] = last_key
+                self._positions[last_key] = pos
+                self._emit_row_changed(pos)
+            del self._rows[key]
+
+    def change_rows(self, rows: Dict[Hashable, tuple]):
+        for key, row in rows.items():
+            pos = self._positions.get(key, None)
+            if pos is None:
+                continue
+
+            self._rows[key] = row
+            self._emit_row_changed(pos)
+
+    def add_rows(self, rows: Dict[Hashable, tuple]):
+        new_keys = [key for key in rows if key not in self._positions]
+        if not new_keys:
+            return
+
+        first = len(self._keys)
+        self.beginInsertRows(QModelIndex(), first, first + len(new_keys) - 1)
+        for key in new_keys:
+            self._positions[key] = len(self._keys)
+            self._keys.append(key)
+            self._rows[key] = rows[key]
+        self.endInsertRows()
+
+    def _emit_row_changed(self, pos):
+        self.dataChanged.emit(self.index(pos, 0), self.index(pos, len(self.HEADER) - 1))
+
+
+class KeyFilterProxyModel(QSortFilterProxyModel):
+    """
+    Sorts the rows of a BinSyncTableModel and shows only the rows of a set of keys, like the matches of a
+    search. Filtering checks a row's key against the set instead of matching text against every cell.
+    """
+
+    def __init__(self, parent=None):
+        super(KeyFilterProxyModel, self).__init__(parent)
+        self._keys = None  # type: Optional[Set[Hashable]]
+
+    @property
+    def keys(self) -> Optional[Set[Hashable]]:
+        return self._keys
+
+    def set_keys(self, keys: Optional[Set[Hashable]]):
+        """
+        Shows only the rows of @keys, or every row if @keys is None.
+        """
+        if keys is None and self._keys is None:
+            return
+
+        self._keys = keys
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self._keys is None:
+            return True
+
+        return self.sourceModel().key(source_row) in self._keys
+
+
+class BinSyncTableView(QTableView):
+    """
+    A read-only, sortable view of a BinSyncTableModel, shared by all control panel tables, that can be
+    filtered down to a set of keys.
+
+    Tables compute their rows off the UI thread into `rows`, which only that thread touches, and return
+    the RowDiff of every update. The UI thread applies the diffs to the model, so the two threads never
+    share a mutable structure.
+    """
+
+    def __init__(self, table_model: BinSyncTableModel, parent=None):
+        super(BinSyncTableView, self).__init__(parent)
+        self.table_model = table_model
+        self.rows = {}  # type: Dict[Hashable, tuple]
+
+        self.proxy_model = KeyFilterProxyModel(self)
+        self.proxy_model.setSourceModel(self.table_model)
+        self.proxy_model.setSortRole(Qt.UserRole)
+        self.proxy_model.setDynamicSortFilter(True)
+        self.setModel(self.proxy_model)
+
+        self.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.horizontalHeader().setHorizontalScrollMode(self.ScrollPerPixel)
+        self.horizontalHeader().setDefaultAlignment(Qt.AlignHCenter | Qt.Alignment(Qt.TextWordWrap))
+        self.horizontalHeader().setMinimumWidth(160)
+        self.setHorizontalScrollMode(self.ScrollPerPixel)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.verticalHeader().setVisible(False)
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.verticalHeader().setDefaultSectionSize(24)
+
+        self.setSortingEnabled(True)
+
+    def _replace_rows(self, rows: Dict[Hashable, tuple]) -> RowDiff:
+        diff = diff_rows(self.rows, rows)
+        self.rows = rows
+        return diff
+
+    def _update_rows(self, rows: Dict[Hashable, Optional[tuple]]) -> RowDiff:
+        """
+        Updates the rows of the keys in @rows, where a None row removes the key.
+        """
+        diff = RowDiff()
+        for key, row in rows.items():
+            old_row = self.rows.get(key, None)
+            if row is None:
+                if old_row is not None:
+                    del self.rows[key]
+                    diff.removed.append(key)
+                continue
+
+            if old_row is None:
+                diff.added[key] = row
+            elif old_row != row:
+                diff.changed[key] = row
+            self.rows[key] = row
+
+        return diff
+
+    def set_filter_keys(self, keys: Optional[Set[Hashable]]):
+        """
+        Shows only the rows of @keys, or every row if @keys is None. Runs on the UI thread.
+        """
+        self.proxy_model.set_keys(keys)
+
+    def key_at(self, pos) -> Optional[Hashable]:
+        """
+        Returns the key of the row at @pos in viewport coordinates, None if there is no row there.
+        """
+        index = self.indexAt(pos)
+        if not index.isValid():
+            return None
+
+        return self.table_model.key(self.proxy_model.mapToSource(index).row())
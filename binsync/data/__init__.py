@@ -1,6 +1,8 @@
 from .user import User
+from .artifact import Artifact, canonicalize, dumps_canonical, hash_state
 from .func import Function, FunctionHeader
 from .comment import Comment
 from .patch import Patch
 from .stack_variable import StackVariable, StackOffsetType
 from .struct import StructMember, Struct
+from .interning import StringTable, STRING_TABLE, intern_str
@@ -1,14 +1,68 @@
+import codecs
+import hashlib
+import json
+
 import toml
 from typing import Dict
 
+from .interning import intern_str
+
+# properties that change without the artifact itself changing
+VOLATILE_KEYS = frozenset((
+    "last_change",
+))
+
+
+def canonicalize(obj, drop_keys=frozenset()):
+    """
+    Converts a serializable state into its canonical form: dict keys are sorted, None values are
+    dropped (TOML can not store them anyway), bytes become hex strings, and any key in @drop_keys is
+    removed at every level. Two semantically identical states always canonicalize the same way.
+
+    @param obj:         A state, normally the output of __getstate__
+    @param drop_keys:   Keys to remove, like VOLATILE_KEYS
+    @return:
+    """
+    if isinstance(obj, dict):
+        return {
+            str(k): canonicalize(obj[k], drop_keys=drop_keys) for k in sorted(obj, key=str)
+            if k not in drop_keys and obj[k] is not None
+        }
+    elif isinstance(obj, (list, tuple)):
+        return [canonicalize(v, drop_keys=drop_keys) for v in obj]
+    elif isinstance(obj, (bytes, bytearray)):
+        return codecs.encode(obj, "hex").decode()
+    elif isinstance(obj, float) and obj.is_integer():
+        return int(obj)
+
+    return obj
+
+
+def dumps_canonical(state: Dict) -> str:
+    """
+    Dumps a state to a deterministic TOML string.
+    """
+    return toml.dumps(canonicalize(state))
+
+
+def hash_state(state) -> str:
+    """
+    Hashes the canonical form of a state, ignoring all volatile properties.
+    """
+    canonical = json.dumps(canonicalize(state, drop_keys=VOLATILE_KEYS), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
 
 class Artifact:
     __slots__ = (
         "last_change"
     )
 
+    # string properties that are loaded through the shared string table
+    _interned = ()
+
     def __init__(self, last_change=None):
-        self.last_change = None
+        self.last_change = last_change
 
     def __getstate__(self) -> Dict:
         """
@@ -30,7 +84,8 @@ class Artifact:
         @return:
         """
         for k in self.__slots__:
-            setattr(self, k, state.get(k, None))
+            v = state.get(k, None)
+            setattr(self, k, intern_str(v) if k in self._interned else v)
 
     def __eq__(self, other):
         """
@@ -58,7 +113,28 @@ class Artifact:
 
         @return:
         """
-        return toml.dumps(self.__getstate__())
+        return dumps_canonical(self.__getstate__())
+
+    def content_hash(self) -> str:
+        """
+        Returns a hash of the properties of the artifact that excludes volatile properties (like
+        last_change). Two artifacts that are == always share a content hash.
+
+        @return:
+        """
+        return hash_state(self.__getstate__())
+
+    @classmethod
+    def load(cls, state: Dict):
+        """
+        Creates an artifact from an already parsed TOML dict, skipping a round trip through a string.
+
+        @param state: Dict
+        @return:
+        """
+        artifact = cls.__new__(cls)
+        artifact.__setstate__(state)
+        return artifact
 
     @classmethod
     def parse(cls, s):
@@ -7,6 +7,7 @@ from typing import Dict, Optional
 from collections import defaultdict
 
 from .artifact import Artifact
+from .interning import intern_str
 from .stack_variable import StackVariable
 
 
@@ -23,6 +24,11 @@ class FunctionArgument(Artifact):
         "size"
     )
 
+    _interned = (
+        "name",
+        "type_str",
+    )
+
     def __init__(self, idx, name, type_str, size, last_change=None):
         super(FunctionArgument, self).__init__(last_change=last_change)
         self.idx = idx
@@ -69,12 +75,18 @@ class FunctionHeader(Artifact):
 
     def __setstate__(self, state):
         self.last_change = state.get("last_change", None)
-        self.name = state.get("name", None)
+        self.name = intern_str(state.get("name", None))
         self.addr = state["addr"]
         self.comment = state.get("comment", None)
-        self.ret_type = state.get("ret_type", None)
-        args = state.get("args", {})
-        self.args = {int(idx, 16): StackVariable.parse(toml.dumps(arg)) for idx, arg in args.items()}
+        self.ret_type = intern_str(state.get("ret_type", None))
+        args = state.get("args", None) or {}
+        self.args = {int(idx, 16): FunctionArgument.load(arg) for idx, arg in args.items()}
+
+    def copy(self) -> "FunctionHeader":
+        return FunctionHeader(
+            self.name, self.addr, comment=self.comment, ret_type=self.ret_type, args=self.args.copy(),
+            last_change=self.last_change
+        )
 
     @classmethod
     def parse(cls, s):
@@ -138,12 +150,22 @@ class Function(Artifact):
         self.addr = metadata["addr"]
         self.last_change = metadata.get("last_change", None)
 
-        self.header = FunctionHeader.parse(toml.dumps(header)) if header else None
+        self.header = FunctionHeader.load(header) if header else None
 
         self.stack_vars = {
-            int(off, 16): StackVariable.parse(toml.dumps(stack_var)) for off, stack_var in stack_vars.items()
+            int(off, 16): StackVariable.load(stack_var) for off, stack_var in stack_vars.items()
         } if stack_vars else {}
 
+    def copy(self) -> "Function":
+        """
+        Copies the function and the containers it owns. The StackVariables and FunctionArguments
+        themselves are shared, since they are always replaced rather than modified.
+        """
+        return Function(
+            self.addr, header=self.header.copy() if self.header else None, stack_vars=self.stack_vars.copy(),
+            last_change=self.last_change
+        )
+
     @classmethod
     def parse(cls, s):
         func = Function(None)
@@ -0,0 +1,98 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class StringTable:
+    """
+    A table of interned strings shared by all the artifact loaders. Strings like type names
+    ("unsigned int", "char *", struct names) repeat across every StackVariable, StructMember and
+    FunctionArgument of every user's State, so loading them through this table makes every
+    duplicate point at a single str object.
+
+    str objects cannot be weakly referenced, so the table keeps a strong reference to every string it
+    holds. It is bounded to the @max_size most recently used strings and can be emptied with clear().
+
+    :ivar int max_size:     Maximum number of strings kept in the table.
+    :ivar int hits:         Number of lookups that returned an already interned string.
+    :ivar int misses:       Number of lookups that added a new string to the table.
+    :ivar int bytes_saved:  Approximate number of bytes that were not kept alive thanks to hits.
+    :ivar int evictions:    Number of least recently used strings dropped to stay under max_size.
+    """
+
+    MAX_SIZE = 0x10000
+
+    def __init__(self, max_size: int = MAX_SIZE):
+        self.max_size = max_size
+        self._strings = OrderedDict()  # type: OrderedDict[str, str]
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __contains__(self, s):
+        return s in self._strings
+
+    def intern(self, s: Optional[str]) -> Optional[str]:
+        """
+        Returns the canonical copy of @s. Anything that is not a str is returned untouched so that
+        loaders can pass values straight from a parsed TOML dict.
+
+        @param s:   String to intern
+        @return:    The interned string
+        """
+        if type(s) is not str:
+            return s
+
+        with self._lock:
+            interned = self._strings.get(s, None)
+            if interned is None:
+                self._strings[s] = s
+                self.misses += 1
+                while len(self._strings) > self.max_size:
+                    self._strings.popitem(last=False)
+                    self.evictions += 1
+                return s
+
+            self._strings.move_to_end(s)
+            if interned is not s:
+                self.bytes_saved += sys.getsizeof(s)
+            self.hits += 1
+            return interned
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "strings": len(self._strings),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "bytes_saved": self.bytes_saved,
+            "evictions": self.evictions,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._strings.clear()
+            self.hits = 0
+            self.misses = 0
+            self.bytes_saved = 0
+            self.evictions = 0
+
+
+# the table shared by every loader in binsync.data
+STRING_TABLE = StringTable()
+
+
+def intern_str(s: Optional[str]) -> Optional[str]:
+    return STRING_TABLE.intern(s)
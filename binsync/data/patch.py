@@ -25,12 +25,12 @@ class Patch(Artifact):
         return {
             "obj_name": self.obj_name,
             "offset": hex(self.offset),
-            "new_bytes": codecs.encode(self.new_bytes, "hex"),
+            "new_bytes": codecs.encode(self.new_bytes, "hex").decode() if self.new_bytes is not None else None,
             "last_change": self.last_change
         }
 
     def __setstate__(self, state):
-        self.obj_name = state["obj_name"]
+        self.obj_name = state.get("obj_name", None)
         self.offset = int(state["offset"], 16)
         self.new_bytes = codecs.decode(state["new_bytes"], "hex")
         self.last_change = state.get("last_change", None)
@@ -55,6 +55,6 @@ class Patch(Artifact):
     @classmethod
     def dump_many(cls, patches):
         patches_ = {}
-        for v in patches.values():
+        for v in sorted(patches.values(), key=lambda x: x.offset):
             patches_["%s_%x" % (v.obj_name, v.offset)] = v.__getstate__()
         return patches_
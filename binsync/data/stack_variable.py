@@ -25,6 +25,11 @@ class StackVariable(Artifact):
         "type",
     )
 
+    _interned = (
+        "name",
+        "type",
+    )
+
     def __init__(self, stack_offset, offset_type, name, type_, size, func_addr, last_change=None):
         super(StackVariable, self).__init__(last_change=last_change)
         self.stack_offset = stack_offset  # type: int
@@ -67,9 +72,7 @@ class StackVariable(Artifact):
     @classmethod
     def load_many(cls, svs_toml):
         for sv_toml in svs_toml.values():
-            sv = StackVariable(None, None, None, None, None, None)
-            sv.__setstate__(sv_toml)
-            yield sv
+            yield StackVariable.load(sv_toml)
 
     @classmethod
     def dump_many(cls, svs):
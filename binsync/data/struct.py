@@ -2,6 +2,7 @@ import toml
 from typing import List, Dict
 
 from .artifact import Artifact
+from .interning import intern_str
 
 
 class StructMember(Artifact):
@@ -17,6 +18,11 @@ class StructMember(Artifact):
         "size",
     )
 
+    _interned = (
+        "member_name",
+        "type",
+    )
+
     def __init__(self, member_name, offset, type_, size, last_change=None):
         super(StructMember, self).__init__(last_change=last_change)
         self.member_name: str = member_name
@@ -60,14 +66,14 @@ class Struct(Artifact):
 
     def __setstate__(self, state):
         metadata = state["metadata"]
-        members = state["members"]
+        members = state.get("members", {})
 
-        self.name = metadata["name"]
-        self.size = members["size"]
-        self.last_change = members.get("last_change", None)
+        self.name = intern_str(metadata["name"])
+        self.size = metadata["size"]
+        self.last_change = metadata.get("last_change", None)
 
         self.struct_members = [
-            StructMember.parse(toml.dumps(member)) for _, member in members.items()
+            StructMember.load(member) for _, member in members.items()
         ]
 
     def add_struct_member(self, mname, moff, mtype, size):
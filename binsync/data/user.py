@@ -1,5 +1,7 @@
 import uuid
 
+from .interning import intern_str
+
 
 class User:
     """
@@ -21,7 +23,7 @@ class User:
     @classmethod
     def from_metadata(cls, metadata):
         u = cls(
-            metadata["user"],
+            intern_str(metadata["user"]),
             uid=metadata.get("uid", None),
             client=metadata.get("client", None),
             last_push_time=metadata.get("last_push_time", -1),
@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import threading
+from typing import Iterable, List, Optional
+
+import git
+import toml
+
+from .data import Function, Comment, Patch, Struct
+from .state import ArtifactGroupType
+
+l = logging.getLogger(__name__)
+
+
+class HistoryEntry:
+    """
+    A single change of an artifact, as found in a user's commit log.
+
+    :ivar str user:         The user whose branch the change was committed to
+    :ivar str commit:       Hexsha of the commit
+    :ivar int timestamp:    Unix time of the commit
+    :ivar str summary:      What the artifact was after the change: a function or struct name, a comment,
+                            patch bytes. None if the artifact was removed.
+    :ivar bool removed:     True if the change removed the artifact
+    """
+
+    __slots__ = ("user", "commit", "timestamp", "summary", "removed")
+
+    def __init__(self, user, commit, timestamp, summary=None, removed=False):
+        self.user = user
+        self.commit = commit
+        self.timestamp = timestamp
+        self.summary = summary
+        self.removed = removed
+
+    def __repr__(self):
+        return f"<HistoryEntry {self.user}@{self.commit[:8]}: {self.summary}>"
+
+    def to_list(self) -> list:
+        return [self.user, self.commit, self.timestamp, self.summary, self.removed]
+
+    @classmethod
+    def from_list(cls, values) -> "HistoryEntry":
+        return cls(*values)
+
+
+def _summarize(artifact) -> Optional[str]:
+    if artifact is None:
+        return None
+    if isinstance(artifact, Function):
+        return artifact.name
+    if isinstance(artifact, Struct):
+        return artifact.name
+    if isinstance(artifact, Comment):
+        return artifact.comment
+    if isinstance(artifact, Patch):
+        return artifact.new_bytes.hex() if isinstance(artifact.new_bytes, bytes) else artifact.new_bytes
+
+    return str(artifact)
+
+
+def _read_toml(tree: Optional[git.Tree], path):
+    if tree is None:
+        return None
+
+    try:
+        return toml.loads(tree[path].data_stream.read().decode())
+    except Exception:
+        return None
+
+
+class ArtifactHistory:
+    """
+    An index from every artifact to its change history across all users, so questions like "who last
+    renamed this function, when, and what was it called before" do not require walking every commit log.
+
+    The index is a local cache stored as json lines in the .git directory. For every user it remembers the
+    last commit it indexed, so each update only reads the commits made since then. Changes are found by
+    diffing every commit with its first parent, which attributes merged changes to the merging user.
+
+    Every update appends a segment line with only what it indexed, and the file is rewritten as a single
+    segment once it holds COMPACT_SEGMENTS of them.
+    """
+
+    FILENAME = "binsync_history.jsonl"
+    VERSION = 2
+    COMPACT_SEGMENTS = 64
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._indexed = {}  # type: Dict[str, str]
+        self._history = {}  # type: Dict[tuple, List[HistoryEntry]]
+        self._segments = 0
+        self._lock = threading.RLock()
+
+        if self.path is not None:
+            self.load()
+
+    def __len__(self):
+        return len(self._history)
+
+    #
+    # Queries
+    #
+
+    def history(self, artifact_type, key) -> List[HistoryEntry]:
+        """
+        Returns every change of an artifact, oldest first.
+        """
+        with self._lock:
+            return list(self._history.get((artifact_type, key), []))
+
+    def last_change(self, artifact_type, key, user=None) -> Optional[HistoryEntry]:
+        with self._lock:
+            for entry in reversed(self._history.get((artifact_type, key), [])):
+                if user is None or entry.user == user:
+                    return entry
+
+        return None
+
+    def change_count(self, artifact_type, key, user=None) -> int:
+        with self._lock:
+            entries = self._history.get((artifact_type, key), [])
+            if user is None:
+                return len(entries)
+
+            return sum(1 for entry in entries if entry.user == user)
+
+    def indexed_commit(self, user) -> Optional[str]:
+        return self._indexed.get(user, None)
+
+    #
+    # Indexing
+    #
+
+    def update(self, repo: git.Repo, user_refs: Iterable) -> int:
+        """
+        Indexes every commit made to the users' branches since the last update.
+
+        @param repo:        The binsync repo
+        @param user_refs:   (user, ref) pairs of the branches to index
+        @return:            The number of new history entries
+        """
+        segment = {"indexed": {}, "forget": [], "entries": []}
+        with self._lock:
+            for user, ref in user_refs:
+                head = ref.commit.hexsha
+                last = self._indexed.get(user, None)
+                if last == head:
+                    continue
+
+                rev = f"{last}..{head}" if last is not None else head
+                try:
+                    commits = list(repo.iter_commits(rev, first_parent=True, reverse=True))
+                except git.GitCommandError:
+                    # the indexed commit is gone (e.g. a force push), index the branch from scratch
+                    self._forget_user(user)
+                    segment["forget"].append(user)
+                    commits = list(repo.iter_commits(head, first_parent=True, reverse=True))
+
+                for commit in commits:
+                    segment["entries"] += self._index_commit(user, commit)
+
+                self._indexed[user] = head
+                segment["indexed"][user] = head
+
+            if segment["indexed"]:
+                self.save(segment)
+
+        return len(segment["entries"])
+
+    def _forget_user(self, user):
+        for key in list(self._history):
+            entries = [e for e in self._history[key] if e.user != user]
+            if entries:
+                self._history[key] = entries
+            else:
+                del self._history[key]
+        self._indexed.pop(user, None)
+
+    def _index_commit(self, user, commit: git.Commit) -> List[list]:
+        """
+        Indexes the changes of a single commit.
+
+        @return: The new entries, as [artifact_type, key, *entry] lists
+        """
+        parent_tree = commit.parents[0].tree if commit.parents else None
+        diffs = parent_tree.diff(commit.tree) if parent_tree is not None else None
+        if diffs is None:
+            paths = {blob.path for blob in commit.tree.traverse() if blob.type == "blob"}
+        else:
+            paths = {p for diff in diffs for p in (diff.a_path, diff.b_path) if p}
+
+        new_entries = []
+        for path in paths:
+            for artifact_type, key, artifact in self._changed_artifacts(path, parent_tree, commit.tree):
+                entry = HistoryEntry(
+                    user, commit.hexsha, commit.committed_date, summary=_summarize(artifact), removed=artifact is None
+                )
+                self._history.setdefault((artifact_type, key), []).append(entry)
+                new_entries.append([artifact_type, key] + entry.to_list())
+
+        return new_entries
+
+    @staticmethod
+    def _changed_artifacts(path, old_tree, new_tree):
+        """
+        Yields (artifact_type, key, new artifact or None) for every artifact that differs in @path.
+        """
+        if path.startswith("functions") or path.startswith("structs"):
+            cls, artifact_type = (Function, ArtifactGroupType.FUNCTION) if path.startswith("functions") \
+                else (Struct, ArtifactGroupType.STRUCT)
+            old_toml, new_toml = _read_toml(old_tree, path), _read_toml(new_tree, path)
+            old = cls.load(old_toml) if old_toml else None
+            new = cls.load(new_toml) if new_toml else None
+            if old == new:
+                return
+
+            artifact = new if new is not None else old
+            key = artifact.addr if artifact_type == ArtifactGroupType.FUNCTION else artifact.name
+            yield artifact_type, key, new
+
+        elif path in ("comments.toml", "patches.toml"):
+            cls, artifact_type, key_attr = (Comment, ArtifactGroupType.COMMENT, "addr") if path == "comments.toml" \
+                else (Patch, ArtifactGroupType.PATCH, "offset")
+            old = {getattr(a, key_attr): a for a in cls.load_many(_read_toml(old_tree, path) or {})}
+            new = {getattr(a, key_attr): a for a in cls.load_many(_read_toml(new_tree, path) or {})}
+            for key in sorted(set(old) | set(new)):
+                if old.get(key, None) != new.get(key, None):
+                    yield artifact_type, key, new.get(key, None)
+
+    #
+    # Serialization
+    #
+
+    def load(self):
+        try:
+            with open(self.path, "r") as fp:
+                lines = fp.readlines()
+        except OSError:
+            return
+
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except ValueError:
+            return
+        if header.get("version", None) != self.VERSION:
+            return
+
+        for line in lines[1:]:
+            try:
+                segment = json.loads(line)
+            except ValueError:
+                # a segment cut short by a crash, everything after it is lost with it
+                break
+
+            self._apply_segment(segment)
+            self._segments += 1
+
+    def _apply_segment(self, segment):
+        for user in segment.get("forget", []):
+            self._forget_user(user)
+        for artifact_type, key, *entry in segment.get("entries", []):
+            self._history.setdefault((artifact_type, key), []).append(HistoryEntry.from_list(entry))
+        self._indexed.update(segment.get("indexed", {}))
+
+    def save(self, segment=None):
+        """
+        Appends @segment to the index file, or rewrites the file as a single segment holding the whole
+        index when there is no segment or the file holds too many of them.
+        """
+        if self.path is None:
+            return
+
+        try:
+            if segment is not None and 0 < self._segments < self.COMPACT_SEGMENTS:
+                with open(self.path, "a") as fp:
+                    fp.write(json.dumps(segment) + "\n")
+                self._segments += 1
+                return
+
+            self._compact()
+        except OSError as e:
+            l.warning(f"Unable to save the artifact history index: {e}")
+
+    def _compact(self):
+        segment = {
+            "indexed": self._indexed,
+            "entries": [
+                [artifact_type, key] + e.to_list()
+                for (artifact_type, key), entries in self._history.items() for e in entries
+            ],
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            fp.write(json.dumps({"version": self.VERSION}) + "\n")
+            fp.write(json.dumps(segment) + "\n")
+        os.replace(tmp_path, self.path)
+        self._segments = 1
@@ -0,0 +1,239 @@
+import hashlib
+import threading
+from typing import Hashable, Iterable, Optional, Set, Tuple
+
+from sortedcontainers import SortedList
+
+
+class RecencyIndex:
+    """
+    Orders the artifacts of a single artifact type by their last_change, so the most recently changed
+    artifacts can be found without scanning the whole State. Updates are O(log n).
+
+    Artifacts without a last_change (never changed by the user) are not part of the index.
+    """
+
+    def __init__(self, items: Iterable[Tuple[Hashable, Optional[int]]] = ()):
+        self._changes = {
+            key: last_change for key, last_change in items if last_change is not None
+        }  # type: Dict[Hashable, int]
+        self._order = SortedList((last_change, key) for key, last_change in self._changes.items())
+
+    def __len__(self):
+        return len(self._changes)
+
+    def __contains__(self, key):
+        return key in self._changes
+
+    def copy(self) -> "RecencyIndex":
+        index = RecencyIndex()
+        index._changes = self._changes.copy()
+        index._order = self._order.copy()
+        return index
+
+    def update(self, key, last_change: Optional[int]):
+        old_change = self._changes.get(key, None)
+        if old_change == last_change:
+            return
+
+        if old_change is not None:
+            self._order.remove((old_change, key))
+
+        if last_change is None:
+            del self._changes[key]
+            return
+
+        self._changes[key] = last_change
+        self._order.add((last_change, key))
+
+    def remove(self, key):
+        self.update(key, None)
+
+    def latest(self) -> Optional[Tuple[Hashable, int]]:
+        if not self._order:
+            return None
+
+        last_change, key = self._order[-1]
+        return key, last_change
+
+    def recent(self, k=None, since=None) -> Iterable[Tuple[Hashable, int]]:
+        """
+        Iterates (key, last_change) pairs from the most recently changed to the least.
+
+        @param k:       Max number of pairs, or None for all of them
+        @param since:   Only include changes made at or after this unix time
+        @return:
+        """
+        minimum = (since,) if since is not None else None
+        for count, (last_change, key) in enumerate(self._order.irange(minimum=minimum, reverse=True)):
+            if k is not None and count >= k:
+                break
+
+            yield key, last_change
+
+
+class ContentDigest:
+    """
+    A digest over the content hashes of a set of artifacts that does not depend on the order they were
+    added in, so two sets of equal artifacts always have the same digest. Changing the hash of a single
+    artifact is O(1): the digest follows the changes of a State instead of being recomputed over every
+    artifact it holds.
+    """
+
+    MODULUS = 1 << 160
+
+    def __init__(self):
+        self._hashes = {}  # type: Dict[Tuple[int, Hashable], str]
+        self._sum = 0
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def copy(self) -> "ContentDigest":
+        digest = ContentDigest()
+        digest._hashes = self._hashes.copy()
+        digest._sum = self._sum
+        return digest
+
+    @staticmethod
+    def _term(artifact_type, key, content_hash) -> int:
+        return int.from_bytes(hashlib.sha1(f"{artifact_type}:{key}:{content_hash}".encode()).digest(), "big")
+
+    def update(self, artifact_type, key, content_hash: Optional[str]):
+        """
+        Sets the content hash of an artifact, None if it was removed.
+        """
+        old_hash = self._hashes.get((artifact_type, key), None)
+        if old_hash == content_hash:
+            return
+
+        if old_hash is not None:
+            self._sum -= self._term(artifact_type, key, old_hash)
+        if content_hash is not None:
+            self._sum += self._term(artifact_type, key, content_hash)
+            self._hashes[(artifact_type, key)] = content_hash
+        else:
+            del self._hashes[(artifact_type, key)]
+
+        self._sum %= self.MODULUS
+
+    def hexdigest(self) -> str:
+        return "%040x" % self._sum
+
+
+class SearchIndex:
+    """
+    A case-insensitive substring index over the texts of documents, like the names of an artifact and
+    the users that changed it.
+
+    Distinct texts are indexed once by their trigrams, however many documents share them (a user name is
+    shared by every artifact of the user), so a query of three or more characters only verifies the texts
+    that share all of its trigrams and collects their documents. Shorter queries, and queries matching
+    texts of a large part of the documents, scan the documents instead, which is cheaper than collecting
+    that many matches.
+
+    Updates are per document and cost what the document's texts do, so the index is kept up to date
+    as artifacts change instead of being rebuilt.
+    """
+
+    SEPARATOR = "\n"
+    # collecting the documents of more matching texts than this fraction of the documents is slower than
+    # scanning them
+    SCAN_FRACTION = 8
+
+    def __init__(self):
+        self._doc_texts = {}  # type: Dict[Hashable, frozenset]
+        # all texts of a document joined by SEPARATOR, for scans
+        self._doc_joined = {}  # type: Dict[Hashable, str]
+        self._text_docs = {}  # type: Dict[str, Set[Hashable]]
+        self._trigrams = {}  # type: Dict[str, Set[str]]
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._doc_texts)
+
+    def __contains__(self, key):
+        return key in self._doc_texts
+
+    @staticmethod
+    def _trigrams_of(text: str) -> Set[str]:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def set(self, key, texts: Iterable[str]):
+        """
+        Sets the texts of a document, replacing the ones it had.
+        """
+        new_texts = frozenset(t.lower() for t in texts if t)
+        with self._lock:
+            old_texts = self._doc_texts.get(key, frozenset())
+            if old_texts == new_texts:
+                return
+
+            self._unlink(key, old_texts - new_texts)
+            for text in new_texts - old_texts:
+                docs = self._text_docs.get(text, None)
+                if docs is None:
+                    docs = self._text_docs[text] = set()
+                    for trigram in self._trigrams_of(text):
+                        self._trigrams.setdefault(trigram, set()).add(text)
+                docs.add(key)
+
+            if new_texts:
+                self._doc_texts[key] = new_texts
+                self._doc_joined[key] = self.SEPARATOR.join(new_texts)
+            else:
+                self._doc_texts.pop(key, None)
+                self._doc_joined.pop(key, None)
+
+    def remove(self, key):
+        with self._lock:
+            self._doc_joined.pop(key, None)
+            self._unlink(key, self._doc_texts.pop(key, frozenset()))
+
+    def _unlink(self, key, texts: Iterable[str]):
+        for text in texts:
+            docs = self._text_docs[text]
+            docs.discard(key)
+            if docs:
+                continue
+
+            # the last document with this text is gone
+            del self._text_docs[text]
+            for trigram in self._trigrams_of(text):
+                trigram_texts = self._trigrams[trigram]
+                trigram_texts.discard(text)
+                if not trigram_texts:
+                    del self._trigrams[trigram]
+
+    def search(self, query: str) -> Set[Hashable]:
+        """
+        Returns the keys of the documents with a text that contains @query, case-insensitive.
+        """
+        query = query.lower().strip()
+        if not query or self.SEPARATOR in query:
+            return set()
+
+        with self._lock:
+            if len(query) < 3:
+                return self._scan(query)
+
+            text_sets = []
+            for trigram in self._trigrams_of(query):
+                texts = self._trigrams.get(trigram, None)
+                if texts is None:
+                    return set()
+                text_sets.append(texts)
+
+            text_sets.sort(key=len)
+            if len(text_sets[0]) > len(self._doc_texts) // self.SCAN_FRACTION:
+                return self._scan(query)
+
+            texts = text_sets[0].intersection(*text_sets[1:])
+            if len(query) > 3:
+                # sharing every trigram does not make the query a substring
+                texts = [text for text in texts if query in text]
+
+            return set().union(*[self._text_docs[text] for text in texts])
+
+    def _scan(self, query: str) -> Set[Hashable]:
+        return {key for key, joined in self._doc_joined.items() if query in joined}
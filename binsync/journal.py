@@ -0,0 +1,185 @@
+import bisect
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+class JournalOp:
+    SET = 0
+    REMOVE = 1
+
+
+class JournalEntry:
+    """
+    A single recorded change to a State.
+
+    :ivar int seq:              Sequence number, increasing for every entry of a journal
+    :ivar int op:               A JournalOp
+    :ivar int artifact_type:    The ArtifactGroupType the changed artifact is stored as
+    :ivar key:                  Address of the artifact, or name for structs
+    :ivar str old_hash:         Content hash before the change, None if it did not exist
+    :ivar str new_hash:         Content hash after the change, None if it was removed
+    :ivar int timestamp:        Unix time the change was recorded at
+    :ivar dict artifact:        The serialized artifact after the change, None if it was removed
+    """
+
+    __slots__ = (
+        "seq",
+        "op",
+        "artifact_type",
+        "key",
+        "old_hash",
+        "new_hash",
+        "timestamp",
+        "artifact",
+    )
+
+    def __init__(self, seq, op, artifact_type, key, old_hash=None, new_hash=None, timestamp=None, artifact=None):
+        self.seq = seq
+        self.op = op
+        self.artifact_type = artifact_type
+        self.key = key
+        self.old_hash = old_hash
+        self.new_hash = new_hash
+        self.timestamp = timestamp
+        self.artifact = artifact
+
+    def __getstate__(self):
+        return dict(
+            (k, getattr(self, k)) for k in self.__slots__
+        )
+
+    def __setstate__(self, state):
+        for k in self.__slots__:
+            setattr(self, k, state.get(k, None))
+
+    def __repr__(self):
+        return f"<JournalEntry {self.seq}: op={self.op} type={self.artifact_type} key={self.key}>"
+
+    @classmethod
+    def load(cls, state):
+        entry = cls(None, None, None, None)
+        entry.__setstate__(state)
+        return entry
+
+
+class Journal:
+    """
+    An append-only record of the operations applied to a State, so an older copy of that State in the
+    same process can be caught up by replaying only the new entries. The journal is not dumped: readers
+    of other users' states follow them through git tree diffs instead.
+
+    Every commit marks a checkpoint. Only the entries after the oldest of the last `max_checkpoints`
+    checkpoints are kept, which bounds the size of the journal.
+    """
+
+    DEFAULT_MAX_CHECKPOINTS = 16
+
+    def __init__(self, max_checkpoints=DEFAULT_MAX_CHECKPOINTS):
+        self.entries = []  # type: List[JournalEntry]
+        self.checkpoints = []  # type: List[int]
+        self.max_checkpoints = max_checkpoints
+        # seq of the last entry ever recorded, even if it was truncated
+        self.last_seq = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    @property
+    def first_seq(self) -> Optional[int]:
+        return self.entries[0].seq if self.entries else None
+
+    def copy(self) -> "Journal":
+        journal = Journal(max_checkpoints=self.max_checkpoints)
+        journal.entries = self.entries.copy()
+        journal.checkpoints = self.checkpoints.copy()
+        journal.last_seq = self.last_seq
+        return journal
+
+    def append(self, op, artifact_type, key, old_hash=None, new_hash=None, artifact=None) -> JournalEntry:
+        self.last_seq += 1
+        entry = JournalEntry(
+            self.last_seq, op, artifact_type, key,
+            old_hash=old_hash, new_hash=new_hash, timestamp=int(time.time()), artifact=artifact
+        )
+        self.entries.append(entry)
+        return entry
+
+    def extend(self, entries: Iterable[JournalEntry]):
+        """
+        Adds entries recorded by another journal, keeping their sequence numbers.
+        """
+        for entry in entries:
+            if entry.seq <= self.last_seq:
+                continue
+
+            self.entries.append(entry)
+            self.last_seq = entry.seq
+
+    def since(self, seq: int) -> List[JournalEntry]:
+        """
+        Returns every entry recorded after @seq.
+        """
+        idx = bisect.bisect_right([e.seq for e in self.entries], seq)
+        return self.entries[idx:]
+
+    def covers(self, seq: int) -> bool:
+        """
+        True if every entry after @seq is still in the journal, so a State at @seq can be caught up.
+        """
+        if seq >= self.last_seq:
+            return True
+
+        return bool(self.entries) and self.entries[0].seq <= seq + 1
+
+    def checkpoint(self) -> int:
+        """
+        Marks the current position of the journal, truncating entries that are older than the kept
+        checkpoints.
+
+        @return: The seq of the checkpoint
+        """
+        if not self.checkpoints or self.checkpoints[-1] != self.last_seq:
+            self.checkpoints.append(self.last_seq)
+
+        if len(self.checkpoints) > self.max_checkpoints:
+            self.checkpoints = self.checkpoints[-self.max_checkpoints:]
+            self.truncate(self.checkpoints[0])
+
+        return self.last_seq
+
+    def truncate(self, seq: int):
+        """
+        Drops every entry recorded at or before @seq.
+        """
+        self.entries = self.since(seq)
+        self.checkpoints = [c for c in self.checkpoints if c >= seq]
+
+    def discard_after(self, seq: int):
+        """
+        Drops every entry recorded after @seq, like the changes of a batch that was rolled back. Their
+        seqs are not reused.
+        """
+        self.entries = self.entries[:len(self.entries) - len(self.since(seq))]
+        self.checkpoints = [c for c in self.checkpoints if c <= seq]
+
+    #
+    # Serialization
+    #
+
+    def __getstate__(self) -> Dict:
+        return {
+            "metadata": {
+                "last_seq": self.last_seq,
+                "checkpoints": self.checkpoints,
+            },
+            "entries": [entry.__getstate__() for entry in self.entries],
+        }
+
+    def __setstate__(self, state):
+        metadata = state.get("metadata", {})
+        self.last_seq = metadata.get("last_seq", 0)
+        self.checkpoints = metadata.get("checkpoints", [])
+        self.entries = [JournalEntry.load(entry) for entry in state.get("entries", [])]
@@ -1,88 +1,242 @@
-from . import State
+from typing import Optional
 
+from .data import Function
+from .state import State, ArtifactGroupType
 
-class MergeState:
-    def __init__(self, mstr_state: State, trgt_state: State, func_addr: int):
-        self.mstr_state = mstr_state
-        self.trgt_state = trgt_state
-        self.func_addr = func_addr
 
-        self.cmt_diff = {}
-        self.var_diff = {}
-        self.func_name_diff = {}
-        self.conflicts = False
+def _merge3(base, ours, theirs):
+    """
+    Three-way merges a single artifact, where None means the artifact does not exist.
 
-    def _gen_state_diff(self):
-        self.conflicts |= self._gen_func_name_diff()
-        self.conflicts |= self._gen_var_diff()
-        self.conflicts |= self._gen_cmt_diff()
+    @return: (take_theirs, conflict)
+    """
+    if ours == theirs or theirs == base:
+        return False, False
+
+    if ours == base:
+        return True, False
+
+    return False, True
+
+
+class MergeChange:
+    """
+    A change made by the other user since the merge base, applied without conflict.
+
+    :ivar int artifact_type:    The ArtifactGroupType the artifact is stored as
+    :ivar key:                  Address of the artifact, or name for structs
+    :ivar offset:               For functions: None for the whole function, HEADER for its header, else the
+                                stack offset of a stack variable
+    :ivar artifact:             The artifact to set, None if it is removed
+    """
 
-    def _gen_cmt_diff(self):
-        conflicts = False
+    HEADER = "header"
 
-        try:
-            mstr_cmts = self.mstr_state.comments[self.func_addr]
-            trgt_cmts = self.trgt_state.comments[self.func_addr]
-        except KeyError:
-            return conflicts
+    __slots__ = ("artifact_type", "key", "offset", "artifact")
 
-        for addr in mstr_cmts:
-            try:
-                after = trgt_cmts[addr]
-            except KeyError:
-                continue
+    def __init__(self, artifact_type, key, artifact, offset=None):
+        self.artifact_type = artifact_type
+        self.key = key
+        self.offset = offset
+        self.artifact = artifact
 
-            before = mstr_cmts[addr]
-            if before.decompiled != after.decompiled:
-                continue
+    def __repr__(self):
+        return f"<{self.__class__.__name__} type={self.artifact_type} key={self.key} offset={self.offset}>"
 
-            if before != after:
-                self.cmt_diff[addr] = {'mstr': before, 'trgt': after}
-                conflicts = True
+    def apply(self, state: State) -> bool:
+        if self.artifact_type == ArtifactGroupType.FUNCTION and self.offset is not None:
+            if self.offset == self.HEADER:
+                if self.artifact is None:
+                    # headers are never removed, only replaced
+                    return False
+                return bool(state.set_function_header(self.artifact, set_last_change=False))
 
-        return conflicts
+            if self.artifact is None:
+                return bool(state.remove_stack_variable(self.offset, self.key))
+            return bool(state.set_stack_variable(self.artifact, self.offset, self.key, set_last_change=False))
 
-    def _gen_var_diff(self):
-        conflicts = False
+        if self.artifact is None:
+            return bool(state.remove_artifact(self.artifact_type, self.key))
 
-        # check for existence of vars both in master and target
-        try:
-            mstr_vars = self.mstr_state.stack_variables[self.func_addr]
-            trgt_vars = self.trgt_state.stack_variables[self.func_addr]
-        except KeyError:
-            return conflicts
+        if isinstance(self.artifact, Function):
+            changed = bool(state.set_many([self.artifact], set_last_change=False))
+            # set_many never removes stack variables, which a replaced function may no longer have
+            for offset in set(state.functions[self.key].stack_vars) - set(self.artifact.stack_vars):
+                changed |= bool(state.remove_stack_variable(offset, self.key))
+            return changed
 
-        # validate for every master var
-        for off in mstr_vars:
-            try:
-                after = trgt_vars[off]
-            except KeyError:
-                continue
+        return bool(state.set_many([self.artifact], set_last_change=False))
 
-            before = mstr_vars[off]
-            if before != after:
-                self.var_diff[off] = {'mstr': before.name, 'trgt': after.name}
-                conflicts = True
 
-        return conflicts
+class MergeConflict(MergeChange):
+    """
+    An artifact both users changed differently since the merge base. Applying a conflict takes the
+    other user's version.
 
-    def _gen_func_name_diff(self):
-        conflicts = False
+    :ivar base:     The artifact at the merge base, None if it did not exist
+    :ivar ours:     Our version of the artifact, None if we removed it
+    """
 
-        try:
-            before = self.mstr_state.functions[self.func_addr]
-            after = self.trgt_state.functions[self.func_addr]
-        except KeyError:
-            return conflicts
+    __slots__ = ("base", "ours")
 
-        if before != after:
-            self.func_name_diff['mstr'] = before.name
-            self.func_name_diff['trgt'] = after.name
-            conflicts = True
+    def __init__(self, artifact_type, key, base, ours, theirs, offset=None):
+        super().__init__(artifact_type, key, theirs, offset=offset)
+        self.base = base
+        self.ours = ours
 
-        return conflicts
+    @property
+    def theirs(self):
+        return self.artifact
 
 
 class Merge:
-    def __init__(self):
-        pass
+    """
+    A three-way merge of another user's state (theirs) into ours, relative to the state both of them
+    were last in sync with (the base).
+
+    Only artifacts the other user changed since the base are looked at. Those we did not change are
+    taken as they are; those both users changed are merged at the finest level that is stored:
+    functions are merged header by header and stack variable by stack variable, everything else
+    artifact by artifact. Whatever both users changed differently is reported as a MergeConflict.
+
+        merge = Merge(base, ours, theirs).compute()
+        merge.apply(ours)
+    """
+
+    OURS = "ours"
+    THEIRS = "theirs"
+
+    def __init__(self, base: State, ours: State, theirs: State):
+        self.base = base
+        self.ours = ours
+        self.theirs = theirs
+
+        self.changes = []  # type: List[MergeChange]
+        self.conflicts = []  # type: List[MergeConflict]
+        self._computed = False
+
+    @property
+    def has_conflicts(self):
+        return bool(self.conflicts)
+
+    def compute(self) -> "Merge":
+        if self._computed:
+            return self
+
+        their_diff = self.base.diff(self.theirs)
+        our_diff = self.base.diff(self.ours)
+
+        for artifact_type, their_changes in their_diff.artifacts.items():
+            our_changed = our_diff.artifacts[artifact_type].keys()
+            base_artifacts = self.base._storage_container(artifact_type)
+            our_artifacts = self.ours._storage_container(artifact_type)
+            their_artifacts = self.theirs._storage_container(artifact_type)
+
+            for key in their_changes.keys():
+                base = base_artifacts.get(key, None)
+                ours = our_artifacts.get(key, None)
+                theirs = their_artifacts.get(key, None)
+
+                if key not in our_changed:
+                    # we did not touch it since the base
+                    self.changes.append(MergeChange(artifact_type, key, theirs))
+                elif artifact_type == ArtifactGroupType.FUNCTION and ours is not None and theirs is not None:
+                    self._merge_function(key, base, ours, theirs)
+                else:
+                    take_theirs, conflict = _merge3(base, ours, theirs)
+                    if conflict:
+                        self.conflicts.append(MergeConflict(artifact_type, key, base, ours, theirs))
+                    elif take_theirs:
+                        self.changes.append(MergeChange(artifact_type, key, theirs))
+
+        self._computed = True
+        return self
+
+    def _merge_function(self, addr, base: Optional[Function], ours: Function, theirs: Function):
+        base_header = base.header if base is not None else None
+        take_theirs, conflict = _merge3(base_header, ours.header, theirs.header)
+        if conflict:
+            self.conflicts.append(MergeConflict(
+                ArtifactGroupType.FUNCTION, addr, base_header, ours.header, theirs.header, offset=MergeChange.HEADER
+            ))
+        elif take_theirs:
+            self.changes.append(MergeChange(ArtifactGroupType.FUNCTION, addr, theirs.header, offset=MergeChange.HEADER))
+
+        base_vars = base.stack_vars if base is not None else {}
+        for offset in sorted(set(base_vars) | set(ours.stack_vars) | set(theirs.stack_vars)):
+            base_var = base_vars.get(offset, None)
+            our_var = ours.stack_vars.get(offset, None)
+            their_var = theirs.stack_vars.get(offset, None)
+
+            take_theirs, conflict = _merge3(base_var, our_var, their_var)
+            if conflict:
+                self.conflicts.append(MergeConflict(
+                    ArtifactGroupType.FUNCTION, addr, base_var, our_var, their_var, offset=offset
+                ))
+            elif take_theirs:
+                self.changes.append(MergeChange(ArtifactGroupType.FUNCTION, addr, their_var, offset=offset))
+
+    def apply(self, state: Optional[State] = None, prefer: Optional[str] = None) -> int:
+        """
+        Applies every non-conflicting change to @state in a single batch.
+
+        @param state:   The state to apply the merge to, ours by default
+        @param prefer:  Merge.THEIRS to also resolve conflicts with the other user's version, otherwise
+                        our version is kept
+        @return:        The number of changes that modified the state
+        """
+        self.compute()
+        state = state if state is not None else self.ours
+
+        changes = self.changes + self.conflicts if prefer == self.THEIRS else self.changes
+        changed = 0
+        with state.batch():
+            for change in changes:
+                changed += change.apply(state)
+
+        return changed
+
+
+class MergeState:
+    """
+    The conflicts of a single function between a master and a target state, for display.
+    """
+
+    def __init__(self, mstr_state: State, trgt_state: State, func_addr: int, base_state: Optional[State] = None):
+        self.mstr_state = mstr_state
+        self.trgt_state = trgt_state
+        self.func_addr = func_addr
+        self.base_state = base_state if base_state is not None else State(mstr_state.user)
+
+        self.cmt_diff = {}
+        self.var_diff = {}
+        self.func_name_diff = {}
+        self.conflicts = False
+
+    def _gen_state_diff(self):
+        # restrict all three states to the function before merging
+        states = []
+        for state in (self.base_state, self.mstr_state, self.trgt_state):
+            view = State(state.user)
+            if self.func_addr in state.functions:
+                view.functions[self.func_addr] = state.functions[self.func_addr]
+            # the function comment is part of the header, not of the comments
+            for addr in state.get_comments_in_function(self.func_addr):
+                if addr in state.comments:
+                    view.comments[addr] = state.comments[addr]
+            states.append(view)
+
+        merge = Merge(*states).compute()
+        for conflict in merge.conflicts:
+            if conflict.artifact_type == ArtifactGroupType.COMMENT:
+                self.cmt_diff[conflict.key] = {'mstr': conflict.ours, 'trgt': conflict.theirs}
+            elif conflict.offset == MergeChange.HEADER:
+                self.func_name_diff['mstr'] = conflict.ours.name if conflict.ours else None
+                self.func_name_diff['trgt'] = conflict.theirs.name if conflict.theirs else None
+            elif conflict.offset is not None:
+                self.var_diff[conflict.offset] = {
+                    'mstr': conflict.ours.name if conflict.ours else None,
+                    'trgt': conflict.theirs.name if conflict.theirs else None,
+                }
+
+        self.conflicts = merge.has_conflicts
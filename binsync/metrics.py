@@ -0,0 +1,189 @@
+import bisect
+import contextlib
+import math
+import os
+import threading
+import time
+from typing import Dict, Tuple
+
+# upper bounds, in seconds, of the default histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+
+def _series_name(name, labels: Tuple) -> str:
+    if not labels:
+        return name
+
+    label_str = ",".join(f'{key}="{value}"' for key, value in labels)
+    return f"{name}{{{label_str}}}"
+
+
+class Counter:
+    """
+    A monotonically increasing value, like the number of commits or bytes written.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, labels: Tuple = ()):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+    def prometheus_lines(self):
+        yield f"{_series_name(self.name, self.labels)} {self.value}"
+
+
+class Histogram:
+    """
+    The distribution of a measurement, usually a duration in seconds, in cumulative buckets.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, labels: Tuple = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    @contextlib.contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "count": self.count,
+                "sum": self.sum,
+                "max": self.max,
+                "mean": self.sum / self.count if self.count else 0.0,
+            }
+
+    def prometheus_lines(self):
+        with self._lock:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), self.bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                yield f"{_series_name(self.name + '_bucket', self.labels + (('le', le),))} {cumulative}"
+            yield f"{_series_name(self.name + '_sum', self.labels)} {self.sum}"
+            yield f"{_series_name(self.name + '_count', self.labels)} {self.count}"
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms of the sync pipeline, kept per process. Metrics are created on first use,
+    so instrumenting a code path is a single call:
+
+        REGISTRY.counter("binsync_commits_total").inc()
+        with REGISTRY.timer("binsync_pull_seconds"):
+            ...
+
+    Series of the same metric are told apart by keyword labels, e.g. table="functions".
+    """
+
+    def __init__(self):
+        self._metrics = {}  # type: Dict[Tuple, object]
+        self._help = {}  # type: Dict[str, str]
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        labels = tuple(sorted(labels.items()))
+        key = (name, labels)
+        metric = self._metrics.get(key, None)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key, None)
+                if metric is None:
+                    metric = cls(name, labels=labels, **kwargs)
+                    self._metrics[key] = metric
+                    if help_text:
+                        self._help[name] = help_text
+
+        if not isinstance(metric, cls):
+            raise TypeError(f"Metric {name} is a {metric.kind}, not a {cls.kind}")
+
+        return metric
+
+    def counter(self, name, help_text="", **labels) -> Counter:
+        return self._get(Counter, name, help_text, labels)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS, **labels) -> Histogram:
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def timer(self, name, help_text="", **labels):
+        """
+        A context manager that observes the seconds spent in it in histogram @name.
+        """
+        return self.histogram(name, help_text, **labels).time()
+
+    def snapshot(self) -> Dict:
+        """
+        The current value of every series: a number for counters, count/sum/max/mean for histograms.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        return {_series_name(m.name, m.labels): m.snapshot() for m in metrics}
+
+    def to_prometheus(self) -> str:
+        """
+        Every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: (m.name, m.labels))
+            help_texts = dict(self._help)
+
+        lines = []
+        last_name = None
+        for metric in metrics:
+            if metric.name != last_name:
+                if metric.name in help_texts:
+                    lines.append(f"# HELP {metric.name} {help_texts[metric.name]}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                last_name = metric.name
+            lines.extend(metric.prometheus_lines())
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Writes every metric to @path for the node exporter's textfile collector. The file is replaced
+        atomically, so it is never read half written.
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            fp.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+            self._help.clear()
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,163 @@
+import collections
+import contextlib
+import cProfile
+import itertools
+import logging
+import os
+import tempfile
+import threading
+import time
+from functools import wraps
+
+from .metrics import REGISTRY
+
+_l = logging.getLogger(name=__name__)
+
+# set to an output directory (or to 1 for the default one) to profile from startup
+PROFILE_ENV = "BINSYNC_PROFILE"
+# seconds after which a profiled cycle is flagged as slow
+PROFILE_SLOW_ENV = "BINSYNC_PROFILE_SLOW"
+
+
+class SlowCycle:
+    __slots__ = ("name", "duration", "path", "timestamp")
+
+    def __init__(self, name, duration, path, timestamp):
+        self.name = name
+        self.duration = duration
+        self.path = path
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f"<SlowCycle {self.name}: {self.duration:.3f}s>"
+
+
+class Profiler:
+    """
+    Opt-in cProfile profiling of the sync hot paths, for reports like "the decompiler freezes when
+    binsync syncs". Every profiled call writes its own .prof file to the output directory, which only
+    keeps the newest max_profiles files. Calls slower than slow_threshold are logged and get a _slow
+    suffix, so the files worth opening in snakeviz or pstats are easy to find.
+
+    Only the outermost profiled call of a thread is profiled: a parse inside a profiled update is part
+    of the update's profile.
+    """
+
+    DEFAULT_DIR = os.path.join(tempfile.gettempdir(), "binsync_profiles")
+
+    def __init__(self, output_dir=None, max_profiles=100, slow_threshold=1.0):
+        self.output_dir = output_dir  # type: Optional[str]
+        self.max_profiles = max_profiles
+        self.slow_threshold = slow_threshold
+        self.slow_cycles = collections.deque(maxlen=64)
+
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    @classmethod
+    def from_env(cls) -> "Profiler":
+        profiler = cls()
+        try:
+            profiler.slow_threshold = float(os.environ.get(PROFILE_SLOW_ENV, profiler.slow_threshold))
+        except ValueError:
+            _l.warning(f"Ignoring {PROFILE_SLOW_ENV}, it is not a number of seconds.")
+
+        output_dir = os.environ.get(PROFILE_ENV, None)
+        if output_dir and output_dir != "0":
+            profiler.enable(None if output_dir == "1" else output_dir)
+
+        return profiler
+
+    @property
+    def enabled(self):
+        return self.output_dir is not None
+
+    def enable(self, output_dir=None):
+        output_dir = output_dir or self.DEFAULT_DIR
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        _l.info(f"Profiling BinSync to {output_dir}")
+
+    def disable(self):
+        self.output_dir = None
+
+    @contextlib.contextmanager
+    def profile(self, name):
+        output_dir = self.output_dir
+        if output_dir is None or getattr(self._local, "active", False):
+            yield
+            return
+
+        profile = cProfile.Profile()
+        self._local.active = True
+        start = time.perf_counter()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already running
+            profile = None
+
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            duration = time.perf_counter() - start
+            self._local.active = False
+            if profile is not None:
+                self._save(profile, name, duration, output_dir)
+
+    def _save(self, profile: cProfile.Profile, name, duration, output_dir):
+        slow = duration >= self.slow_threshold
+        timestamp = time.time()
+        filename = "%s_%06d_%s_%dms%s.prof" % (
+            time.strftime("%Y%m%d-%H%M%S", time.localtime(timestamp)), next(self._sequence), name, duration * 1000,
+            "_slow" if slow else ""
+        )
+        path = os.path.join(output_dir, filename)
+        with self._write_lock:
+            try:
+                profile.dump_stats(path)
+                self._rotate(output_dir)
+            except OSError as e:
+                _l.warning(f"Unable to write profile {path}: {e}")
+                return
+
+        if slow:
+            self.slow_cycles.append(SlowCycle(name, duration, path, timestamp))
+            REGISTRY.counter("binsync_slow_cycles_total", "Profiled calls slower than the threshold", stage=name).inc()
+            _l.warning(f"Slow {name}: {duration:.2f}s, profile written to {path}")
+
+    def _rotate(self, output_dir):
+        profiles = [
+            os.path.join(output_dir, f) for f in os.listdir(output_dir) if f.endswith(".prof")
+        ]
+        if len(profiles) <= self.max_profiles:
+            return
+
+        profiles.sort(key=lambda path: (os.path.getmtime(path), path))
+        for path in profiles[:len(profiles) - self.max_profiles]:
+            os.remove(path)
+
+
+PROFILER = Profiler.from_env()
+
+
+def profiled(name):
+    """
+    Profiles every call of the decorated function with PROFILER while it is enabled. When profiling is
+    disabled the wrapper costs a single attribute check.
+    """
+    def decorator(f):
+        @wraps(f)
+        def _profiled(*args, **kwargs):
+            if PROFILER.output_dir is None:
+                return f(*args, **kwargs)
+
+            with PROFILER.profile(name):
+                return f(*args, **kwargs)
+
+        return _profiled
+
+    return decorator
@@ -1,5 +1,8 @@
 import time
-from typing import List, Dict, Iterable, Union, Optional
+import contextlib
+import heapq
+import itertools
+from typing import List, Dict, Iterable, Union, Optional, Set
 import inspect
 
 import os
@@ -11,9 +14,13 @@ from sortedcontainers import SortedDict
 import toml
 import git
 
-from .data import Function, FunctionHeader, Comment, Patch, StackVariable
+from .data import Function, FunctionHeader, Comment, Patch, StackVariable, intern_str, dumps_canonical
 from .data.struct import Struct
 from .errors import MetadataNotFoundError
+from .indexes import RecencyIndex, ContentDigest
+from .journal import Journal, JournalOp, JournalEntry
+from .metrics import REGISTRY
+from .profiling import profiled
 
 
 class ArtifactGroupType:
@@ -24,6 +31,95 @@ class ArtifactGroupType:
     COMMENT = 3
 
 
+class ArtifactDiff:
+    """
+    The differences of a single artifact type between two states, keyed like the State containers.
+
+    :ivar dict added:   Artifacts only in the other state
+    :ivar dict removed: Artifacts only in this state
+    :ivar dict changed: (this state's artifact, other state's artifact) for artifacts in both that differ
+    """
+
+    def __init__(self):
+        self.added = {}
+        self.removed = {}
+        self.changed = {}
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def keys(self) -> Set:
+        return set(self.added) | set(self.removed) | set(self.changed)
+
+
+class StateDiff:
+    """
+    The result of State.diff, an ArtifactDiff per artifact type.
+    """
+
+    def __init__(self):
+        self.artifacts = {
+            ArtifactGroupType.FUNCTION: ArtifactDiff(),
+            ArtifactGroupType.STRUCT: ArtifactDiff(),
+            ArtifactGroupType.PATCH: ArtifactDiff(),
+            ArtifactGroupType.COMMENT: ArtifactDiff(),
+        }  # type: Dict[int, ArtifactDiff]
+
+    def __len__(self):
+        return sum(len(d) for d in self.artifacts.values())
+
+    def __bool__(self):
+        return len(self) > 0
+
+    @property
+    def functions(self) -> ArtifactDiff:
+        return self.artifacts[ArtifactGroupType.FUNCTION]
+
+    @property
+    def structs(self) -> ArtifactDiff:
+        return self.artifacts[ArtifactGroupType.STRUCT]
+
+    @property
+    def patches(self) -> ArtifactDiff:
+        return self.artifacts[ArtifactGroupType.PATCH]
+
+    @property
+    def comments(self) -> ArtifactDiff:
+        return self.artifacts[ArtifactGroupType.COMMENT]
+
+
+# the State attribute each artifact type is stored in
+STORAGE_ATTRS = {
+    ArtifactGroupType.FUNCTION: "functions",
+    ArtifactGroupType.COMMENT: "comments",
+    ArtifactGroupType.PATCH: "patches",
+    ArtifactGroupType.STRUCT: "structs",
+}
+
+# how each shared State container is copied on its first write after a snapshot
+COW_COPIERS = {
+    "functions": lambda functions: functions.copy(),
+    "comments": lambda comments: comments.copy(),
+    "patches": lambda patches: patches.copy(),
+    "structs": lambda structs: structs.copy(),
+    "_func_comments": lambda func_comments: defaultdict(set, {k: set(v) for k, v in func_comments.items()}),
+    "_recency": lambda recency: {k: index.copy() for k, index in recency.items()},
+    "journal": lambda journal: journal.copy(),
+    "_content": lambda content: content.copy() if content is not None else None,
+}
+
+# stands for a key that was not stored when a batch started, see batch()
+_MISSING = object()
+
+# how each artifact type is loaded back from its serialized form
+ARTIFACT_LOADERS = {
+    ArtifactGroupType.FUNCTION: Function,
+    ArtifactGroupType.COMMENT: Comment,
+    ArtifactGroupType.PATCH: Patch,
+    ArtifactGroupType.STRUCT: Struct,
+}
+
+
 def dirty_checker(f):
     @wraps(f)
     def dirtycheck(self, *args, **kwargs):
@@ -41,15 +137,31 @@ def update_last_change(f):
         should_set = kwargs.pop('set_last_change', True)
         artifact = args[0]
 
-        # make a function if one does not exist
+        # remember what the artifact was stored as before the change for the journal
+        storage_group = self._storage_group(artifact)
+        old_hash = self._stored_hash(*storage_group)
+
+        # make a function if one does not exist, owned by this state since it will be modified
         if (isinstance(artifact, Comment) and artifact.func_addr) or isinstance(artifact, StackVariable):
-            func = self.get_or_make_function(artifact.func_addr)
+            func = self._get_writable_function(artifact.func_addr)
         elif isinstance(artifact, FunctionHeader):
-            func = self.get_or_make_function(artifact.addr)
+            func = self._get_writable_function(artifact.addr)
 
         if not should_set:
-            return f(self, *args, **kwargs)
-        artifact.last_change = int(time.time())
+            r = f(self, *args, **kwargs)
+            if r is True:
+                self._update_recency(artifact)
+                self._journal_set(*storage_group, old_hash)
+            return r
+
+        prev_change = artifact.last_change
+        artifact.last_change = self._batch_time or int(time.time())
+        r = f(self, *args, **kwargs)
+
+        # only real changes are timestamped, otherwise identical states would dump differently
+        if r is not True:
+            artifact.last_change = prev_change
+            return r
 
         # Comment
         if isinstance(artifact, Comment):
@@ -88,8 +200,10 @@ def update_last_change(f):
         self.last_push_artifact = artifact_loc
         self.last_push_time = artifact.last_change
         self.last_push_artifact_type = artifact_type
+        self._update_recency(artifact)
+        self._journal_set(*storage_group, old_hash)
 
-        return f(self, *args, **kwargs)
+        return r
 
     return _update_last_change
 
@@ -114,7 +228,14 @@ def list_files_in_tree(base_tree: git.Tree):
     return file_list
 
 
+def load_tree_toml(tree: git.Tree, path: str):
+    data = tree[path].data_stream.read()
+    REGISTRY.counter("binsync_bytes_read_total", "Bytes of state files read from git").inc(len(data))
+    return toml.loads(data.decode())
+
+
 def add_data(index: git.IndexFile, path: str, data: bytes):
+    REGISTRY.counter("binsync_bytes_written_total", "Bytes of state files written to the index").inc(len(data))
     fullpath = os.path.join(os.path.dirname(index.repo.git_dir), path)
     pathlib.Path(fullpath).parent.mkdir(parents=True, exist_ok=True)
     with open(fullpath, 'wb') as fp:
@@ -128,6 +249,24 @@ def remove_data(index: git.IndexFile, path: str):
     index.remove([fullpath], working_tree=True)
 
 
+def remove_stale_data(index: git.IndexFile, directory: str, paths: Set[str]) -> int:
+    """
+    Removes every file in @directory of the index that is not in @paths, like the files of artifacts
+    that were removed from the state.
+
+    @return: The number of files removed
+    """
+    # index paths always use forward slashes
+    prefix = directory + "/"
+    paths = {path.replace(os.sep, "/") for path in paths}
+    stale = [path for path, _ in index.entries if path.startswith(prefix) and path not in paths]
+    if stale:
+        root = os.path.dirname(index.repo.git_dir)
+        index.remove([os.path.join(root, path) for path in stale], working_tree=True)
+
+    return len(stale)
+
+
 class State:
     """
     The state.
@@ -149,12 +288,41 @@ class State:
 
         # dirty bit
         self._dirty = False  # type: bool
+        # content hash of the state at its last commit, None if unknown
+        self._last_commit_hash = None  # type: Optional[str]
 
         # data
-        self.functions = {}  # type: Dict[int, Function]
-        self.comments = {}  # type: Dict[int, Comment]
+        # address keyed artifacts are kept sorted for range and containment queries
+        self.functions = SortedDict()  # type: Dict[int, Function]
+        self.comments = SortedDict()  # type: Dict[int, Comment]
         self.structs = {}  # type: Dict[str, Struct]
-        self.patches = SortedDict()
+        self.patches = SortedDict()  # type: Dict[int, Patch]
+
+        # indexes
+        self._func_comments = defaultdict(set)  # type: Dict[int, Set[int]]
+        self._recency = self._make_recency_indexes()  # type: Dict[int, RecencyIndex]
+
+        # record of the changes applied to this state since it was created, kept in memory only
+        self.journal = Journal()
+
+        # (artifact_type, key) -> (artifact, content hash), valid only while the artifact is the one stored
+        self._hash_cache = {}  # type: Dict[tuple, tuple]
+        # digest of every stored artifact, kept up to date by the journaled changes. None until it is
+        # first needed, or after the containers were reloaded without journaling.
+        self._content = None  # type: Optional[ContentDigest]
+
+        # copy-on-write bookkeeping, see snapshot()
+        self._readonly = False
+        self._shared = set()  # type: Set[str]
+        self._owned_funcs = None  # type: Optional[Set[int]]
+
+        # set while a batch of changes is applied, see batch()
+        self._batch_time = None  # type: Optional[int]
+        self._batch_depth = 0
+        # what the artifacts changed by the batch were when it started, by container then key
+        self._batch_undo = None  # type: Optional[Dict[str, Dict]]
+        # containers replaced as a whole by the batch, as they were before the replacement
+        self._batch_containers = None  # type: Optional[Dict[str, Dict]]
 
     def __eq__(self, other):
         if isinstance(other, State):
@@ -176,27 +344,59 @@ class State:
         if not isinstance(other, State):
             return False
 
-        are_eq = True
+        if func_addr not in self.functions or func_addr not in other.functions:
+            return False
 
-        # function headers
-        try:
-            are_eq &= self.functions[func_addr] == other.functions[func_addr]
-        except KeyError:
+        # function header and stack vars
+        if not self._same_artifact(ArtifactGroupType.FUNCTION, func_addr, other):
             return False
 
         # comments
-        try:
-            are_eq &= self.comments[func_addr] == other.comments[func_addr]
-        except KeyError:
-            return False
+        return self.get_comments_in_function(func_addr) == other.get_comments_in_function(func_addr)
 
-        # stack vars
-        try:
-            are_eq &= self.stack_variables[func_addr] == other.stack_variables[func_addr]
-        except KeyError:
-            return False
+    def diff(self, other: "State", artifact_types=None, addr_range=None) -> "StateDiff":
+        """
+        Computes what changes between this state and @other, artifact by artifact: "added" artifacts
+        only exist in @other, "removed" ones only exist in this state, and "changed" ones exist in both
+        with different content. Artifacts shared through snapshots or with known equal content hashes
+        are skipped without being compared.
+
+        @param other:           The state to compare against
+        @param artifact_types:  An ArtifactGroupType or list of them to restrict the diff to
+        @param addr_range:      A (start, end) range to restrict address keyed artifacts to
+        @return:                A StateDiff
+        """
+        if artifact_types is None:
+            artifact_types = list(STORAGE_ATTRS)
+        elif isinstance(artifact_types, int):
+            artifact_types = [artifact_types]
+
+        diff = StateDiff()
+        for artifact_type in artifact_types:
+            mine = self._storage_container(artifact_type)
+            theirs = other._storage_container(artifact_type)
+            artifact_diff = diff.artifacts[artifact_type]
+            if mine is theirs:
+                # still shared by a snapshot, nothing can differ
+                continue
+
+            if addr_range is not None and artifact_type != ArtifactGroupType.STRUCT:
+                start, end = addr_range
+                my_keys = set(mine.irange(start, end, inclusive=(True, False)))
+                their_keys = set(theirs.irange(start, end, inclusive=(True, False)))
+            else:
+                my_keys = mine.keys()
+                their_keys = theirs.keys()
 
-        return are_eq
+            for key in my_keys - their_keys:
+                artifact_diff.removed[key] = mine[key]
+            for key in their_keys - my_keys:
+                artifact_diff.added[key] = theirs[key]
+            for key in my_keys & their_keys:
+                if not self._same_artifact(artifact_type, key, other):
+                    artifact_diff.changed[key] = (mine[key], theirs[key])
+
+        return diff
 
     @property
     def dirty(self):
@@ -216,113 +416,510 @@ class State:
             "last_push_artifact": self.last_push_artifact,
             "last_push_artifact_type": self.last_push_artifact_type,
         }
-        add_data(index, 'metadata.toml', toml.dumps(d).encode())
+        add_data(index, 'metadata.toml', dumps_canonical(d).encode())
 
+    @profiled("state_dump")
     def dump(self, index: git.IndexFile):
-        # dump metadata
-        self.dump_metadata(index)
+        with REGISTRY.timer("binsync_dump_seconds", "Seconds spent dumping the local state"):
+            # dump metadata
+            self.dump_metadata(index)
+
+            # dump functions, one file per function in ./functions/
+            paths = set()
+            for addr in sorted(self.functions):
+                path = os.path.join('functions', "%08x.toml" % addr)
+                add_data(index, path, self.functions[addr].dump().encode())
+                paths.add(path)
 
-        # dump functions, one file per function in ./functions/
-        for addr, func in self.functions.items():
-            path = os.path.join('functions', "%08x.toml" % addr)
-            add_data(index, path, func.dump().encode())
+            # removed functions are only gone from the tree once their files are
+            remove_stale_data(index, 'functions', paths)
 
-        # dump structs, one file per struct in ./structs/
-        for s_name, struct in self.structs.items():
-            path = os.path.join('structs', f"{s_name}.toml")
-            add_data(index, path, struct.dump().encode())
+            # dump structs, one file per struct in ./structs/
+            paths = set()
+            for s_name in sorted(self.structs):
+                path = os.path.join('structs', f"{s_name}.toml")
+                add_data(index, path, self.structs[s_name].dump().encode())
+                paths.add(path)
 
-        # dump comments
-        add_data(index, 'comments.toml', toml.dumps(Comment.dump_many(self.comments)).encode())
+            remove_stale_data(index, 'structs', paths)
 
-        # dump patches
-        add_data(index, 'patches.toml', toml.dumps(Patch.dump_many(self.patches)).encode())
+            # dump comments
+            add_data(index, 'comments.toml', dumps_canonical(Comment.dump_many(self.comments)).encode())
 
+            # dump patches
+            add_data(index, 'patches.toml', dumps_canonical(Patch.dump_many(self.patches)).encode())
+
+            # the journal is kept in memory only, drop the one dumped by older versions
+            if ('journal.toml', 0) in index.entries:
+                remove_data(index, 'journal.toml')
+
+    def content_hash(self) -> str:
+        """
+        A hash over every artifact in the state that ignores volatile data (last_change, metadata).
+        Two states with the same content hash dump to the same artifact blobs.
+
+        The hash is computed over every artifact once, then follows the changes made through the
+        setters, so it is O(1) to get for a state that is only changed through them.
+
+        @return: hex digest
+        """
+        if self._content is None:
+            content = ContentDigest()
+            for artifact_type, attr in STORAGE_ATTRS.items():
+                for key, artifact in getattr(self, attr).items():
+                    content.update(artifact_type, key, self._artifact_hash(artifact_type, key, artifact))
+
+            self._content = content
+            self._shared.discard("_content")
+
+        return self._content.hexdigest()
 
     @staticmethod
     def load_metadata(tree):
-        return toml.loads(tree['metadata.toml'].data_stream.read().decode())
+        return load_tree_toml(tree, 'metadata.toml')
 
-    @classmethod
-    def parse(cls, tree: git.Tree, version=None, client=None):
-        s = cls(None, client=client)
+    @staticmethod
+    def load_function(tree, path) -> Optional[Function]:
+        try:
+            func_toml = load_tree_toml(tree, path)
+        except:
+            return None
 
-        # load metadata
+        return Function.load(func_toml)
+
+    @staticmethod
+    def load_struct(tree, path) -> Optional[Struct]:
         try:
-            metadata = cls.load_metadata(tree)
+            struct_toml = load_tree_toml(tree, path)
+        except:
+            return None
+
+        return Struct.load(struct_toml)
+
+    @staticmethod
+    def load_comments(tree) -> Optional[Dict[int, Comment]]:
+        try:
+            comments_toml = load_tree_toml(tree, 'comments.toml')
+        except:
+            return None
+
+        return {comment.addr: comment for comment in Comment.load_many(comments_toml)}
+
+    @staticmethod
+    def load_patches(tree) -> Optional[Dict[int, Patch]]:
+        try:
+            patches_toml = load_tree_toml(tree, 'patches.toml')
+        except:
+            return None
+
+        return {patch.offset: patch for patch in Patch.load_many(patches_toml)}
+
+    def _load_tree_metadata(self, tree, version=None):
+        try:
+            metadata = self.load_metadata(tree)
         except:
             # metadata is not found
             raise MetadataNotFoundError()
-        s.user = metadata["user"]
 
-        s.version = version if version is not None else metadata["version"]
+        self.user = intern_str(metadata["user"])
+        self.version = version if version is not None else metadata["version"]
+        self.last_push_time = metadata.get("last_push_time", None)
+        self.last_push_artifact = metadata.get("last_push_artifact", None)
+        self.last_push_artifact_type = metadata.get("last_push_artifact_type", None)
+
+    @classmethod
+    @profiled("state_parse")
+    def parse(cls, tree: git.Tree, version=None, client=None):
+        start = time.perf_counter()
+        s = cls(None, client=client)
+
+        # load metadata
+        s._load_tree_metadata(tree, version=version)
 
-        # load functions
         tree_files = list_files_in_tree(tree)
-        function_files = [name for name in tree_files if name.startswith("functions")]
-        for func_file in function_files:
-            try:
-                func_toml = toml.loads(tree[func_file].data_stream.read().decode())
-            except:
-                pass
-            else:
-                func = Function.load(func_toml)
-                s.functions[func.addr] = func
+
+        # load functions
+        functions = {}
+        for func_file in tree_files:
+            if func_file.startswith("functions"):
+                func = cls.load_function(tree, func_file)
+                if func is not None:
+                    functions[func.addr] = func
+        s.functions = SortedDict(functions)
 
         # load comments
-        try:
-            comments_toml = toml.loads(tree['comments.toml'].data_stream.read().decode())
-        except:
-            pass
-        else:
-            comments = {}
-            for comment in Comment.load_many(comments_toml):
-                comments[comment.addr] = comment
-            s.comments = comments
+        comments = cls.load_comments(tree)
+        if comments is not None:
+            s.comments = SortedDict(comments)
+            s._rebuild_comment_index()
 
         # load patches
-        try:
-            patches_toml = toml.loads(tree['patches.toml'].data_stream.read().decode())
-        except:
-            pass
-        else:
-            patches = {}
-            for patch in Patch.load_many(patches_toml):
-                patches[patch.offset] = patch
+        patches = cls.load_patches(tree)
+        if patches is not None:
             s.patches = SortedDict(patches)
 
         # load structs
-        tree_files = list_files_in_tree(tree)
-        struct_files = [name for name in tree_files if name.startswith("structs")]
-        for struct_file in struct_files:
-            try:
-                struct_toml = toml.loads(tree[struct_file].data_stream.read().decode())
-            except:
-                pass
-            else:
-                struct = Struct.load(struct_toml)
-                s.structs[struct.name] = struct
+        for struct_file in tree_files:
+            if struct_file.startswith("structs"):
+                struct = cls.load_struct(tree, struct_file)
+                if struct is not None:
+                    s.structs[struct.name] = struct
+
+        s._recency = s._make_recency_indexes()
 
         # clear the dirty bit
         s._dirty = False
 
+        REGISTRY.histogram("binsync_parse_seconds", "Seconds spent parsing a state from git").observe(
+            time.perf_counter() - start
+        )
+        REGISTRY.counter("binsync_artifacts_parsed_total", "Artifacts loaded by State.parse").inc(
+            len(s.functions) + len(s.comments) + len(s.patches) + len(s.structs)
+        )
         return s
 
+    def apply_tree_diff(self, old_tree: git.Tree, new_tree: git.Tree) -> int:
+        """
+        Turns this state, parsed from @old_tree, into the state stored in @new_tree by reloading only
+        the files that differ between the two trees. Trees can be of any two commits, so this moves a
+        state forward as well as backward in history.
+
+        Unlike the setters, nothing is journaled: the journal only records the changes made locally.
+
+        @param old_tree:    The tree this state matches
+        @param new_tree:    The tree to move this state to
+        @return:            The number of files that were reloaded
+        """
+        self._check_writable()
+        changed_paths = set()
+        for diff in old_tree.diff(new_tree):
+            changed_paths.update(p for p in (diff.a_path, diff.b_path) if p)
+
+        for path in changed_paths:
+            if path.startswith("functions"):
+                # the name of a function file is its address
+                addr = int(os.path.splitext(os.path.basename(path))[0], 16)
+                func = self.load_function(new_tree, path)
+                self._save_undo("functions", addr)
+                functions = self._writable("functions")
+                if func is None:
+                    functions.pop(addr, None)
+                else:
+                    functions[addr] = func
+                if self._owned_funcs is not None:
+                    self._owned_funcs.add(addr)
+            elif path.startswith("structs"):
+                name = os.path.splitext(os.path.basename(path))[0]
+                struct = self.load_struct(new_tree, path)
+                self._save_undo("structs", name)
+                structs = self._writable("structs")
+                if struct is None:
+                    structs.pop(name, None)
+                else:
+                    structs[name] = struct
+            elif path == "comments.toml":
+                self._save_container_undo("comments")
+                self._shared.discard("comments")
+                self.comments = SortedDict(self.load_comments(new_tree) or {})
+                self._rebuild_comment_index()
+            elif path == "patches.toml":
+                self._save_container_undo("patches")
+                self._shared.discard("patches")
+                self.patches = SortedDict(self.load_patches(new_tree) or {})
+            elif path == "metadata.toml":
+                self._load_tree_metadata(new_tree)
+
+        if changed_paths:
+            self._shared.discard("_recency")
+            self._recency = self._make_recency_indexes()
+            # reloaded artifacts are not journaled, recompute the digest when it is needed
+            self._shared.discard("_content")
+            self._content = None
+
+        return len(changed_paths)
+
     def copy_state(self, target_state=None):
         if target_state is None:
             print("Cannot copy an empty state (state == None)")
             return
 
-        self.functions = target_state.functions.copy()
-        self.comments = target_state.comments.copy()
-        self.patches = target_state.patches.copy()
-        self.structs = target_state.structs.copy()
-        
+        self._check_writable()
+        for artifact_type in STORAGE_ATTRS:
+            self._journal_replace(artifact_type, target_state)
+
+        # share the artifacts of the target instead of copying them, both states copy on write
+        target_snapshot = target_state.snapshot()
+        for attr in ("functions", "comments", "patches", "structs"):
+            self._save_container_undo(attr)
+        self.functions = target_snapshot.functions
+        self.comments = target_snapshot.comments
+        self.patches = target_snapshot.patches
+        self.structs = target_snapshot.structs
+        self._shared.update(("functions", "comments", "patches", "structs"))
+        self._owned_funcs = set()
+
+        self._rebuild_comment_index()
+        self._shared.discard("_recency")
+        self._recency = self._make_recency_indexes()
+        self._dirty = True
+
+    def apply_journal(self, entries: Iterable[JournalEntry]) -> int:
+        """
+        Replays journal entries recorded by another copy of a state onto this state. The entries are
+        also added to this state's journal so the state knows how far it has been caught up.
+
+        @param entries: JournalEntries, normally Journal.since(self.journal.last_seq)
+        @return:        Number of entries applied
+        """
+        applied = []
+        for entry in entries:
+            if entry.seq is not None and entry.seq <= self.journal.last_seq:
+                continue
+
+            attr = self._storage_attr(entry.artifact_type)
+            self._save_undo(attr, entry.key)
+            container = self._writable(attr)
+            old_artifact = container.get(entry.key, None)
+
+            if entry.op == JournalOp.SET:
+                artifact = ARTIFACT_LOADERS[entry.artifact_type].load(entry.artifact)
+                if isinstance(artifact, Comment) and artifact.func_addr:
+                    self.get_or_make_function(artifact.func_addr)
+                container[entry.key] = artifact
+                if entry.artifact_type == ArtifactGroupType.FUNCTION and self._owned_funcs is not None:
+                    self._owned_funcs.add(entry.key)
+                self._update_content(
+                    entry.artifact_type, entry.key, self._artifact_hash(entry.artifact_type, entry.key, artifact)
+                )
+            else:
+                artifact = old_artifact
+                container.pop(entry.key, None)
+                self._hash_cache.pop((entry.artifact_type, entry.key), None)
+                self._update_content(entry.artifact_type, entry.key, None)
+
+            if entry.artifact_type == ArtifactGroupType.COMMENT:
+                if old_artifact is not None:
+                    self._unindex_comment(old_artifact)
+                if entry.op == JournalOp.SET:
+                    self._index_comment(artifact)
+
+            if artifact is not None:
+                self._update_recency(artifact)
+            applied.append(entry)
+
+        if applied:
+            self._writable("journal").extend(applied)
+            self._dirty = True
+
+        return len(applied)
+
+    #
+    # Snapshots
+    #
+
+    def snapshot(self, readonly=True) -> "State":
+        """
+        Takes a read-only snapshot of the state in O(1). The snapshot and this state share every
+        container and artifact; whichever of them is written to next copies only what it touches:
+        a container is copied once on its first write, and a Function once on its first modification.
+
+        Snapshots can be read from any thread without holding the client's commit_lock.
+
+        @param readonly:    False for a writable copy that shares data the same way
+        @return:            A State, read-only by default
+        """
+        snap = State(self.user, version=self.version, client=self.client)
+        for attr in COW_COPIERS:
+            setattr(snap, attr, getattr(self, attr))
+
+        snap.last_push_artifact = self.last_push_artifact
+        snap.last_push_artifact_type = self.last_push_artifact_type
+        snap.last_push_time = self.last_push_time
+        snap._dirty = self._dirty
+        snap._last_commit_hash = self._last_commit_hash
+        snap._hash_cache = self._hash_cache
+
+        snap._readonly = readonly
+        snap._shared = set(COW_COPIERS)
+        snap._owned_funcs = set()
+        self._shared = set(COW_COPIERS)
+        self._owned_funcs = set()
+
+        return snap
+
+    @property
+    def readonly(self):
+        return self._readonly
+
+    def _check_writable(self):
+        if self._readonly:
+            raise RuntimeError("Cannot modify a read-only State snapshot.")
+
+    def _writable(self, attr):
+        """
+        Returns the container stored in @attr, copying it first if it is shared with a snapshot.
+        """
+        self._check_writable()
+        if attr in self._shared:
+            setattr(self, attr, COW_COPIERS[attr](getattr(self, attr)))
+            self._shared.discard(attr)
+
+        return getattr(self, attr)
+
+    def restore(self, snapshot: "State"):
+        """
+        Rolls this state back to @snapshot, which must have been taken from this state.
+        """
+        self._check_writable()
+        for attr in COW_COPIERS:
+            setattr(self, attr, getattr(snapshot, attr))
+
+        self.last_push_artifact = snapshot.last_push_artifact
+        self.last_push_artifact_type = snapshot.last_push_artifact_type
+        self.last_push_time = snapshot.last_push_time
+        self._dirty = snapshot._dirty
+        self._last_commit_hash = snapshot._last_commit_hash
+
+        self._shared = set(COW_COPIERS)
+        self._owned_funcs = set()
+
+    def checkpoint_journal(self) -> int:
+        return self._writable("journal").checkpoint()
+
     def save(self):
         if self.client is None:
             raise RuntimeError("save(): State.client is None.")
         self.client.commit_state(self)
 
+    #
+    # Batches
+    #
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Applies every change made inside the context as one batch: all changed artifacts share a
+        single last_change timestamp, and if an exception escapes the context the state is rolled
+        back to what it was when the batch started. Batches can be nested; only the outermost counts.
+
+        Only what the batch changes is remembered for the rollback, so a batch costs as much as its
+        changes no matter how large the state is.
+        """
+        if self._batch_depth > 0:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+            return
+
+        self._check_writable()
+        before = (
+            self.last_push_artifact, self.last_push_artifact_type, self.last_push_time,
+            self._dirty, self._last_commit_hash, self.journal.last_seq,
+        )
+        # owned functions are changed in place, own none so the batch copies the ones it changes
+        self._owned_funcs = set()
+        self._batch_undo = {}
+        self._batch_containers = {}
+        self._batch_time = int(time.time())
+        self._batch_depth = 1
+        try:
+            yield self
+        except BaseException:
+            self._rollback_batch(before)
+            raise
+        finally:
+            self._batch_undo = None
+            self._batch_containers = None
+            self._batch_time = None
+            self._batch_depth = 0
+
+    def _save_undo(self, attr, key):
+        """
+        Remembers what @key was in the container @attr when the current batch started.
+        """
+        if self._batch_undo is None or attr in self._batch_containers:
+            return
+
+        saved = self._batch_undo.setdefault(attr, {})
+        if key not in saved:
+            saved[key] = getattr(self, attr).get(key, _MISSING)
+
+    def _save_container_undo(self, attr):
+        """
+        Remembers the container @attr before the current batch replaces it as a whole.
+        """
+        if self._batch_undo is None or attr in self._batch_containers:
+            return
+
+        self._batch_containers[attr] = getattr(self, attr)
+
+    def _rollback_batch(self, before):
+        (
+            self.last_push_artifact, self.last_push_artifact_type, self.last_push_time,
+            self._dirty, self._last_commit_hash, last_seq,
+        ) = before
+
+        for attr, container in self._batch_containers.items():
+            setattr(self, attr, container)
+            self._shared.add(attr)
+        if self._batch_containers:
+            self._shared.discard("_content")
+            self._content = None
+
+        for artifact_type, attr in STORAGE_ATTRS.items():
+            saved = self._batch_undo.get(attr, {})
+            container = self._writable(attr) if saved else None
+            for key, artifact in saved.items():
+                if artifact is _MISSING:
+                    container.pop(key, None)
+                else:
+                    container[key] = artifact
+                self._update_content(artifact_type, key, self._stored_hash(artifact_type, key))
+
+        # the restored functions may be shared, and the indexes are rebuilt from the restored artifacts
+        self._owned_funcs = set()
+        self._writable("journal").discard_after(last_seq)
+        self._rebuild_comment_index()
+        self._shared.discard("_recency")
+        self._recency = self._make_recency_indexes()
+
+    def set_many(self, artifacts: Iterable, set_last_change=True) -> int:
+        """
+        Sets many artifacts of any type in a single batch.
+
+        @param artifacts:       Functions, FunctionHeaders, StackVariables, Comments, Patches and Structs
+        @param set_last_change: False when the artifacts come from another user
+        @return:                The number of artifacts that changed the state
+        """
+        changed = 0
+        with self.batch():
+            for artifact in artifacts:
+                if isinstance(artifact, Function):
+                    if artifact.header is not None:
+                        changed += bool(self.set_function_header(artifact.header, set_last_change=set_last_change))
+                    for offset, stack_var in artifact.stack_vars.items():
+                        changed += bool(
+                            self.set_stack_variable(stack_var, offset, artifact.addr, set_last_change=set_last_change)
+                        )
+                elif isinstance(artifact, FunctionHeader):
+                    changed += bool(self.set_function_header(artifact, set_last_change=set_last_change))
+                elif isinstance(artifact, StackVariable):
+                    changed += bool(self.set_stack_variable(
+                        artifact, artifact.stack_offset, artifact.func_addr, set_last_change=set_last_change
+                    ))
+                elif isinstance(artifact, Comment):
+                    changed += bool(self.set_comment(artifact, set_last_change=set_last_change))
+                elif isinstance(artifact, Patch):
+                    changed += bool(self.set_patch(artifact, artifact.offset, set_last_change=set_last_change))
+                elif isinstance(artifact, Struct):
+                    changed += bool(self.set_struct(artifact, None, set_last_change=set_last_change))
+                else:
+                    raise TypeError(f"Unsupported artifact type {type(artifact)}.")
+
+        return changed
+
     #
     # Setters
     #
@@ -330,10 +927,11 @@ class State:
     @dirty_checker
     @update_last_change
     def set_function_header(self, func_header: FunctionHeader, set_last_change=True):
-        if self.functions[func_header.addr] == func_header:
+        if self.functions[func_header.addr].header == func_header:
             return False
 
-        self.functions[func_header.addr].header = func_header
+        # headers are changed in place by function comments, never store one the caller may share
+        self._get_writable_function(func_header.addr).header = func_header.copy()
         return True
 
     @dirty_checker
@@ -344,17 +942,70 @@ class State:
 
         # comment in the function header
         is_func_cmt = comment.addr == comment.func_addr
-        if is_func_cmt and self.functions[comment.addr].header.comment != comment.comment:
-            self.functions[comment.addr].header.comment = comment.comment
+        header = self.functions[comment.addr].header if is_func_cmt else None
+        if is_func_cmt and (header is None or header.comment != comment.comment):
+            # the header may be shared with snapshots, change a copy of it
+            header = header.copy() if header is not None else FunctionHeader(None, comment.addr)
+            header.comment = comment.comment
+            self._get_writable_function(comment.addr).header = header
             return True
 
         # comment located elsewhere in memory
         elif comment.addr not in self.comments or self.comments[comment.addr] != comment:
-            self.comments[comment.addr] = comment
+            old_comment = self.comments.get(comment.addr, None)
+            if old_comment is not None:
+                self._unindex_comment(old_comment)
+
+            self._save_undo("comments", comment.addr)
+            self._writable("comments")[comment.addr] = comment
+            self._index_comment(comment)
             return True
 
         return False
 
+    @dirty_checker
+    def remove_comment(self, addr):
+        if addr not in self.comments:
+            return False
+
+        self._save_undo("comments", addr)
+        comment = self._writable("comments").pop(addr)
+
+        self._unindex_comment(comment)
+        self._writable("_recency")[ArtifactGroupType.COMMENT].remove(addr)
+        self._journal_remove(ArtifactGroupType.COMMENT, addr, comment)
+        return True
+
+    @dirty_checker
+    def remove_stack_variable(self, offset, func_addr):
+        if func_addr not in self.functions or offset not in self.functions[func_addr].stack_vars:
+            return False
+
+        old_hash = self._stored_hash(ArtifactGroupType.FUNCTION, func_addr)
+        self._get_writable_function(func_addr).stack_vars.pop(offset)
+        self._journal_set(ArtifactGroupType.FUNCTION, func_addr, old_hash)
+        return True
+
+    @dirty_checker
+    def remove_artifact(self, artifact_type, key):
+        """
+        Removes whatever is stored under @key for @artifact_type: a whole Function, Comment, Patch or Struct.
+        """
+        if artifact_type == ArtifactGroupType.COMMENT:
+            return self.remove_comment(key)
+
+        if key not in self._storage_container(artifact_type):
+            return False
+
+        self._save_undo(self._storage_attr(artifact_type), key)
+        artifact = self._writable(self._storage_attr(artifact_type)).pop(key)
+        if artifact_type == ArtifactGroupType.FUNCTION and self._owned_funcs is not None:
+            self._owned_funcs.discard(key)
+
+        self._writable("_recency")[artifact_type].remove(key)
+        self._journal_remove(artifact_type, key, artifact)
+        return True
+
     @dirty_checker
     @update_last_change
     def set_patch(self, patch, addr, set_last_change=True):
@@ -363,7 +1014,8 @@ class State:
             # no update is required
             return False
 
-        self.patches[addr] = patch
+        self._save_undo("patches", addr)
+        self._writable("patches")[addr] = patch
         return True
 
     @dirty_checker
@@ -372,7 +1024,7 @@ class State:
         if offset in self.functions[func_addr].stack_vars and variable == self.functions[func_addr].stack_vars[offset]:
             return False
 
-        self.functions[func_addr].stack_vars[offset] = variable
+        self._get_writable_function(func_addr).stack_vars[offset] = variable
         return True
 
     @dirty_checker
@@ -397,17 +1049,216 @@ class State:
             return False
 
         # delete old struct only when we know what it is
-        if old_name is not None:
-            try:
-                del self.structs[old_name]
-                # delete the repo toml for the struct
-                remove_data(self.client.repo.index, os.path.join('structs', f'{old_name}.toml'))
-            except KeyError:
-                pass
+        if old_name is not None and old_name in self.structs:
+            self._save_undo("structs", old_name)
+            old_struct = self._writable("structs").pop(old_name)
+            self._writable("_recency")[ArtifactGroupType.STRUCT].remove(old_name)
+            self._journal_remove(ArtifactGroupType.STRUCT, old_name, old_struct)
+
+            # delete the repo toml for the struct
+            if self.client is not None:
+                try:
+                    remove_data(self.client.repo.index, os.path.join('structs', f'{old_name}.toml'))
+                except git.GitCommandError:
+                    # the struct was never committed
+                    pass
 
         # set the new struct
         if struct.name is not None:
-            self.structs[struct.name] = struct
+            self._save_undo("structs", struct.name)
+            self._writable("structs")[struct.name] = struct
+
+        return True
+
+    #
+    # Indexes
+    #
+
+    def _index_comment(self, comment: Comment):
+        if comment.func_addr is not None:
+            self._writable("_func_comments")[comment.func_addr].add(comment.addr)
+
+    def _unindex_comment(self, comment: Comment):
+        if comment.func_addr not in self._func_comments:
+            return
+
+        func_comments = self._writable("_func_comments")
+        addrs = func_comments[comment.func_addr]
+        addrs.discard(comment.addr)
+        if not addrs:
+            del func_comments[comment.func_addr]
+
+    def _rebuild_comment_index(self):
+        self._check_writable()
+        self._shared.discard("_func_comments")
+        self._func_comments = defaultdict(set)
+        for comment in self.comments.values():
+            self._index_comment(comment)
+
+    def _make_recency_indexes(self) -> Dict[int, RecencyIndex]:
+        return {
+            ArtifactGroupType.FUNCTION: RecencyIndex(
+                (addr, func.last_change) for addr, func in self.functions.items()
+            ),
+            ArtifactGroupType.COMMENT: RecencyIndex(
+                (addr, cmt.last_change) for addr, cmt in self.comments.items() if not cmt.func_addr
+            ),
+            ArtifactGroupType.PATCH: RecencyIndex(
+                (addr, patch.last_change) for addr, patch in self.patches.items()
+            ),
+            ArtifactGroupType.STRUCT: RecencyIndex(
+                (name, struct.last_change) for name, struct in self.structs.items()
+            ),
+        }
+
+    def _update_recency(self, artifact):
+        """
+        Syncs the recency index entry of the artifact group @artifact belongs to with what is stored.
+        Comments and stack variables inside a function count as a change to their function.
+        """
+        if isinstance(artifact, (Function, FunctionHeader)):
+            artifact_type, key, stored = ArtifactGroupType.FUNCTION, artifact.addr, self.functions
+        elif isinstance(artifact, StackVariable) or (isinstance(artifact, Comment) and artifact.func_addr):
+            artifact_type, key, stored = ArtifactGroupType.FUNCTION, artifact.func_addr, self.functions
+        elif isinstance(artifact, Comment):
+            artifact_type, key, stored = ArtifactGroupType.COMMENT, artifact.addr, self.comments
+        elif isinstance(artifact, Patch):
+            artifact_type, key, stored = ArtifactGroupType.PATCH, artifact.offset, self.patches
+        elif isinstance(artifact, Struct):
+            artifact_type, key, stored = ArtifactGroupType.STRUCT, artifact.name, self.structs
+        else:
+            return
+
+        if key is None:
+            return
+
+        stored_artifact = stored.get(key, None)
+        self._writable("_recency")[artifact_type].update(
+            key, stored_artifact.last_change if stored_artifact else None
+        )
+
+    #
+    # Journal
+    #
+
+    @staticmethod
+    def _storage_attr(artifact_type) -> str:
+        try:
+            return STORAGE_ATTRS[artifact_type]
+        except KeyError:
+            raise ValueError(f"Unknown artifact type {artifact_type}.")
+
+    def _storage_container(self, artifact_type) -> Dict:
+        return getattr(self, self._storage_attr(artifact_type))
+
+    @staticmethod
+    def _storage_group(artifact):
+        """
+        Returns the (artifact_type, key) @artifact is stored under. Unlike recency, this follows where
+        the data lives: function comments and stack vars live in the Function, other comments do not.
+        """
+        if isinstance(artifact, FunctionHeader):
+            return ArtifactGroupType.FUNCTION, artifact.addr
+        elif isinstance(artifact, StackVariable):
+            return ArtifactGroupType.FUNCTION, artifact.func_addr
+        elif isinstance(artifact, Comment):
+            if artifact.func_addr is not None and artifact.addr == artifact.func_addr:
+                return ArtifactGroupType.FUNCTION, artifact.addr
+            return ArtifactGroupType.COMMENT, artifact.addr
+        elif isinstance(artifact, Patch):
+            return ArtifactGroupType.PATCH, artifact.offset
+        elif isinstance(artifact, Struct):
+            return ArtifactGroupType.STRUCT, artifact.name
+
+        return ArtifactGroupType.UNSET, None
+
+    def _artifact_hash(self, artifact_type, key, artifact, refresh=False) -> str:
+        cached = self._hash_cache.get((artifact_type, key), None)
+        if not refresh and cached is not None and cached[0] is artifact:
+            return cached[1]
+
+        content_hash = artifact.content_hash()
+        self._hash_cache[(artifact_type, key)] = (artifact, content_hash)
+        return content_hash
+
+    def _stored_hash(self, artifact_type, key) -> Optional[str]:
+        if key is None or artifact_type == ArtifactGroupType.UNSET:
+            return None
+
+        stored = self._storage_container(artifact_type).get(key, None)
+        return self._artifact_hash(artifact_type, key, stored) if stored is not None else None
+
+    def _same_artifact(self, artifact_type, key, other: "State") -> bool:
+        """
+        Compares the artifact stored under @key in this state and in @other, using the cheapest
+        available check: identity (shared by a snapshot), then known content hashes, then equality.
+        """
+        mine = self._storage_container(artifact_type)[key]
+        theirs = other._storage_container(artifact_type)[key]
+        if mine is theirs:
+            return True
+
+        my_hash = self._hash_cache.get((artifact_type, key), None)
+        their_hash = other._hash_cache.get((artifact_type, key), None)
+        if my_hash is not None and their_hash is not None and my_hash[0] is mine and their_hash[0] is theirs:
+            return my_hash[1] == their_hash[1]
+
+        return mine == theirs
+
+    def _journal_set(self, artifact_type, key, old_hash):
+        if key is None or artifact_type == ArtifactGroupType.UNSET:
+            return
+
+        stored = self._storage_container(artifact_type).get(key, None)
+        if stored is None:
+            return
+
+        # the stored artifact may have been modified in place, so its hash is always recomputed
+        new_hash = self._artifact_hash(artifact_type, key, stored, refresh=True)
+        self._update_content(artifact_type, key, new_hash)
+        self._writable("journal").append(
+            JournalOp.SET, artifact_type, key,
+            old_hash=old_hash, new_hash=new_hash, artifact=stored.__getstate__()
+        )
+
+    def _journal_remove(self, artifact_type, key, old_artifact):
+        old_hash = self._artifact_hash(artifact_type, key, old_artifact) if old_artifact is not None else None
+        self._hash_cache.pop((artifact_type, key), None)
+        self._update_content(artifact_type, key, None)
+        self._writable("journal").append(JournalOp.REMOVE, artifact_type, key, old_hash=old_hash)
+
+    def _journal_replace(self, artifact_type, target_state: "State"):
+        """
+        Journals the replacement of a whole artifact container with the one of @target_state. Hashes
+        come from the caches of both states, so only artifacts neither state hashed yet are hashed.
+        """
+        old_artifacts = self._storage_container(artifact_type)
+        new_artifacts = target_state._storage_container(artifact_type)
+        for key, old_artifact in old_artifacts.items():
+            if key not in new_artifacts:
+                self._journal_remove(artifact_type, key, old_artifact)
+
+        for key, new_artifact in new_artifacts.items():
+            old_artifact = old_artifacts.get(key, None)
+            if old_artifact is new_artifact:
+                continue
+
+            old_hash = self._artifact_hash(artifact_type, key, old_artifact) if old_artifact is not None else None
+            new_hash = target_state._artifact_hash(artifact_type, key, new_artifact)
+            self._hash_cache[(artifact_type, key)] = (new_artifact, new_hash)
+            if old_hash == new_hash:
+                continue
+
+            self._update_content(artifact_type, key, new_hash)
+            self._writable("journal").append(
+                JournalOp.SET, artifact_type, key,
+                old_hash=old_hash, new_hash=new_hash, artifact=new_artifact.__getstate__()
+            )
+
+    def _update_content(self, artifact_type, key, content_hash: Optional[str]):
+        # an unknown digest is computed over everything when it is needed
+        if self._content is not None:
+            self._writable("_content").update(artifact_type, key, content_hash)
 
     #
     # Getters
@@ -417,9 +1268,29 @@ class State:
         try:
             func = self.functions[addr]
         except KeyError:
-            self.functions[addr] = Function(addr)
-            func = self.functions[addr]
+            func = Function(addr)
+            self._save_undo("functions", addr)
+            self._writable("functions")[addr] = func
+            if self._owned_funcs is not None:
+                self._owned_funcs.add(addr)
+            self._update_content(
+                ArtifactGroupType.FUNCTION, addr, self._artifact_hash(ArtifactGroupType.FUNCTION, addr, func)
+            )
+
+        return func
 
+    def _get_writable_function(self, addr) -> Function:
+        """
+        Like get_or_make_function, but guarantees the returned Function is not shared with a snapshot.
+        """
+        func = self.get_or_make_function(addr)
+        if self._owned_funcs is None or addr in self._owned_funcs:
+            return func
+
+        self._save_undo("functions", addr)
+        func = func.copy()
+        self._writable("functions")[addr] = func
+        self._owned_funcs.add(addr)
         return func
 
     def get_function(self, addr) -> Function:
@@ -432,7 +1303,8 @@ class State:
         if addr in self.comments:
             return self.comments[addr]
 
-        elif addr in self.functions and self.functions[addr].header.comment is not None:
+        elif addr in self.functions and self.functions[addr].header is not None \
+                and self.functions[addr].header.comment is not None:
             return Comment(addr, self.functions[addr].header.comment)
 
         else:
@@ -443,12 +1315,9 @@ class State:
             return {}
 
         # include the function comment
-        cmts = {func_addr: Comment(func_addr, self.functions[func_addr].header.comment)}
-        for addr, comment in self.comments.items():
-            if comment.func_addr != func_addr:
-                continue
-
-            cmts[comment.addr] = comment
+        cmts = {func_addr: Comment(func_addr, self.functions[func_addr].comment)}
+        for addr in sorted(self._func_comments.get(func_addr, ())):
+            cmts[addr] = self.comments[addr]
 
         return cmts
 
@@ -481,24 +1350,82 @@ class State:
     def get_structs(self) -> Iterable[Struct]:
         return self.structs.values()
 
-    def get_last_push_for_artifact_type(self, artifact_type):
-        last_change = -1
-        artifact = None
+    #
+    # Address Queries
+    #
 
+    def _addr_index(self, artifact_type) -> SortedDict:
         if artifact_type == ArtifactGroupType.FUNCTION:
-            for function in self.functions.values():
-                if function.last_change > last_change:
-                    last_change = function.last_change
-                    artifact = function.addr
-        elif artifact_type == ArtifactGroupType.STRUCT:
-            for struct in self.structs.values():
-                if struct.last_change > last_change:
-                    last_change = struct.last_change
-                    artifact = struct.name
+            return self.functions
+        elif artifact_type == ArtifactGroupType.COMMENT:
+            return self.comments
         elif artifact_type == ArtifactGroupType.PATCH:
-            for patch in self.patches.values():
-                if patch.last_change > last_change:
-                    last_change = patch.last_change
-                    artifact = patch.offset
+            return self.patches
+
+        raise ValueError(f"Artifact type {artifact_type} is not keyed by address.")
+
+    def get_artifacts_in_range(self, artifact_type, start, end) -> Iterable:
+        """
+        Iterates, in address order, all the artifacts of @artifact_type located in [start, end).
+
+        @param artifact_type:   An ArtifactGroupType that is keyed by address (function, comment, patch)
+        @param start:           First address of the range
+        @param end:             Address after the last address of the range
+        @return:
+        """
+        index = self._addr_index(artifact_type)
+        for addr in index.irange(start, end, inclusive=(True, False)):
+            yield index[addr]
+
+    def get_nearest_artifact(self, artifact_type, addr):
+        """
+        Returns the artifact of @artifact_type with the highest address that is <= @addr, or None.
+        """
+        index = self._addr_index(artifact_type)
+        idx = index.bisect_right(addr)
+        if idx == 0:
+            return None
+
+        return index.peekitem(idx - 1)[1]
 
-        return tuple((artifact, last_change))
+    def get_func_containing(self, addr) -> Optional[Function]:
+        """
+        Returns the function that contains @addr. Functions carry no size, so outside of what the
+        comments at @addr record, this is the closest function starting at or before @addr.
+        """
+        comment = self.comments.get(addr, None)
+        if comment is not None and comment.func_addr in self.functions:
+            return self.functions[comment.func_addr]
+
+        return self.get_nearest_artifact(ArtifactGroupType.FUNCTION, addr)
+
+    def get_last_push_for_artifact_type(self, artifact_type):
+        try:
+            latest = self._recency[artifact_type].latest()
+        except KeyError:
+            latest = None
+
+        return latest if latest is not None else tuple((None, -1))
+
+    def recent(self, k=None, since=None, artifact_type=None) -> List[tuple]:
+        """
+        Returns the most recently changed artifacts, newest first, as (artifact_type, key, last_change)
+        tuples. Function keys are addresses, struct keys are names. Comments and stack variables count
+        as a change to the function they are in.
+
+        @param k:               Max number of changes to return, None for all
+        @param since:           Only include changes made at or after this unix time
+        @param artifact_type:   Restrict to one ArtifactGroupType, None for all of them
+        @return:
+        """
+        if artifact_type is not None:
+            indexes = {artifact_type: self._recency[artifact_type]}
+        else:
+            indexes = self._recency
+
+        # each index is already sorted, so merging them only touches the newest k of each
+        streams = [
+            zip(itertools.repeat(a_type), index.recent(k=k, since=since)) for a_type, index in indexes.items()
+        ]
+        merged = heapq.merge(*streams, key=lambda x: x[1][1], reverse=True)
+        return [(a_type, key, last_change) for a_type, (key, last_change) in itertools.islice(merged, k)]
@@ -40,6 +40,14 @@ class AngrBinSyncController(BinSyncController):
 
         return binsync.data.Function(func.addr, header=FunctionHeader(func.name, func.addr))
 
+    def related_functions(self, func_addr):
+        # callees first, they are the most likely to be visited next
+        callgraph = self._instance.kb.functions.callgraph
+        if func_addr not in callgraph:
+            return []
+
+        return list(callgraph.successors(func_addr)) + list(callgraph.predecessors(func_addr))
+
     #
     # Display Fillers
     #
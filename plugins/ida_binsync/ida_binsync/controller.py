@@ -20,7 +20,6 @@
 from functools import wraps
 import re
 import threading
-import time
 import datetime
 import logging
 from typing import Dict, List, Tuple
@@ -113,6 +112,9 @@ class UpdateTaskState:
 #
 
 class IDABinSyncController(BinSyncController):
+    # comments are pushed with their function first in IDA
+    CMD_KEY_ARGS = dict(BinSyncController.CMD_KEY_ARGS, push_comment=(1,))
+
     def __init__(self):
         super(IDABinSyncController, self).__init__()
 
@@ -133,13 +135,6 @@ class IDABinSyncController(BinSyncController):
         with self.api_lock:
             self.api_count += 1
 
-    def make_controller_cmd(self, cmd_func, *args, **kwargs):
-        with self.queue_lock:
-            if cmd_func == self.push_struct:
-                self.cmd_queue[args[0].name] = (cmd_func, args, kwargs)
-            else:
-                self.cmd_queue[time.time()] = (cmd_func, args, kwargs)
-
     #
     # Controller Interaction
     #
@@ -147,6 +142,10 @@ class IDABinSyncController(BinSyncController):
     def binary_hash(self) -> str:
         return idc.retrieve_input_file_md5().hex()
 
+    def run_in_main_thread(self, func, *args, **kwargs):
+        # the IDA database may only be changed from the main thread
+        return compat.execute_write(func)(*args, **kwargs)
+
     def active_context(self):
         return self._updated_ctx
 
@@ -291,32 +290,6 @@ class IDABinSyncController(BinSyncController):
     #   Pullers
     #
 
-    @init_checker
-    def sync_all(self, user=None, state=None):
-        # copy the actual state from the other user
-        self.client.sync_states(user=user)
-        new_state = self.client.get_state(user=self.client.master_user)
-        func_addrs = new_state.functions.keys()
-        print("[BinSync]: Target Addrs for sync being cached:", [hex(x) for x in func_addrs])
-
-        # set the new stuff in the UI
-        for func_addr in func_addrs:
-            if func_addr:
-                try:
-                    target_func = new_state.get_function(func_addr)
-                    remote_name = target_func.name
-
-                    if remote_name != "" and remote_name:
-                        compat.set_ida_func_name(func_addr, remote_name)
-                except Exception:
-                    pass
-
-            update_task = UpdateTask(
-                self.fill_function,
-                func_addr, user=self.client.master_user
-            )
-            self.update_states[func_addr].add_update_task(update_task)
-
     @init_checker
     @make_state
     def remove_all_comments(self, ida_func, user=None, state=None):
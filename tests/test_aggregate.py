@@ -0,0 +1,104 @@
+import sys
+import tempfile
+
+import unittest
+
+import binsync
+from binsync.aggregate import AggregateIndex
+from binsync.indexes import SearchIndex
+
+
+class TestAggregate(unittest.TestCase):
+    def test_aggregate_refresh(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user1", tmpdir, "fake_hash", init_repo=True)
+            client.get_state().set_function_header(binsync.data.FunctionHeader("user1_main", 0x400000))
+            client.commit_state()
+            client.close()
+            client.repo_lock.release()
+            client.repo_lock = None
+
+            client = binsync.Client("user0", tmpdir, "fake_hash")
+            state = client.get_state()
+            state.set_function_header(binsync.data.FunctionHeader("main", 0x400000))
+            state.set_struct(binsync.data.Struct("my_struct", 8, []), None)
+            client.commit_state()
+
+            index = AggregateIndex()
+            changes = index.refresh(client)
+            self.assertEqual(changes.functions, {0x400000})
+            self.assertEqual(changes.structs, {"my_struct"})
+            self.assertEqual(changes.users, {"user0", "user1"})
+
+            summary = index.summary(binsync.ArtifactGroupType.FUNCTION, 0x400000)
+            self.assertEqual(summary.names(), {"user0": "main", "user1": "user1_main"})
+            self.assertEqual(summary.latest_user, "user0")
+            self.assertEqual(index.user_summary("user1").recent_function, 0x400000)
+
+            # nothing moved
+            self.assertFalse(index.refresh(client))
+
+            # only what changed since the last refresh is reindexed
+            state.set_function_header(binsync.data.FunctionHeader("foo", 0x401000))
+            client.commit_state()
+            changes = index.refresh(client)
+            self.assertEqual(changes.functions, {0x401000})
+            self.assertEqual(changes.structs, set())
+            self.assertEqual(index.users_of(binsync.ArtifactGroupType.FUNCTION, 0x401000), ["user0"])
+            client.close()
+
+    def test_aggregate_search(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user0", tmpdir, "fake_hash", init_repo=True)
+            state = client.get_state()
+            state.set_function_header(binsync.data.FunctionHeader("parse_packet", 0x400000))
+            state.set_function_header(binsync.data.FunctionHeader("main", 0x401000))
+            state.set_struct(binsync.data.Struct("packet_hdr", 8, []), None)
+            state.set_comment(binsync.data.Comment(0x401010, "Checksum is skipped", func_addr=0x401000))
+            client.commit_state()
+
+            index = AggregateIndex()
+            index.refresh(client)
+
+            results = index.search("PACKET")
+            self.assertEqual(results.functions, {0x400000})
+            self.assertEqual(results.structs, {"packet_hdr"})
+            self.assertEqual(results.users, set())
+            self.assertEqual(index.search("0x401").functions, {0x401000})
+            self.assertEqual(index.search("checksum").functions, {0x401000})
+            self.assertEqual(index.search("user0").users, {"user0"})
+            self.assertEqual(index.search("user0").functions, {0x400000, 0x401000})
+
+            # the search index follows renames
+            state.set_function_header(binsync.data.FunctionHeader("recv_msg", 0x400000))
+            client.commit_state()
+            index.refresh(client)
+            self.assertEqual(index.search("packet").functions, set())
+            self.assertEqual(index.search("recv").functions, {0x400000})
+            client.close()
+
+    def test_search_index(self):
+        index = SearchIndex()
+        index.set("a", ["sub_400000", "alice"])
+        index.set("b", ["parse_packet", "bob"])
+        index.set("c", ["packet_len", "alice"])
+        index.set("d", ["abcbcd"])
+
+        self.assertEqual(index.search("packet"), {"b", "c"})
+        self.assertEqual(index.search("Alice"), {"a", "c"})
+        self.assertEqual(index.search("p"), {"b", "c"})
+        # all trigrams of the query, but not the query
+        self.assertEqual(index.search("abcd"), set())
+        self.assertEqual(index.search("et_l"), {"c"})
+        self.assertEqual(index.search(""), set())
+
+        index.set("c", ["packet_len", "bob"])
+        self.assertEqual(index.search("alice"), {"a"})
+        index.remove("b")
+        self.assertEqual(index.search("bob"), {"c"})
+        self.assertEqual(index.search("parse"), set())
+        self.assertEqual(len(index), 3)
+
+
+if __name__ == "__main__":
+    unittest.main(argv=sys.argv)
@@ -1,9 +1,13 @@
 import os
 import sys
 import tempfile
+import threading
+import time
 
 import unittest
 
+import git
+
 import binsync
 
 
@@ -40,6 +44,256 @@ class TestClient(unittest.TestCase):
             # git is still running at least on windows
             client.close()
 
+    def test_client_skips_unchanged_commit(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user0", tmpdir, "fake_hash", init_repo=True)
+            state = client.get_state()
+            state.set_function_header(binsync.data.FunctionHeader("some_name", 0x400080))
+            client.commit_state()
+            head = client.repo.head.commit.hexsha
+
+            # only a volatile field changes, so nothing new is committed
+            state.functions[0x400080].last_change += 10
+            client.commit_state()
+            self.assertEqual(client.repo.head.commit.hexsha, head)
+
+            state.set_function_header(binsync.data.FunctionHeader("new_name", 0x400080))
+            client.commit_state()
+            self.assertNotEqual(client.repo.head.commit.hexsha, head)
+
+            client.close()
+
+    def test_client_transaction(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user0", tmpdir, "fake_hash", init_repo=True)
+            commits_before = len(list(client.repo.iter_commits()))
+
+            headers = [binsync.data.FunctionHeader(f"sub_{i:x}", 0x400000 + i * 0x10) for i in range(50)]
+            with client.transaction() as state:
+                self.assertEqual(state.set_many(headers), 50)
+                # commits inside the transaction are deferred
+                client.commit_state()
+
+            self.assertEqual(len(list(client.repo.iter_commits())), commits_before + 1)
+            change_times = {func.last_change for func in state.functions.values()}
+            self.assertEqual(len(change_times), 1)
+
+            # a failed transaction rolls back and commits nothing
+            head = client.repo.head.commit.hexsha
+            with self.assertRaises(ValueError):
+                with client.transaction() as state:
+                    state.set_function_header(binsync.data.FunctionHeader("renamed", 0x400000))
+                    raise ValueError()
+
+            self.assertEqual(state.functions[0x400000].name, "sub_0")
+            self.assertEqual(client.repo.head.commit.hexsha, head)
+            self.assertFalse(client.in_transaction)
+            client.close()
+
+    def test_client_merge_from(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            def set_header(user, name, addr):
+                client = binsync.Client(user, tmpdir, "fake_hash", init_repo=not os.path.isdir(os.path.join(tmpdir, ".git")))
+                client.get_state().set_function_header(binsync.data.FunctionHeader(name, addr))
+                client.commit_state()
+                client.close()
+                client.repo_lock.release()
+                client.repo_lock = None
+
+            set_header("user0", "main", 0x400000)
+            set_header("user1", "other_main", 0x400000)
+            set_header("user1", "parse", 0x400100)
+
+            client = binsync.Client("user0", tmpdir, "fake_hash")
+            merge = client.merge_from("user1")
+            state = client.get_state()
+            # the new function is merged, the one both users named is a conflict and keeps our name
+            self.assertEqual(state.functions[0x400100].name, "parse")
+            self.assertEqual(state.functions[0x400000].name, "main")
+            self.assertEqual([(c.key, c.theirs.name) for c in merge.conflicts], [(0x400000, "other_main")])
+
+            merge = client.merge_from("user1", prefer=binsync.merge.Merge.OURS)
+            self.assertEqual(len(merge.conflicts), 1)
+            self.assertEqual(len(client.repo.head.commit.parents), 2)
+            client.close()
+            client.repo_lock.release()
+            client.repo_lock = None
+
+            # after the merge commit, only what user1 changes next is merged and nothing conflicts
+            set_header("user1", "parse_args", 0x400100)
+            client = binsync.Client("user0", tmpdir, "fake_hash")
+            merge = client.merge_from("user1")
+            self.assertFalse(merge.has_conflicts)
+            state = client.get_state()
+            self.assertEqual(state.functions[0x400100].name, "parse_args")
+            self.assertEqual(state.functions[0x400000].name, "main")
+            client.close()
+
+    def test_client_state_history(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user0", tmpdir, "fake_hash", init_repo=True)
+            state = client.get_state()
+            for i, name in enumerate(("first", "second", "third")):
+                state.set_function_header(binsync.data.FunctionHeader(name, 0x400000))
+                state.set_comment(binsync.data.Comment(0x400100 + i, name))
+                if i > 0:
+                    state.set_function_header(binsync.data.FunctionHeader(name, 0x401000 + i))
+                    state.set_struct(binsync.data.Struct(f"{name}_struct", 8, []), None)
+                client.commit_state()
+
+            latest = client.get_state_at()
+            self.assertTrue(latest.readonly)
+            self.assertEqual(latest.functions[0x400000].name, "third")
+
+            # older states are derived from the cached ones
+            past = client.get_state_at(changes_ago=1)
+            self.assertEqual(past.functions[0x400000].name, "second")
+            self.assertEqual(set(past.comments), {0x400100, 0x400101})
+            self.assertIs(client.get_state_at(commit=client.find_commit(changes_ago=1).hexsha), past)
+            past = client.get_state_at(changes_ago=2)
+            self.assertEqual(past.functions[0x400000].name, "first")
+            self.assertIs(client.get_state_at(timestamp=time.time()), latest)
+            with self.assertRaises(ValueError):
+                client.get_state_at(timestamp=0)
+            self.assertIsNone(client.get_state_at(changes_ago=3))
+
+            client.rollback(changes_ago=2)
+            self.assertEqual(state.functions[0x400000].name, "first")
+            self.assertEqual(set(state.comments), {0x400100})
+
+            # what the rollback removed is gone from the committed tree too
+            committed = binsync.State.parse(client.get_tree(user="user0"))
+            self.assertEqual(set(committed.functions), {0x400000})
+            self.assertEqual(set(committed.structs), set())
+            self.assertEqual(set(committed.comments), {0x400100})
+            client.close()
+
+    def test_client_concurrent_commits(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user0", tmpdir, "fake_hash", init_repo=True)
+            state = client.get_state()
+            state.set_function_header(binsync.data.FunctionHeader("start", 0x400000))
+            client.commit_state()
+
+            def write():
+                for i in range(20):
+                    with client.transaction(msg=f"Change {i}") as tx_state:
+                        for j in range(10):
+                            tx_state.set_function_header(binsync.data.FunctionHeader(f"f{i}_{j}", 0x400000 + j))
+
+            # the git thread commits and historical reads run while transactions change the state
+            writer = threading.Thread(target=write)
+            writer.start()
+            while writer.is_alive():
+                client.update()
+                client.get_state_at(changes_ago=1)
+            writer.join()
+            client.update()
+
+            committed = binsync.State.parse(client.get_tree(user="user0"))
+            self.assertEqual(committed, state)
+            self.assertEqual(committed.functions[0x400009].name, "f19_9")
+            client.close()
+
+    def test_client_remote_push(self):
+        with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryDirectory() as remote_dir:
+            remote = git.Repo.init(remote_dir, bare=True)
+            client = binsync.Client("user0", tmpdir, "fake_hash", init_repo=True)
+            client.add_remote("origin", remote_dir)
+            client.push()
+            pushed = remote.heads["binsync/user0"].commit
+
+            # commits are left for the next update to push
+            client.get_state().set_function_header(binsync.data.FunctionHeader("main", 0x400000))
+            client.commit_state()
+            self.assertEqual(remote.heads["binsync/user0"].commit, pushed)
+
+            client.update()
+            self.assertEqual(remote.heads["binsync/user0"].commit, client.get_commit("user0"))
+            self.assertEqual(client.repo.active_branch.name, "binsync/user0")
+            client.close()
+
+    def test_client_artifact_history(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user0", tmpdir, "fake_hash", init_repo=True)
+            state = client.get_state()
+            for name in ("first", "second"):
+                state.set_function_header(binsync.data.FunctionHeader(name, 0x400000))
+                state.set_comment(binsync.data.Comment(0x500000, name))
+                client.commit_state()
+
+            # queries only read the index, which is extended by updates
+            self.assertEqual(client.artifact_history(binsync.ArtifactGroupType.FUNCTION, 0x400000), [])
+            self.assertEqual(client.update_history(), 4)
+            history = client.artifact_history(binsync.ArtifactGroupType.FUNCTION, 0x400000)
+            self.assertEqual([(e.user, e.summary) for e in history], [("user0", "first"), ("user0", "second")])
+            self.assertEqual(len(client.artifact_history(binsync.ArtifactGroupType.COMMENT, 0x500000)), 2)
+
+            # the index is persisted and only extended with new commits
+            state.set_function_header(binsync.data.FunctionHeader("third", 0x400000))
+            client.commit_state()
+            reloaded = binsync.history.ArtifactHistory(client.history.path)
+            self.assertEqual(reloaded.change_count(binsync.ArtifactGroupType.FUNCTION, 0x400000), 2)
+            self.assertEqual(client.update_history(), 1)
+            self.assertEqual(client.history.last_change(binsync.ArtifactGroupType.FUNCTION, 0x400000).summary, "third")
+
+            # updates are appended to the index file, and compacted into one segment once there are too many
+            with open(client.history.path) as fp:
+                self.assertEqual(len(fp.readlines()), 3)
+            reloaded = binsync.history.ArtifactHistory(client.history.path)
+            self.assertEqual(reloaded.change_count(binsync.ArtifactGroupType.FUNCTION, 0x400000), 3)
+            client.history.COMPACT_SEGMENTS = 2
+            state.set_function_header(binsync.data.FunctionHeader("fourth", 0x400000))
+            client.commit_state()
+            self.assertEqual(client.update_history(), 1)
+            with open(client.history.path) as fp:
+                self.assertEqual(len(fp.readlines()), 2)
+            reloaded = binsync.history.ArtifactHistory(client.history.path)
+            self.assertEqual(
+                [e.summary for e in reloaded.history(binsync.ArtifactGroupType.FUNCTION, 0x400000)],
+                ["first", "second", "third", "fourth"]
+            )
+            self.assertEqual(reloaded.indexed_commit("user0"), client.get_commit("user0").hexsha)
+            client.close()
+
+    def test_client_caches_user_states(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user1", tmpdir, "fake_hash", init_repo=True)
+            client.get_state().set_function_header(binsync.data.FunctionHeader("main", 0x400000))
+            client.commit_state()
+            client.close()
+            client.repo_lock.release()
+            client.repo_lock = None
+
+            client = binsync.Client("user0", tmpdir, "fake_hash")
+            state = client.get_state(user="user1")
+            self.assertTrue(state.readonly)
+            self.assertEqual(state.functions[0x400000].name, "main")
+            # the branch did not move, so the same state is reused
+            self.assertIs(client.get_state(user="user1"), state)
+            client.close()
+
+    def test_client_metrics(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            metrics_path = os.path.join(tmpdir, "binsync.prom")
+            client = binsync.Client("user0", os.path.join(tmpdir, "repo"), "fake_hash", init_repo=True,
+                                    metrics_path=metrics_path)
+            commits = binsync.metrics.REGISTRY.counter("binsync_commits_total").value
+            client.get_state().set_function_header(binsync.data.FunctionHeader("main", 0x400000))
+            client.commit_state()
+            client.update()
+
+            metrics = client.status()["metrics"]
+            self.assertEqual(metrics["binsync_commits_total"], commits + 1)
+            self.assertGreater(metrics["binsync_dump_seconds"]["count"], 0)
+            self.assertGreater(metrics["binsync_bytes_written_total"], 0)
+
+            with open(metrics_path) as fp:
+                text = fp.read()
+            self.assertIn("# TYPE binsync_commit_seconds histogram", text)
+            self.assertIn('binsync_commit_seconds_bucket{le="+Inf"}', text)
+            client.close()
+
 
 if __name__ == "__main__":
     unittest.main(argv=sys.argv)
@@ -0,0 +1,219 @@
+import io
+import json
+import sys
+import tempfile
+import threading
+import time
+
+import unittest
+
+import binsync
+from binsync.common.controller import init_checker, make_state
+from binsync.common.headless import HeadlessController
+
+
+class FuncFirstController(HeadlessController):
+    """
+    Pushes comments with their function first, like the IDA controller.
+    """
+
+    CMD_KEY_ARGS = dict(HeadlessController.CMD_KEY_ARGS, push_comment=(1,))
+
+    @init_checker
+    @make_state
+    def push_comment(self, func_addr, addr, comment, decompiled=False, user=None, state=None):
+        return state.set_comment(binsync.data.Comment(addr, comment, decompiled=decompiled, func_addr=func_addr))
+
+
+class TestHeadless(unittest.TestCase):
+    def test_headless_import_dump(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            controller = HeadlessController(binary_hash="fake_hash")
+            controller.connect("user0", tmpdir, init_repo=True)
+            commits_before = len(list(controller.client.repo.iter_commits()))
+
+            records = [{"type": "function", "addr": hex(0x400000 + i * 0x10), "name": f"sub_{i}"} for i in range(100)]
+            records.append({"type": "comment", "addr": "0x400004", "comment": "seeded", "func_addr": "0x400000"})
+            self.assertEqual(controller.import_json(io.StringIO(json.dumps(records))), 101)
+            # the whole import is a single commit
+            self.assertEqual(len(list(controller.client.repo.iter_commits())), commits_before + 1)
+
+            out = io.StringIO()
+            self.assertEqual(controller.dump_jsonl(out), 101)
+
+            # dumps can be imported back as they are
+            state = controller.client.get_state()
+            state.set_function_header(binsync.data.FunctionHeader("renamed", 0x400000))
+            out.seek(0)
+            self.assertEqual(controller.import_json(out), 1)
+            self.assertEqual(state.functions[0x400000].name, "sub_0")
+
+            stats = controller.stats()
+            self.assertEqual(stats["users"]["user0"]["functions"], 100)
+            self.assertEqual(stats["users"]["user0"]["comments"], 1)
+            controller.client.close()
+
+    def test_headless_import_function_comment(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            controller = HeadlessController(binary_hash="fake_hash")
+            controller.connect("user0", tmpdir, init_repo=True)
+
+            # the comment example of the import_json docstring, on a fresh state
+            record = {"type": "comment", "addr": "0x401000", "comment": "entry point", "func_addr": "0x401000"}
+            self.assertEqual(controller.import_json(io.StringIO(json.dumps(record))), 1)
+            self.assertEqual(controller.client.get_state().get_comment(0x401000).comment, "entry point")
+            controller.client.close()
+
+    def test_headless_cmd_queue_keys(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            controller = FuncFirstController(binary_hash="fake_hash")
+            controller.connect("user0", tmpdir, init_repo=True)
+
+            controller.make_controller_cmd(controller.push_function_header, 0x400000, "first")
+            controller.make_controller_cmd(controller.push_function_header, 0x400000, "second")
+            controller.make_controller_cmd(
+                controller.push_stack_variable, 0x400000, 0x8, "v0", "int", 4
+            )
+            controller.make_controller_cmd(controller.push_struct, binsync.data.Struct("s0", 8, []), None)
+            controller.make_controller_cmd(controller.push_comment, 0x400000, 0x400004, "one")
+            controller.make_controller_cmd(controller.push_comment, 0x400000, 0x400008, "two")
+            self.assertEqual(controller.queue_stats()["coalesced"], 1)
+            self.assertEqual(controller._eval_cmd_queue(), 5)
+            self.assertEqual(controller.queue_stats()["failed"], 0)
+
+            state = controller.client.get_state()
+            self.assertEqual(state.functions[0x400000].name, "second")
+            self.assertEqual(state.functions[0x400000].stack_vars[0x8].name, "v0")
+            self.assertIn("s0", state.structs)
+            self.assertEqual({addr: cmt.comment for addr, cmt in state.comments.items()},
+                             {0x400004: "one", 0x400008: "two"})
+
+            # deletions of different structs are all kept
+            controller.make_controller_cmd(controller.push_struct, binsync.data.Struct("s1", 8, []), None)
+            self.assertEqual(controller._eval_cmd_queue(), 1)
+            controller.make_controller_cmd(controller.push_struct, binsync.data.Struct(None, None, None), "s0")
+            controller.make_controller_cmd(controller.push_struct, binsync.data.Struct(None, None, None), "s1")
+            self.assertEqual(controller.queue_stats()["depth"], 2)
+            self.assertEqual(controller._eval_cmd_queue(), 2)
+            self.assertNotIn("s0", state.structs)
+            self.assertNotIn("s1", state.structs)
+            controller.client.close()
+
+    def test_headless_worker_survives_commit_errors(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            controller = HeadlessController(binary_hash="fake_hash")
+            controller.connect("user0", tmpdir, init_repo=True, start_threads=True)
+            commit_state = controller.client.commit_state
+            failed = threading.Event()
+
+            def failing_commit(*args, **kwargs):
+                # only the commit at the end of the drain's transaction fails
+                if controller.client.in_transaction:
+                    return commit_state(*args, **kwargs)
+                failed.set()
+                raise RuntimeError("commit failed")
+
+            controller.client.commit_state = failing_commit
+            controller.make_controller_cmd(controller.push_function_header, 0x400000, "first")
+            self.assertTrue(failed.wait(timeout=10))
+
+            # the worker keeps running the commands queued after the failure
+            controller.client.commit_state = commit_state
+            controller.make_controller_cmd(controller.push_function_header, 0x400010, "second")
+            deadline = time.time() + 10
+            while controller.queue_stats()["drained"] < 1 and time.time() < deadline:
+                time.sleep(0.05)
+
+            self.assertTrue(controller.updater_thread.is_alive())
+            self.assertEqual(controller.client.get_state().functions[0x400010].name, "second")
+            controller.shutdown()
+            controller.client.close()
+
+    def test_headless_sync_all_main_thread(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user1", tmpdir, "fake_hash", init_repo=True)
+            state = client.get_state()
+            for i in range(40):
+                state.set_function_header(binsync.data.FunctionHeader(f"user1_{i}", 0x400000 + i * 0x10))
+            client.commit_state()
+            client.close()
+            client.repo_lock.release()
+            client.repo_lock = None
+
+            main_threads = []
+
+            class RecordingController(HeadlessController):
+                def run_in_main_thread(self, func, *args, **kwargs):
+                    main_threads.append(threading.current_thread())
+                    return func(*args, **kwargs)
+
+            controller = RecordingController(binary_hash="fake_hash")
+            controller.connect("user0", tmpdir)
+            user1_state = controller.client.get_state(user="user1")
+            last_changes = {addr: func.last_change for addr, func in user1_state.functions.items()}
+            commits_before = len(list(controller.client.repo.iter_commits()))
+            controller.SYNC_YIELD_INTERVAL = 0
+            task = controller.sync_all(user="user1")
+            self.assertTrue(task.wait(timeout=30))
+
+            # one commit per chunk, and the other user's cached state is left as it was
+            self.assertEqual(len(list(controller.client.repo.iter_commits())), commits_before + len(main_threads))
+            self.assertEqual({addr: func.last_change for addr, func in user1_state.functions.items()}, last_changes)
+
+            # every chunk is filled through the main thread hook
+            self.assertEqual(len(main_threads), -(-40 // controller.SYNC_CHUNK_SIZE))
+            self.assertNotIn(threading.main_thread(), main_threads)
+            self.assertEqual(task.done, 40)
+            self.assertTrue(all(task.results.values()))
+            self.assertEqual(controller.client.get_state().functions[0x400000].name, "user1_0")
+            controller.client.close()
+
+    def test_headless_context_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user1", tmpdir, "fake_hash", init_repo=True)
+            client.get_state().set_function_header(binsync.data.FunctionHeader("user1_func", 0x400000))
+            client.commit_state()
+            client.close()
+            client.repo_lock.release()
+            client.repo_lock = None
+
+            controller = HeadlessController(binary_hash="fake_hash")
+            controller.connect("user0", tmpdir)
+            controller.client.get_state().set_function_header(binsync.data.FunctionHeader("user0_func", 0x400000))
+            controller.client.commit_state()
+            controller._invalidate_moved_users()
+
+            views = controller.function_views(0x400000)
+            self.assertEqual({user: view.function.name for user, view in views.items()},
+                             {"user0": "user0_func", "user1": "user1_func"})
+
+            # no branch moved, so the cache stays warm
+            controller._invalidate_moved_users()
+            self.assertIs(controller.function_views(0x400000), views)
+
+            # only the user whose branch moved is reloaded
+            controller.client.get_state().set_function_header(binsync.data.FunctionHeader("renamed", 0x400000))
+            controller.client.commit_state()
+            controller._invalidate_moved_users()
+            self.assertEqual(controller._ctx_stale[0x400000], {"user0"})
+            self.assertIs(controller._ctx_cache[0x400000]["user1"], views["user1"])
+            views = controller.function_views(0x400000)
+            self.assertEqual(views["user0"].function.name, "renamed")
+            self.assertNotIn(0x400000, controller._ctx_stale)
+
+            # views of the local state are read from a snapshot, later changes do not reach them
+            controller.client.get_state().set_stack_variable(
+                binsync.data.StackVariable(0x8, 0, "v0", "int", 4, 0x400000), 0x8, 0x400000
+            )
+            self.assertEqual(len(views["user0"].function.stack_vars), 0)
+
+            # loads started before an invalidation are not cached
+            generation = controller._ctx_generation
+            controller.invalidate_context_cache()
+            controller._load_function_views(0x400000, generation=generation)
+            self.assertNotIn(0x400000, controller._ctx_cache)
+            controller.client.close()
+
+
+if __name__ == "__main__":
+    unittest.main(argv=sys.argv)
@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+
+import unittest
+
+from binsync.profiling import Profiler
+
+
+class TestProfiling(unittest.TestCase):
+    def test_profiler(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            profiler = Profiler(max_profiles=2, slow_threshold=60)
+            with profiler.profile("disabled"):
+                pass
+            self.assertEqual(os.listdir(tmpdir), [])
+
+            profiler.enable(tmpdir)
+            with profiler.profile("outer"):
+                # nested calls are part of the outer profile
+                with profiler.profile("inner"):
+                    sum(range(1000))
+            profiles = os.listdir(tmpdir)
+            self.assertEqual(len(profiles), 1)
+            self.assertIn("_outer_", profiles[0])
+
+            profiler.slow_threshold = 0
+            for _ in range(3):
+                with profiler.profile("cycle"):
+                    pass
+            # only the newest profiles are kept
+            profiles = os.listdir(tmpdir)
+            self.assertEqual(len(profiles), 2)
+            self.assertTrue(all(p.endswith("_slow.prof") for p in profiles))
+            self.assertEqual(len(profiler.slow_cycles), 3)
+
+
+if __name__ == "__main__":
+    unittest.main(argv=sys.argv)
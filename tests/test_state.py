@@ -1,9 +1,12 @@
+import copy
 import tempfile
 import os
 import sys
 
 import unittest
 
+import toml
+
 import binsync
 
 
@@ -70,6 +73,380 @@ class TestState(unittest.TestCase):
         self.assertEqual(state.last_push_artifact, "some_struct")
         self.assertEqual(state.last_push_artifact_type, binsync.state.ArtifactGroupType.STRUCT)
 
+    def test_state_interned_strings(self):
+        table = binsync.data.STRING_TABLE
+        hits_before = table.hits
+
+        func = binsync.data.Function(0x400080, header=binsync.data.FunctionHeader("some_name", 0x400080))
+        func.stack_vars[0x10] = binsync.data.StackVariable(0x10, 0, "v1", "unsigned int", 4, 0x400080)
+        func.stack_vars[0x18] = binsync.data.StackVariable(0x18, 0, "v2", "unsigned int", 4, 0x400080)
+        func_toml = toml.loads(func.dump())
+
+        loaded_a = binsync.data.Function.load(func_toml)
+        loaded_b = binsync.data.Function.load(func_toml)
+
+        # every loaded copy of a type string is the same object
+        self.assertIs(loaded_a.stack_vars[0x10].type, loaded_a.stack_vars[0x18].type)
+        self.assertIs(loaded_a.stack_vars[0x10].type, loaded_b.stack_vars[0x10].type)
+        self.assertIs(loaded_a.name, loaded_b.name)
+        self.assertGreater(table.hits, hits_before)
+        self.assertGreater(table.stats()["hit_rate"], 0)
+
+        # the table only keeps the most recently used strings
+        small_table = binsync.data.StringTable(max_size=2)
+        first = small_table.intern("".join(["first", "_type"]))
+        small_table.intern("second_type")
+        self.assertIs(small_table.intern("".join(["first", "_type"])), first)
+        small_table.intern("third_type")
+        self.assertEqual(len(small_table), 2)
+        self.assertNotIn("second_type", small_table)
+        self.assertIn("first_type", small_table)
+        self.assertEqual(small_table.stats()["evictions"], 1)
+
+    def test_state_canonical_dump(self):
+        func_a = binsync.data.Function(0x400080, header=binsync.data.FunctionHeader("some_name", 0x400080))
+        func_b = binsync.data.Function(0x400080, header=binsync.data.FunctionHeader("some_name", 0x400080))
+        sv1 = binsync.data.StackVariable(0x8, 0, "v1", "int", 4, 0x400080)
+        sv2 = binsync.data.StackVariable(0x10, 0, "v2", "char *", 8, 0x400080)
+
+        # same content, different insertion order and change times
+        func_a.stack_vars[0x8], func_a.stack_vars[0x10] = sv1, sv2
+        func_b.stack_vars[0x10], func_b.stack_vars[0x8] = sv2, sv1
+        func_b.last_change = 1234
+        self.assertEqual(func_a.content_hash(), func_b.content_hash())
+        func_b.last_change = None
+        self.assertEqual(func_a.dump(), func_b.dump())
+
+        func_b.name = "other_name"
+        self.assertNotEqual(func_a.content_hash(), func_b.content_hash())
+
+        # patches survive a round trip through their canonical form
+        patch = binsync.data.Patch(0x400100, b"\x90\x90", obj_name="fauxware")
+        loaded_patch = binsync.data.Patch.load(toml.loads(patch.dump()))
+        self.assertEqual(patch, loaded_patch)
+
+    def test_state_content_hash(self):
+        state_a = binsync.State("user0")
+        state_b = binsync.State("user1")
+        state_a.set_function_header(binsync.data.FunctionHeader("some_name", 0x400080))
+        state_b.set_function_header(binsync.data.FunctionHeader("some_name", 0x400080), set_last_change=False)
+        self.assertEqual(state_a.content_hash(), state_b.content_hash())
+
+        # setting identical data is not a change
+        last_change = state_a.functions[0x400080].last_change
+        state_a.functions[0x400080].last_change = 1
+        self.assertFalse(state_a.set_function_header(binsync.data.FunctionHeader("some_name", 0x400080)))
+        self.assertEqual(state_a.functions[0x400080].last_change, 1)
+        self.assertNotEqual(last_change, None)
+
+    def test_state_content_hash_updates(self):
+        def full_hash(state):
+            fresh = state.snapshot()
+            fresh._content = None
+            return fresh.content_hash()
+
+        state = binsync.State("user0")
+        empty_hash = state.content_hash()
+        state.set_function_header(binsync.data.FunctionHeader("some_name", 0x400080))
+        state.set_stack_variable(binsync.data.StackVariable(0x8, 0, "v1", "int", 4, 0x400080), 0x8, 0x400080)
+        state.set_comment(binsync.data.Comment(0x400084, "a comment", func_addr=0x400080))
+        state.set_comment(binsync.data.Comment(0x400080, "a function comment", func_addr=0x400080))
+        state.set_struct(binsync.data.Struct("some_struct", 8, []), None)
+        state.set_struct(binsync.data.Struct("renamed_struct", 8, []), "some_struct")
+        self.assertEqual(state.content_hash(), full_hash(state))
+
+        # changes to snapshots and rolled back batches are not part of the hash
+        snap_hash = state.content_hash()
+        snap = state.snapshot()
+        state.remove_stack_variable(0x8, 0x400080)
+        state.remove_comment(0x400084)
+        self.assertEqual(state.content_hash(), full_hash(state))
+        self.assertEqual(snap.content_hash(), snap_hash)
+        with self.assertRaises(ValueError):
+            with state.batch():
+                state.remove_artifact(binsync.ArtifactGroupType.FUNCTION, 0x400080)
+                raise ValueError()
+        self.assertEqual(state.content_hash(), full_hash(state))
+
+        state.copy_state(snap)
+        self.assertEqual(state.content_hash(), snap_hash)
+        state.remove_artifact(binsync.ArtifactGroupType.FUNCTION, 0x400080)
+        state.remove_artifact(binsync.ArtifactGroupType.STRUCT, "renamed_struct")
+        state.remove_comment(0x400084)
+        self.assertEqual(state.content_hash(), empty_hash)
+
+    def test_state_copy_cached_hashes(self):
+        state, other = binsync.State("user0"), binsync.State("user1")
+        for i in range(10):
+            state.set_function_header(binsync.data.FunctionHeader(f"func_{i}", 0x400000 + i * 0x10))
+            other.set_function_header(binsync.data.FunctionHeader(f"func_{i}", 0x400000 + i * 0x10))
+        other.set_function_header(binsync.data.FunctionHeader("renamed", 0x400000))
+        other.remove_artifact(binsync.ArtifactGroupType.FUNCTION, 0x400010)
+
+        # a read-only snapshot is left untouched
+        snap = state.snapshot()
+        with self.assertRaises(RuntimeError):
+            snap.copy_state(other)
+        self.assertEqual(len(snap.journal), len(state.journal))
+
+        # artifacts both states already hashed are not hashed again
+        hashed = []
+        content_hash = binsync.data.Function.content_hash
+        binsync.data.Function.content_hash = lambda func: hashed.append(func.addr) or content_hash(func)
+        try:
+            state.copy_state(other)
+        finally:
+            binsync.data.Function.content_hash = content_hash
+        self.assertEqual(hashed, [])
+        self.assertEqual(state.functions[0x400000].name, "renamed")
+        self.assertEqual(state.content_hash(), other.content_hash())
+
+    def test_state_batch_rollback(self):
+        state = binsync.State("user0")
+        for i in range(10):
+            state.set_function_header(binsync.data.FunctionHeader(f"func_{i}", 0x400000 + i * 0x10))
+        state.set_comment(binsync.data.Comment(0x400004, "in func_0", func_addr=0x400000))
+        state.set_comment(binsync.data.Comment(0x500000, "global"))
+        state.set_struct(binsync.data.Struct("some_struct", 8, []), None)
+
+        # a batch only copies what it changes
+        containers = (state.comments, state.patches, state.structs, state._recency, state.journal)
+        with state.batch():
+            state.set_function_header(binsync.data.FunctionHeader("renamed", 0x400000))
+        self.assertEqual(state.functions[0x400000].name, "renamed")
+        self.assertTrue(all(a is b for a, b in zip(containers, (
+            state.comments, state.patches, state.structs, state._recency, state.journal
+        ))))
+        state.set_function_header(binsync.data.FunctionHeader("func_0", 0x400000))
+        content_hash = state.content_hash()
+        journal_len = len(state.journal)
+        expected = (
+            {addr: func.copy() for addr, func in state.functions.items()},
+            {addr: copy.copy(cmt) for addr, cmt in state.comments.items()},
+            dict(state.structs), dict(state.patches),
+        )
+        func_comments = state.get_comments_in_function(0x400000)
+
+        with self.assertRaises(ValueError):
+            with state.batch():
+                state.set_function_header(binsync.data.FunctionHeader("renamed", 0x400000))
+                state.set_stack_variable(binsync.data.StackVariable(0x8, 0, "v1", "int", 4, 0x400010), 0x8, 0x400010)
+                state.set_function_header(binsync.data.FunctionHeader("new_func", 0x401000))
+                state.set_comment(binsync.data.Comment(0x400008, "new in func_0", func_addr=0x400000))
+                state.remove_comment(0x500000)
+                state.set_struct(binsync.data.Struct(None, None, None), "some_struct")
+                state.set_patch(binsync.data.Patch(0x600000, b"\x90"), 0x600000)
+                state.copy_state(binsync.State("user0"))
+                raise ValueError()
+
+        self.assertEqual(
+            (dict(state.functions), dict(state.comments), dict(state.structs), dict(state.patches)), expected
+        )
+        self.assertEqual(state.content_hash(), content_hash)
+        self.assertEqual(len(state.journal), journal_len)
+        self.assertEqual(state.get_comments_in_function(0x400000), func_comments)
+        self.assertNotIn(0x401000, [key for _, key, _ in state.recent()])
+
+    def test_state_comments_in_function(self):
+        state = binsync.State("user0")
+        state.set_function_header(binsync.data.FunctionHeader("func_a", 0x400080))
+        state.set_function_header(binsync.data.FunctionHeader("func_b", 0x400200))
+        state.set_comment(binsync.data.Comment(0x400084, "in a", func_addr=0x400080))
+        state.set_comment(binsync.data.Comment(0x400088, "also in a", func_addr=0x400080))
+        state.set_comment(binsync.data.Comment(0x400204, "in b", func_addr=0x400200))
+        state.set_comment(binsync.data.Comment(0x500000, "global"))
+
+        cmts = state.get_comments_in_function(0x400080)
+        self.assertEqual(set(cmts), {0x400080, 0x400084, 0x400088})
+
+        # moving a comment to another function updates both functions
+        state.set_comment(binsync.data.Comment(0x400088, "now in b", func_addr=0x400200))
+        self.assertNotIn(0x400088, state.get_comments_in_function(0x400080))
+        self.assertIn(0x400088, state.get_comments_in_function(0x400200))
+
+        self.assertTrue(state.remove_comment(0x400204))
+        self.assertEqual(set(state.get_comments_in_function(0x400200)), {0x400200, 0x400088})
+
+    def test_state_address_queries(self):
+        state = binsync.State("user0")
+        for addr in (0x400300, 0x400080, 0x400200):
+            state.set_function_header(binsync.data.FunctionHeader(f"sub_{addr:x}", addr))
+        state.set_comment(binsync.data.Comment(0x400210, "in 0x400200", func_addr=0x400200))
+        state.set_patch(binsync.data.Patch(0x400090, b"\x90"), 0x400090)
+
+        funcs = list(state.get_artifacts_in_range(binsync.state.ArtifactGroupType.FUNCTION, 0x400080, 0x400300))
+        self.assertEqual([f.addr for f in funcs], [0x400080, 0x400200])
+        patches = list(state.get_artifacts_in_range(binsync.state.ArtifactGroupType.PATCH, 0x400000, 0x500000))
+        self.assertEqual([p.offset for p in patches], [0x400090])
+
+        self.assertEqual(state.get_func_containing(0x400250).addr, 0x400200)
+        self.assertEqual(state.get_func_containing(0x400080).addr, 0x400080)
+        self.assertIsNone(state.get_func_containing(0x400000))
+        self.assertEqual(
+            state.get_nearest_artifact(binsync.state.ArtifactGroupType.COMMENT, 0x400300).addr, 0x400210
+        )
+
+    def test_state_recent_changes(self):
+        state = binsync.State("user0")
+        FUNCTION, STRUCT = binsync.state.ArtifactGroupType.FUNCTION, binsync.state.ArtifactGroupType.STRUCT
+
+        # pulled artifacts keep the change time of their author
+        other_state = binsync.State("user1")
+        for i, addr in enumerate((0x400080, 0x400100, 0x400180)):
+            header = binsync.data.FunctionHeader(f"sub_{addr:x}", addr)
+            other_state.functions[addr] = binsync.data.Function(addr, header=header, last_change=100 + i)
+        state.copy_state(other_state)
+        struct = binsync.data.Struct("some_struct", 8, [], last_change=150)
+        state.set_struct(struct, None, set_last_change=False)
+
+        self.assertEqual(state.get_last_push_for_artifact_type(FUNCTION), (0x400180, 102))
+        self.assertEqual(state.get_last_push_for_artifact_type(binsync.state.ArtifactGroupType.PATCH), (None, -1))
+        self.assertEqual(
+            state.recent(3),
+            [(STRUCT, "some_struct", 150), (FUNCTION, 0x400180, 102), (FUNCTION, 0x400100, 101)]
+        )
+        self.assertEqual(state.recent(since=102, artifact_type=FUNCTION), [(FUNCTION, 0x400180, 102)])
+
+        # a local change moves the function to the front
+        state.set_stack_variable(binsync.data.StackVariable(0x8, 0, "v", "int", 4, 0x400080), 0x8, 0x400080)
+        self.assertEqual(state.recent(1)[0][:2], (FUNCTION, 0x400080))
+
+    def test_state_journal_replay(self):
+        FUNCTION, STRUCT = binsync.state.ArtifactGroupType.FUNCTION, binsync.state.ArtifactGroupType.STRUCT
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user0", tmpdir, "fake_hash", init_repo=True)
+            state = client.get_state()
+            state.set_function_header(binsync.data.FunctionHeader("some_name", 0x400080))
+            client.commit_state()
+
+            # a reader copies the state once...
+            old_copy = state.snapshot(readonly=False)
+            seq = old_copy.journal.last_seq
+
+            # ...and the writer keeps going
+            state.set_function_header(binsync.data.FunctionHeader("new_name", 0x400080))
+            state.set_function_header(binsync.data.FunctionHeader("other_name", 0x400100))
+            state.set_comment(binsync.data.Comment(0x400084, "a comment", func_addr=0x400080))
+            state.set_struct(binsync.data.Struct("some_struct", 8, []), None)
+            state.set_struct(binsync.data.Struct("renamed_struct", 8, []), "some_struct")
+            client.commit_state()
+
+            # the journal is not part of the committed tree
+            self.assertNotIn("journal.toml", [blob.path for blob in client.get_tree("user0").traverse()])
+
+            self.assertTrue(state.journal.covers(seq))
+            entries = state.journal.since(seq)
+            self.assertEqual(entries[-2].op, binsync.journal.JournalOp.REMOVE)
+            self.assertEqual((entries[-2].artifact_type, entries[-2].key), (STRUCT, "some_struct"))
+            self.assertEqual(entries[0].artifact_type, FUNCTION)
+
+            self.assertEqual(old_copy.apply_journal(entries), len(entries))
+            self.assertEqual(old_copy, state)
+            self.assertIn(0x400084, old_copy.get_comments_in_function(0x400080))
+            self.assertEqual(old_copy.journal.last_seq, state.journal.last_seq)
+            # replayed functions are ordered by their changes too
+            self.assertEqual({key for _, key, _ in old_copy.recent(artifact_type=FUNCTION)}, {0x400080, 0x400100})
+
+            # replaying the same segment twice is a no-op
+            self.assertEqual(old_copy.apply_journal(entries), 0)
+            client.close()
+
+    def test_state_snapshot(self):
+        state = binsync.State("user0")
+        state.set_function_header(binsync.data.FunctionHeader("some_name", 0x400080))
+        state.set_stack_variable(binsync.data.StackVariable(0x8, 0, "v1", "int", 4, 0x400080), 0x8, 0x400080)
+        state.set_comment(binsync.data.Comment(0x400084, "a comment", func_addr=0x400080))
+
+        snap = state.snapshot()
+        self.assertTrue(snap.readonly)
+        self.assertIs(snap.functions, state.functions)
+
+        # writes after the snapshot never leak into it
+        state.set_function_header(binsync.data.FunctionHeader("new_name", 0x400080))
+        state.set_stack_variable(binsync.data.StackVariable(0x10, 0, "v2", "int", 4, 0x400080), 0x10, 0x400080)
+        state.set_comment(binsync.data.Comment(0x400088, "another comment", func_addr=0x400080))
+        self.assertEqual(snap.functions[0x400080].name, "some_name")
+        self.assertEqual(list(snap.functions[0x400080].stack_vars), [0x8])
+        self.assertEqual(set(snap.get_comments_in_function(0x400080)), {0x400080, 0x400084})
+        self.assertEqual(state.functions[0x400080].name, "new_name")
+        self.assertEqual(len(snap.journal), 3)
+
+        with self.assertRaises(RuntimeError):
+            snap.set_function_header(binsync.data.FunctionHeader("bad_name", 0x400080))
+
+        # copied states do not share mutations either
+        copied = binsync.State("user1")
+        copied.copy_state(state)
+        copied.set_function_header(binsync.data.FunctionHeader("copied_name", 0x400080))
+        self.assertEqual(state.functions[0x400080].name, "new_name")
+        state.set_stack_variable(binsync.data.StackVariable(0x18, 0, "v3", "int", 4, 0x400080), 0x18, 0x400080)
+        self.assertNotIn(0x18, copied.functions[0x400080].stack_vars)
+
+    def test_state_snapshot_header_comment(self):
+        other = binsync.State("user1")
+        other.set_function_header(binsync.data.FunctionHeader("user1_name", 0x400080, comment="theirs"))
+        other_snap = other.snapshot()
+
+        # headers synced from another user's snapshot are not shared with it
+        state = binsync.State("user0")
+        state.set_many([other_snap.functions[0x400080]], set_last_change=False)
+        snap = state.snapshot()
+        state.set_comment(binsync.data.Comment(0x400080, "mine", func_addr=0x400080))
+        self.assertEqual(state.functions[0x400080].header.comment, "mine")
+        self.assertEqual(snap.functions[0x400080].header.comment, "theirs")
+        self.assertEqual(other_snap.functions[0x400080].header.comment, "theirs")
+
+        # function comments on functions without a header
+        state.set_stack_variable(binsync.data.StackVariable(0x8, 0, "v1", "int", 4, 0x400100), 0x8, 0x400100)
+        state.set_comment(binsync.data.Comment(0x400100, "no header", func_addr=0x400100))
+        self.assertEqual(state.get_comment(0x400100).comment, "no header")
+
+    def test_state_merge_function_comments(self):
+        states = []
+        for user, cmt in (("user0", "ours"), ("user1", "theirs")):
+            state = binsync.State(user)
+            state.set_function_header(binsync.data.FunctionHeader("main", 0x400080, comment="header comment"))
+            state.set_comment(binsync.data.Comment(0x400084, cmt, func_addr=0x400080))
+            states.append(state)
+
+        merge_state = binsync.merge.MergeState(states[0], states[1], 0x400080)
+        merge_state._gen_state_diff()
+        self.assertTrue(merge_state.conflicts)
+        self.assertEqual(list(merge_state.cmt_diff), [0x400084])
+        self.assertEqual(merge_state.cmt_diff[0x400084]["trgt"].comment, "theirs")
+
+    def test_state_diff(self):
+        state = binsync.State("user0")
+        state.set_function_header(binsync.data.FunctionHeader("func_a", 0x400080))
+        state.set_function_header(binsync.data.FunctionHeader("func_b", 0x400100))
+        state.set_comment(binsync.data.Comment(0x500000, "global comment"))
+        state.set_struct(binsync.data.Struct("some_struct", 8, []), None)
+
+        snap = state.snapshot()
+        self.assertFalse(state.diff(snap))
+
+        state.set_function_header(binsync.data.FunctionHeader("func_a_renamed", 0x400080))
+        state.set_function_header(binsync.data.FunctionHeader("func_c", 0x400200))
+        state.remove_comment(0x500000)
+
+        diff = snap.diff(state)
+        self.assertEqual(len(diff), 3)
+        self.assertEqual(set(diff.functions.changed), {0x400080})
+        self.assertEqual(set(diff.functions.added), {0x400200})
+        self.assertEqual(set(diff.comments.removed), {0x500000})
+        self.assertFalse(diff.structs)
+
+        # restricted diffs
+        diff = snap.diff(state, addr_range=(0x400000, 0x400100))
+        self.assertEqual(diff.functions.keys(), {0x400080})
+        self.assertFalse(diff.comments)
+        diff = snap.diff(state, artifact_types=binsync.ArtifactGroupType.COMMENT)
+        self.assertEqual(len(diff), 1)
+
+        self.assertTrue(state.compare_function(0x400100, snap))
+        self.assertFalse(state.compare_function(0x400080, snap))
+
 
 if __name__ == "__main__":
     unittest.main(argv=sys.argv)
@@ -0,0 +1,82 @@
+import os
+import sys
+
+import unittest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+try:
+    from PySide6.QtCore import QModelIndex, QPersistentModelIndex, QSortFilterProxyModel, Qt, qInstallMessageHandler
+    from PySide6.QtTest import QAbstractItemModelTester
+    from PySide6.QtWidgets import QApplication
+except ImportError:
+    QApplication = None
+
+if QApplication is not None:
+    from binsync.common.ui import set_ui_version
+    set_ui_version("PySide6")
+    from binsync.common.ui.tables.table_model import BinSyncTableModel, RowDiff, diff_rows
+
+    class KeyValueModel(BinSyncTableModel):
+        HEADER = ["Key", "Value"]
+
+
+@unittest.skipIf(QApplication is None, "PySide6 is not installed")
+class TestUITables(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QApplication.instance() or QApplication([])
+
+    def test_table_model_diffs(self):
+        model = KeyValueModel()
+        proxy = QSortFilterProxyModel()
+        proxy.setSourceModel(model)
+        proxy.setSortRole(Qt.UserRole)
+        proxy.setDynamicSortFilter(True)
+        proxy.sort(0)
+
+        warnings = []
+        previous_handler = qInstallMessageHandler(lambda mode, context, message: warnings.append(message))
+        self.addCleanup(qInstallMessageHandler, previous_handler)
+        testers = [
+            QAbstractItemModelTester(m, QAbstractItemModelTester.FailureReportingMode.Warning) for m in (model, proxy)
+        ]
+
+        # every signal is sent while the rows match the row count
+        inconsistent = []
+
+        def check_consistent(*args):
+            keys = [model.key(row) for row in range(model.rowCount())]
+            if len(set(keys)) != len(keys) or any(model.row_data(key) is None for key in keys):
+                inconsistent.append(keys)
+        for signal in (model.dataChanged, model.rowsInserted, model.rowsRemoved, model.rowsAboutToBeRemoved):
+            signal.connect(check_consistent)
+
+        rows = {i: (i, f"value_{i}") for i in range(10)}
+        model.apply_diff(diff_rows({}, rows))
+        selected = QPersistentModelIndex(model.index(model._positions[9], 0))
+        removed = QPersistentModelIndex(model.index(model._positions[2], 0))
+
+        new_rows = {i: row for i, row in rows.items() if i not in (2, 5)}
+        new_rows[3] = (3, "changed")
+        new_rows[10] = (10, "value_10")
+        self.assertTrue(model.apply_operations(diff_rows(rows, new_rows).operations(), chunk_size=2))
+        self.assertEqual(inconsistent, [])
+
+        self.assertEqual(model.rows, new_rows)
+        self.assertEqual(
+            [proxy.data(proxy.index(row, 1)) for row in range(proxy.rowCount())],
+            [new_rows[key][1] for key in sorted(new_rows)]
+        )
+        # indexes on removed rows are dropped instead of following the rows moved into their place
+        self.assertFalse(removed.isValid())
+        self.assertFalse(selected.isValid() and model.key(selected.row()) != 9)
+
+        model.apply_diff(RowDiff(removed=list(new_rows)))
+        self.assertEqual(model.rowCount(), 0)
+        self.maxDiff = None
+        self.assertEqual(sorted(set(warnings)), [])
+        del testers
+
+
+if __name__ == "__main__":
+    unittest.main(argv=sys.argv)